@@ -0,0 +1,337 @@
+"""Process-wide aggregates shared by every dashboard session.
+
+``bokeh serve`` re-executes ``dashboard.py`` for every browser session, but
+modules it imports are imported once per server process.  The
+``AggregateStore`` built here therefore holds everything that does not
+depend on a session — the scatter sample, the per-tab groupbys, the world
+shapefile — and the script itself only creates Bokeh models from it.
+The per-tab groupbys are roll-ups of a single ``PollutantCube`` built at the
+finest (Country, City, Year, Month) grain.
+
+Callbacks slice the roll-ups through ``RowIndex`` offset tables instead of
+scanning them with boolean masks.  Raw rows are only read by the scatter's
+density view, through ``store.raw`` (see ``raw_rows.py``).
+
+With ``AIR_QUALITY_CHUNK_ROWS`` set the store is built by
+``AggregateStore.from_chunks`` from the CSV read a chunk at a time, and no
+frame of all rows is ever held: the cube, the daily sums and the scatter
+sample are all folded chunk by chunk, the aggregates of ``MERGE_FAN_IN``
+chunks at a time.
+
+The store is built by ``on_server_loaded`` in ``server_lifecycle.py`` when
+the server starts, or lazily by the first session otherwise.  All frames in
+it are shared and must be treated as read-only.
+
+In live mode (see ``live_feed.py``) new rows are folded in with
+``AggregateStore.append``: it merges a cube of just the new rows into the
+existing one, recomputes only the roll-up groups those rows fall in, and
+replaces each derived table with a new object, so sessions reading the old
+one are never disturbed.  Sessions pick up the appended rows
+with ``batches_since`` and stream them to their plots.
+"""
+import collections
+import threading
+
+import numpy as np
+import pandas as pd
+
+from aqi import categorize_aqi
+from cube import PollutantCube
+from data_loader import (
+    CHUNK_ROWS, DATA_PATH, MEASURE_COLUMNS, MONTHS, POLLUTANT_COLUMNS,
+    concat_measurements, iter_measurement_chunks, load_air_quality_data,
+)
+from map_geometry import country_value_vectors, load_world_patches
+from parallel import map_partitions
+from raw_rows import FrameRows, open_raw_store
+from row_index import RowIndex
+
+
+SHAPEFILE_PATH = "ne_110m_admin_0_countries/ne_110m_admin_0_countries.shp"
+SCATTER_SAMPLE_SIZE = 5000
+BOX_COLUMNS = {'min': 'Lower', 'q25': 'Q1', 'q50': 'Median', 'q75': 'Q3', 'max': 'Upper'}
+LIVE_SCATTER_ROWS = 5000  # Most recent live rows kept alongside the scatter sample
+LIVE_BATCH_HISTORY = 256  # Appended batches kept for sessions to catch up on
+MERGE_FAN_IN = 8  # Chunk aggregates merged at a time by a chunked load
+
+_stores = {}
+_lock = threading.Lock()
+
+
+class AggregateStore:
+    """Session-independent data for every tab, computed once."""
+
+    def __init__(self, frame, shapefile_path=SHAPEFILE_PATH):
+        # Every tab's statistics roll up from one cube.  It and the daily
+        # sums are built per partition of years (in worker processes for
+        # large frames) and merged.
+        partial = _merge_partials(map_partitions(_partial_aggregates, frame))
+
+        # Scatter tab: sample data to reduce density
+        sample = frame.sample(n=min(SCATTER_SAMPLE_SIZE, len(frame)), random_state=42)
+        self._build(partial, sample, FrameRows(frame), len(frame), shapefile_path)
+
+    @classmethod
+    def from_chunks(cls, chunks, raw=None, shapefile_path=SHAPEFILE_PATH):
+        """Build the store from an iterable of frames, holding one at a time.
+
+        Each chunk is folded into the cube and the daily sums and then
+        dropped, so memory is bounded by the chunk size and the aggregates.
+        Raw rows are kept only in ``raw`` (e.g. ``raw_rows.ArrowRows``), if
+        given; without it the scatter's density mode is unavailable.
+        """
+        rng = np.random.default_rng(42)
+        levels, sample, sample_keys, row_count = [], None, None, 0
+        for chunk in chunks:
+            _add_partial(levels, _partial_aggregates(chunk))
+            # The scatter sample is the rows with the smallest random keys so
+            # far: a uniform sample of everything read, without replacement
+            keys = rng.random(len(chunk))
+            if sample is not None:
+                chunk_rows, chunk = chunk, concat_measurements(sample, chunk)
+                keys = np.concatenate([sample_keys, keys])
+            else:
+                chunk_rows = chunk
+            keep = np.sort(np.argsort(keys, kind='stable')[:SCATTER_SAMPLE_SIZE])
+            sample, sample_keys = chunk.take(keep).reset_index(drop=True), keys[keep]
+            if raw is not None:
+                raw = raw.append(chunk_rows)
+            row_count += len(chunk_rows)
+        if not levels:
+            raise ValueError("no measurements to aggregate")
+        partial = _merge_partials([part for level in levels for part in level])
+
+        store = cls.__new__(cls)
+        store._build(partial, sample, raw, row_count, shapefile_path)
+        return store
+
+    def _build(self, partial, sample, raw, row_count, shapefile_path):
+        self.raw = raw  # Raw rows for the density view, or None
+        self.row_count = row_count
+        self.version = 0
+        self.batches = collections.deque(maxlen=LIVE_BATCH_HISTORY)
+        self._append_lock = threading.Lock()
+
+        self.pm10_range = (sample['PM10'].min(), sample['PM10'].max())
+        self.scatter_sample_size = len(sample)
+        self.scatter_df = self._scatter_rows(sample)
+
+        self.cube, self.city_daily_sums, self.daily_sums = partial
+        self.map_patches = load_world_patches(shapefile_path)
+        self._build_rollups()
+        self._build_daily()
+        self._build_indexes()
+        self._build_cell_index()
+
+    def _scatter_rows(self, rows):
+        low, high = self.pm10_range
+        rows['PM10_Scaled'] = (rows['PM10'] - low) / (high - low) * 10 + 5
+        rows['AQI_Category'] = categorize_aqi(rows['AQI'])
+        return rows
+
+    def _build_rollups(self, cells=None):
+        # With ``cells`` (the cube cells new rows fell in) only the groups
+        # containing them are recomputed and replaced in each table.
+        def rebuilt(name, update, by):
+            if cells is None:
+                return update
+            return _replace_groups(getattr(self, name), update, by)
+
+        # Regional trends tab: yearly average AQI per country
+        regional_data = self.cube.means(['Country', 'Year'], ['AQI'], cells)
+        regional_data['Year'] = regional_data['Year'].astype(str)
+        self.regional_data = rebuilt('regional_data', regional_data, ['Country', 'Year'])
+
+        # Heatmap tab: pollutants by country, year and month
+        hm_data = self.cube.means(['Country', 'Year', 'MonthNum'], POLLUTANT_COLUMNS, cells)
+        hm_data.insert(2, 'Month', np.array(MONTHS, dtype=object)[hm_data['MonthNum'] - 1])
+        self.hm_data = rebuilt('hm_data', hm_data, ['Country', 'Year', 'MonthNum'])
+
+        # Map and grouped bar tabs: yearly averages per country.  The map
+        # draws static, pre-simplified outlines and swaps in the value
+        # vector of the selected (year, measure).
+        map_data = self.cube.means(['Country', 'Year'], MEASURE_COLUMNS, cells)
+        self.map_data = rebuilt('map_data', map_data, ['Country', 'Year'])
+        if cells is None:
+            self.map_values = country_value_vectors(self.map_data, self.map_patches['NAME'], MEASURE_COLUMNS)
+        else:
+            # Whole years are re-vectorised: countries without new rows keep their values
+            years = self.map_data[self.map_data['Year'].isin(map_data['Year'].unique())]
+            self.map_values = {**self.map_values, **country_value_vectors(years, self.map_patches['NAME'], MEASURE_COLUMNS)}
+
+        # Box plot tab: pollutant quartiles by city, year and month, one row
+        # per (City, Year, MonthNum, Pollutant)
+        self.box_data = rebuilt('box_data', self._box_data(cells), ['City', 'Year', 'MonthNum'])
+
+    def _build_daily(self):
+        # Time-series and stacked area tabs: daily means per city and
+        # overall, sorted by date so a visible range is a contiguous slice
+        city_daily = _means(self.city_daily_sums).reset_index()
+        city_daily['City'] = city_daily['City'].astype('category')
+        self.city_daily = city_daily
+        self.daily_means = _means(self.daily_sums)
+
+    def _build_indexes(self):
+        # Indexes for the widget callbacks.  Country-level callbacks read the
+        # cube roll-ups, so those are indexed rather than the raw rows.
+        self.city_daily_index = RowIndex(self.city_daily, ['City'])
+        self.scatter_index = RowIndex(self.scatter_df, ['Country', 'City'])
+        self.hm_index = RowIndex(self.hm_data, ['Year', 'MonthNum'])
+        self.map_index = RowIndex(self.map_data, ['Year', 'Country'])
+        self.box_index = RowIndex(self.box_data, ['City', 'Year', 'Pollutant'])
+
+    def _build_cell_index(self):
+        cells = self.cube.stats.index.to_frame(index=False)
+        self.cell_index = RowIndex(cells, ['Country', 'City'])
+        self.city_country = dict(zip(cells['City'].astype(str), cells['Country'].astype(str)))
+
+        # Widget options, which no longer need the raw rows
+        self.countries = sorted(str(country) for country in self.cell_index.labels())
+        self.cities = sorted(self.city_country)
+        self.years = sorted(cells['Year'].unique().tolist())
+
+    def append(self, rows):
+        """Fold newly arrived measurement ``rows`` into every aggregate.
+
+        ``rows`` must have the columns ``load_air_quality_data`` produces.
+        Only the cube cells the rows fall in are merged, only the roll-up
+        groups containing those cells are recomputed, and the rows' daily
+        sums are added to the stored ones; the rows are then recorded as a
+        batch for ``batches_since``.
+        """
+        if rows.empty:
+            return
+        with self._append_lock:
+            rows = rows.reset_index(drop=True)
+            new_cube = PollutantCube.from_frame(rows)
+            cell_count = len(self.cube.stats)
+            self.cube = self.cube.merge(new_cube)
+            self._build_rollups(new_cube.stats.index)
+
+            city_sums, date_sums = _daily_sums(rows)
+            self.city_daily_sums = _add_sums([self.city_daily_sums, city_sums])
+            self.daily_sums = _add_sums([self.daily_sums, date_sums])
+            self._build_daily()
+
+            # New rows are shown on the scatter next to the sample, up to a cap
+            live_rows = self._scatter_rows(rows.copy())
+            scatter_df = concat_measurements(self.scatter_df, live_rows)
+            if len(scatter_df) > self.scatter_sample_size + LIVE_SCATTER_ROWS:
+                scatter_df = pd.concat([scatter_df.iloc[:self.scatter_sample_size], scatter_df.iloc[-LIVE_SCATTER_ROWS:]])
+            self.scatter_df = scatter_df
+
+            if self.raw is not None:
+                self.raw = self.raw.append(rows)
+            self.row_count += len(rows)
+            self._build_indexes()
+            if len(self.cube.stats) != cell_count:
+                self._build_cell_index()  # New cities or years
+            self.batches.append((self.version + 1, live_rows))
+            self.version += 1
+
+    def batches_since(self, version):
+        """``(version reached, rows)``: the rows appended after ``version``, one frame per batch.
+
+        Both come from one snapshot of ``batches``, so a caller that keeps
+        the version reached neither misses a batch nor gets one twice while
+        ``append`` runs on another thread.  The rows are ``None`` when some
+        of the batches are no longer kept, in which case the caller should
+        redraw from the aggregates instead.
+        """
+        batches = list(self.batches)
+        if not batches or batches[-1][0] <= version:
+            return version, []
+        if batches[0][0] > version + 1:
+            return batches[-1][0], None
+        return batches[-1][0], [rows for batch_version, rows in batches if batch_version > version]
+
+    def _box_data(self, cells=None):
+        by = ['City', 'Year', 'MonthNum']
+        parts = []
+        for pollutant in POLLUTANT_COLUMNS:
+            summary = self.cube.quantile_summary(by, pollutant, cells=cells)
+            summary.insert(len(by), 'Pollutant', pollutant)
+            parts.append(summary)
+        box_data = pd.concat(parts, ignore_index=True)
+        box_data.insert(3, 'Month', np.array(MONTHS, dtype=object)[box_data['MonthNum'] - 1])
+        return box_data.rename(columns=BOX_COLUMNS)
+
+    def box_summary(self, pollutant, **where):
+        """Monthly quartiles of ``pollutant`` over any (Country, City, Year) selection.
+
+        ``where`` fixes cube keys, e.g. ``box_summary('PM2.5', Country='India')``
+        pools every Indian city and year.  The city/year grain is precomputed in
+        ``box_data``; coarser scopes merge the cell sketches on demand.
+        """
+        summary = self.cube.quantile_summary(['MonthNum'], pollutant, where=where)
+        summary.insert(1, 'Month', np.array(MONTHS, dtype=object)[summary['MonthNum'] - 1])
+        return summary.rename(columns=BOX_COLUMNS)
+
+
+def _daily_sums(frame):
+    """Pollutant sums and counts per (City, Date) and per Date.
+
+    Unlike means these add up across partitions, chunks and appends.
+    """
+    values = frame[POLLUTANT_COLUMNS].astype('float64')
+    city_sums = values.groupby([frame['City'], frame['Date']], observed=True, sort=True).agg(['sum', 'count'])
+    date_sums = values.groupby(frame['Date'], sort=True).agg(['sum', 'count'])
+    return city_sums, date_sums
+
+
+def _add_sums(tables):
+    total = tables[0]
+    for table in tables[1:]:
+        total = total.add(table, fill_value=0)
+    return total.sort_index()
+
+
+def _means(sums):
+    """Flat pollutant means from a ``_daily_sums`` table, on the same index."""
+    return pd.DataFrame(
+        {col: sums[(col, 'sum')] / sums[(col, 'count')].where(sums[(col, 'count')] > 0) for col in POLLUTANT_COLUMNS},
+        index=sums.index,
+    )
+
+
+def _partial_aggregates(frame):
+    """Cube and daily sums of one partition of rows (run in a worker)."""
+    return (PollutantCube.from_frame(frame),) + _daily_sums(frame)
+
+
+def _merge_partials(partials):
+    """Combine ``_partial_aggregates`` results of disjoint sets of rows."""
+    cubes, city_sums, date_sums = zip(*partials)
+    return PollutantCube.merge_all(cubes), _add_sums(city_sums), _add_sums(date_sums)
+
+
+def _add_partial(levels, partial, level=0):
+    """Add ``partial`` to ``levels[level]``; a full level is merged into one partial of the next.
+
+    Every merge combines ``MERGE_FAN_IN`` partials of similar size, so a
+    cell's sketch is re-clustered once per level rather than once per chunk.
+    """
+    if level == len(levels):
+        levels.append([])
+    levels[level].append(partial)
+    if len(levels[level]) == MERGE_FAN_IN:
+        merged, levels[level] = _merge_partials(levels[level]), []
+        _add_partial(levels, merged, level + 1)
+
+
+def _replace_groups(table, update, by):
+    """``table`` with the rows of every ``by`` group in ``update`` replaced by ``update``'s."""
+    stale = pd.MultiIndex.from_frame(table[by]).isin(pd.MultiIndex.from_frame(update[by]))
+    merged = concat_measurements(table[~stale], update)
+    return merged.sort_values(by, kind='stable', ignore_index=True)
+
+
+def get_store(path=DATA_PATH):
+    """Return the process-wide ``AggregateStore`` for ``path``, building it once."""
+    with _lock:
+        if path not in _stores:
+            if CHUNK_ROWS:
+                _stores[path] = AggregateStore.from_chunks(iter_measurement_chunks(path, CHUNK_ROWS), raw=open_raw_store())
+            else:
+                _stores[path] = AggregateStore(load_air_quality_data(path))
+        return _stores[path]
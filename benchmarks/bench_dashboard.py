@@ -0,0 +1,285 @@
+"""Benchmarks for building the dashboard and driving its widget callbacks.
+
+For every dataset size a ``synthetic_data`` ``expanded_air_quality_data.csv``
+is written to a scratch directory (and reused by later runs), then a fresh
+Python process, so peak memory and the process-wide caches start clean:
+
+* builds the aggregate store, as ``on_server_loaded`` would, and then the
+  Bokeh document headlessly, the way ``bokeh serve`` runs ``dashboard.py``
+  for each browser session;
+* selects every tab in turn, recording the time to build it on first
+  selection and the size of the patch that sends it to the browser;
+* drives each tab's widgets through a sweep of representative values,
+  twice: the second pass is served by the shared callback cache;
+* records the wall time of every change, the process's peak RSS so far and
+  the size of the PATCH-DOC message the change would send to the browser.
+
+Usage::
+
+    python benchmarks/bench_dashboard.py --rows 10k 1M --output bench.json
+    python benchmarks/bench_dashboard.py --rows 10k --compare bench.json
+
+``--compare`` prints every metric that is worse than the baseline by more
+than ``--tolerance`` and exits with status 1 if there is any.  For sizes
+that do not fit in memory pass ``--chunk-rows`` (``AIR_QUALITY_CHUNK_ROWS``).
+"""
+import argparse
+import contextlib
+import json
+import os
+import runpy
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_ROOT = os.path.join(tempfile.gettempdir(), 'air-quality-bench')
+DEFAULT_SIZES = ['10k']
+TIME_FLOOR_S = 0.002  # Timings below this are noise, whatever the ratio
+
+sys.path.insert(0, REPO_ROOT)
+from synthetic_data import parse_rows, write_dataset  # noqa: E402
+
+
+def dataset_dir(rows, seed):
+    """Scratch directory holding the CSV for ``rows`` and ``seed``, generated on first use."""
+    directory = os.path.join(DATA_ROOT, f'synthetic-{rows}-{seed}')
+    csv_path = os.path.join(directory, 'expanded_air_quality_data.csv')
+    if not os.path.exists(csv_path):
+        os.makedirs(directory, exist_ok=True)
+        start = time.perf_counter()
+        write_dataset(csv_path, rows, seed)
+        print(f"Generated {rows} rows in {time.perf_counter() - start:.1f}s: {csv_path}", file=sys.stderr)
+    shapefile_dir = os.path.join(directory, 'ne_110m_admin_0_countries')
+    if not os.path.exists(shapefile_dir):
+        os.symlink(os.path.join(REPO_ROOT, 'ne_110m_admin_0_countries'), shapefile_dir)
+    return directory
+
+
+# ---- Child process: one dataset, one document ----
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # bytes on macOS, KiB elsewhere
+
+
+def message_bytes(message):
+    return len(message.content_json) + sum(buffer.data.nbytes for buffer in message.buffers)
+
+
+def spread(values, count=4):
+    """Up to ``count`` values spread evenly over ``values``, first and last included."""
+    values = list(values)
+    if len(values) <= count:
+        return values
+    return [values[round(i * (len(values) - 1) / (count - 1))] for i in range(count)]
+
+
+def sweeps(widget):
+    """``(callback, widget name, attribute, values)`` for every swept widget.
+
+    ``widget(name)`` looks a widget up by its Bokeh ``name``.  Values are
+    taken from the widgets, so the sweeps follow the dataset.
+    """
+    def options(name, count=4):
+        return spread([o[0] if isinstance(o, tuple) else o for o in widget(name).options], count)
+
+    def slider(name):
+        return list(range(int(widget(name).start), int(widget(name).end) + 1))
+
+    cities = options('time_city_select', 3)
+    countries = options('grouped_bar_country_select', 6)
+    return [
+        ('update_scatter', 'country_select', 'value', options('country_select')),
+        ('update_plots', 'yr_dropdown', 'value', options('yr_dropdown')),
+        ('update_plots', 'pollutant_dropdown', 'value', options('pollutant_dropdown')),
+        ('update_plots', 'month_slider', 'value', list(range(1, 13))),
+        ('update_time_series', 'time_city_select', 'value', [cities[:i] for i in range(1, len(cities) + 1)]),
+        ('update_time_series', 'time_year_select', 'value', options('time_year_select')),
+        ('update_grouped_bar_chart', 'grouped_bar_country_select', 'value', [countries[:i] for i in (2, 4, 6)]),
+        ('update_grouped_bar_chart', 'grouped_bar_year_slider', 'value', slider('grouped_bar_year_slider')),
+        ('update_map', 'year_slider', 'value', slider('year_slider')),
+        ('update_map', 'pollutant_select', 'value', options('pollutant_select')),
+        ('update_box_plot', 'box_city_select', 'value', options('box_city_select')),
+        ('update_box_plot', 'box_year_select', 'value', options('box_year_select')),
+        ('update_box_plot', 'box_scope_select', 'value', options('box_scope_select')),
+        ('update_plot', 'year_dropdown', 'value', options('year_dropdown')),
+    ]
+
+
+def summarise(samples):
+    times = [seconds for seconds, _ in samples]
+    return {
+        'median_s': statistics.median(times),
+        'max_s': max(times),
+        'bytes': int(statistics.median(nbytes for _, nbytes in samples)),
+    }
+
+
+def run_child(data_dir):
+    """Benchmark the dataset in ``data_dir`` (the working directory) and return the results."""
+    os.chdir(data_dir)
+    from bokeh.document import Document
+    from bokeh.document.events import DocumentPatchedEvent
+    from bokeh.io.doc import patch_curdoc
+    from bokeh.protocol import Protocol
+
+    from aggregates import get_store
+
+    results = {'startup': {}, 'tabs': {}, 'callbacks': {}}
+    start = time.perf_counter()
+    store = get_store()
+    results['startup']['store_s'] = time.perf_counter() - start
+    results['rows'] = store.row_count
+
+    doc = Document()
+    protocol = Protocol()
+    with patch_curdoc(doc):
+        start = time.perf_counter()
+        ns = runpy.run_path(os.path.join(REPO_ROOT, 'dashboard.py'), run_name='bench_dashboard_session')
+        results['startup']['document_s'] = time.perf_counter() - start
+        results['startup']['document_bytes'] = message_bytes(protocol.create('PULL-DOC-REPLY', 'bench', doc))
+        results['startup']['peak_rss_mb'] = peak_rss_mb()
+
+        events = []
+        doc.on_change(events.append)
+
+        def patch_bytes(patched):
+            return message_bytes(protocol.create('PATCH-DOC', patched)) if patched else 0
+
+        # Tabs are built on first selection; the first one already is
+        tabs = ns['tabs']
+        for index, panel in enumerate(tabs.tabs[1:], 1):
+            events.clear()
+            start = time.perf_counter()
+            tabs.active = index
+            elapsed = time.perf_counter() - start
+            patched = [e for e in events if isinstance(e, DocumentPatchedEvent) and getattr(e, 'model', None) is not tabs]
+            results['tabs'][panel.title] = {'build_s': elapsed, 'bytes': patch_bytes(patched)}
+        results['startup']['all_tabs_peak_rss_mb'] = peak_rss_mb()
+
+        for callback, name, attr, values in sweeps(lambda name: doc.select_one({'name': name})):
+            widget = doc.select_one({'name': name})
+            passes = []
+            for _ in range(2):
+                samples = []
+                for value in values:
+                    events.clear()
+                    start = time.perf_counter()
+                    setattr(widget, attr, value)
+                    elapsed = time.perf_counter() - start
+                    # The widget's own change comes from the browser and is not sent back
+                    patched = [e for e in events if isinstance(e, DocumentPatchedEvent) and getattr(e, 'model', None) is not widget]
+                    samples.append((elapsed, patch_bytes(patched)))
+                passes.append(summarise(samples))
+            results['callbacks'][f'{callback}:{name}'] = {
+                'steps': len(values), 'cold': passes[0], 'warm': passes[1], 'peak_rss_mb': peak_rss_mb(),
+            }
+    return results
+
+
+# ---- Parent process: datasets, reporting, comparison ----
+
+def run_size(rows, seed, chunk_rows):
+    env = dict(os.environ, AIR_QUALITY_CACHE_DIR=os.path.join(DATA_ROOT, 'cache'))
+    if chunk_rows:
+        env['AIR_QUALITY_CHUNK_ROWS'] = str(chunk_rows)
+    directory = dataset_dir(rows, seed)
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', directory],
+        env=env, check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def report(size, result):
+    startup = result['startup']
+    print(f"== {size} ({result['rows']} rows) ==")
+    print(f"  store {startup['store_s']:.3f}s  document {startup['document_s']:.3f}s  "
+          f"{startup['document_bytes'] / 1024:.0f} KiB  peak RSS {startup['peak_rss_mb'] or 0:.0f} MiB")
+    for title, stats in result.get('tabs', {}).items():
+        print(f"  tab {title:44} {stats['build_s'] * 1e3:9.1f} ms {stats['bytes'] / 1024:8.1f} KiB")
+    print(f"  {'callback:widget':48} {'cold ms':>9} {'warm ms':>9} {'max ms':>9} {'KiB':>8} {'RSS MiB':>8}")
+    for key, stats in result['callbacks'].items():
+        cold, warm = stats['cold'], stats['warm']
+        print(f"  {key:48} {cold['median_s'] * 1e3:9.1f} {warm['median_s'] * 1e3:9.1f} "
+              f"{cold['max_s'] * 1e3:9.1f} {cold['bytes'] / 1024:8.1f} {stats['peak_rss_mb'] or 0:8.0f}")
+
+
+def metrics(result):
+    """Flat ``{name: value}`` of the metrics compared against a baseline."""
+    flat = {f'startup.{key}': value for key, value in result['startup'].items()}
+    for title, stats in result.get('tabs', {}).items():
+        flat[f'tab.{title}.build_s'] = stats['build_s']
+        flat[f'tab.{title}.bytes'] = stats['bytes']
+    for key, stats in result['callbacks'].items():
+        flat[f'{key}.cold_s'] = stats['cold']['median_s']
+        flat[f'{key}.warm_s'] = stats['warm']['median_s']
+        flat[f'{key}.bytes'] = stats['cold']['bytes']
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """Print and return the metrics worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for size, result in results.items():
+        if size not in baseline:
+            continue
+        old = metrics(baseline[size])
+        for name, value in metrics(result).items():
+            before = old.get(name)
+            if value is None or not before:
+                continue
+            if name.endswith('_s') and value < TIME_FLOOR_S:
+                continue
+            if value > before * (1 + tolerance):
+                regressions.append((size, name, before, value))
+    for size, name, before, value in regressions:
+        print(f"REGRESSION {size} {name}: {before:.4g} -> {value:.4g} ({value / before - 1:+.0%})")
+    if not regressions:
+        print(f"No regressions beyond {tolerance:.0%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', nargs='+', default=DEFAULT_SIZES, help="dataset sizes, e.g. 10k 1M 50M")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=0, help="load with AIR_QUALITY_CHUNK_ROWS")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', help="baseline JSON written by --output")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown/growth (default 0.2)")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        with contextlib.redirect_stdout(sys.stderr):  # stdout carries only the results
+            results = run_child(args.child)
+        json.dump(results, sys.stdout)
+        return 0
+
+    results = {}
+    for size in args.rows:
+        results[size] = run_size(parse_rows(size), args.seed, args.chunk_rows)
+        report(size, results[size])
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+    if args.compare:
+        with open(args.compare) as handle:
+            return 1 if compare(results, json.load(handle), args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+"""Pre-aggregated (Country, City, Year, Month) x measurement cube.
+
+Each cell of the cube holds count, sum, sum of squares, minimum and maximum
+of every measurement column plus a ``TDigest`` quantile sketch.  All of
+these combine exactly (or, for the sketches, mergeably) across cells, so any
+coarser grain — country/year for the map, city/year/month for the box plot —
+is a roll-up over cells rather than a scan over raw rows.
+"""
+import numpy as np
+import pandas as pd
+
+from data_loader import MEASURE_COLUMNS
+from instrumentation import count_rows
+from sketches import TDigest
+
+
+CUBE_KEYS = ['Country', 'City', 'Year', 'MonthNum']
+ADDITIVE_STATS = ['count', 'sum', 'sumsq']
+STATS = ADDITIVE_STATS + ['min', 'max']
+
+
+class PollutantCube:
+    """Cell statistics indexed by ``CUBE_KEYS``.
+
+    ``stats`` has one column per ``(measure, stat)`` pair and ``sketches``
+    one ``TDigest`` column per measure, both sharing the same sorted index.
+    """
+
+    def __init__(self, stats, sketches):
+        self.stats = stats
+        self.sketches = sketches
+
+    @classmethod
+    def from_frame(cls, frame, measures=MEASURE_COLUMNS):
+        values = frame[measures].astype('float64')
+        keys = [frame[key] for key in CUBE_KEYS]
+        grouped = values.groupby(keys, observed=True, sort=True)
+
+        parts = {
+            'count': grouped.count(),
+            'sum': grouped.sum(),
+            'sumsq': (values ** 2).groupby(keys, observed=True, sort=True).sum(),
+            'min': grouped.min(),
+            'max': grouped.max(),
+        }
+        stats = pd.concat(parts, axis=1).swaplevel(axis=1)
+        stats = stats[pd.MultiIndex.from_product([measures, STATS])]
+
+        # One pass per measure over every cell at once
+        codes = grouped.ngroup().to_numpy()
+        sketches = pd.DataFrame(
+            {measure: TDigest.from_groups(values[measure].to_numpy(), codes, len(stats)) for measure in measures},
+            index=stats.index,
+        )
+        return cls(stats, sketches)
+
+    def merge(self, other):
+        """Cube over the rows of both ``self`` and ``other``."""
+        return PollutantCube.merge_all([self, other])
+
+    @classmethod
+    def merge_all(cls, cubes):
+        """Cube over the rows of every cube in ``cubes`` (of disjoint rows).
+
+        Cells found in several cubes combine their statistics and merge
+        their sketches in one step each, however many cubes there are;
+        cells found in one are carried over unchanged.
+        """
+        if len(cubes) == 1:
+            return cubes[0]
+        measures = cubes[0].measures
+        stats = pd.concat([cube.stats for cube in cubes])
+        grouped = stats.groupby(level=CUBE_KEYS, observed=True, sort=True)
+        merged = pd.concat([
+            grouped[[(m, s) for m in measures for s in ADDITIVE_STATS]].sum(),
+            grouped[[(m, 'min') for m in measures]].min(),
+            grouped[[(m, 'max') for m in measures]].max(),
+        ], axis=1)[cubes[0].stats.columns]
+        counts = [(m, 'count') for m in measures]
+        merged[counts] = merged[counts].astype('int64')  # As the serial cube has them
+
+        codes = grouped.ngroup().to_numpy()
+        sketches = pd.concat([cube.sketches for cube in cubes])
+        merged_sketches = pd.DataFrame(
+            {m: TDigest.merge_groups(sketches[m].tolist(), codes, len(merged)) for m in measures},
+            index=merged.index,
+        )
+        return cls(merged, merged_sketches)
+
+    @staticmethod
+    def _groups_of(table, by, cells):
+        # Rows of ``table`` (indexed by CUBE_KEYS) in the ``by`` groups of ``cells``
+        if cells is None:
+            return table
+        dropped = [key for key in CUBE_KEYS if key not in by]
+        keys = cells.droplevel(dropped) if dropped else cells
+        own = table.index.droplevel(dropped) if dropped else table.index
+        return table[own.isin(keys.unique())]
+
+    @property
+    def measures(self):
+        return list(self.sketches.columns)
+
+    def rollup(self, by, measures=None, cells=None):
+        """Return ``(measure, stat)`` columns aggregated to the ``by`` grain.
+
+        Besides the stored statistics the result carries ``mean`` and
+        ``std`` (population) for every measure.  With ``cells`` (an index of
+        cube cells, e.g. those a batch of new rows fell in) only the ``by``
+        groups containing one of them are computed.
+        """
+        measures = measures or self.measures
+        stats = self._groups_of(self.stats, by, cells)[measures]
+        if list(by) != CUBE_KEYS:
+            grouped = stats.groupby(level=by, observed=True, sort=True)
+            additive = grouped[[(m, s) for m in measures for s in ADDITIVE_STATS]].sum()
+            mins = grouped[[(m, 'min') for m in measures]].min()
+            maxs = grouped[[(m, 'max') for m in measures]].max()
+            stats = pd.concat([additive, mins, maxs], axis=1)
+
+        derived = {}
+        for measure in measures:
+            count = stats[(measure, 'count')].where(stats[(measure, 'count')] > 0)
+            mean = stats[(measure, 'sum')] / count
+            derived[(measure, 'mean')] = mean
+            derived[(measure, 'std')] = np.sqrt((stats[(measure, 'sumsq')] / count - mean ** 2).clip(lower=0))
+        stats = pd.concat([stats, pd.DataFrame(derived, index=stats.index)], axis=1)
+        return stats.sort_index(axis=1)
+
+    def means(self, by, measures=None, cells=None):
+        """Flat frame of ``by`` keys plus the mean of each measure."""
+        measures = measures or self.measures
+        rolled = self.rollup(by, measures, cells)
+        means = pd.DataFrame({measure: rolled[(measure, 'mean')] for measure in measures}, index=rolled.index)
+        return means.reset_index()
+
+    def quantile_summary(self, by, measure, quantiles=(0.25, 0.5, 0.75), cells=None, where=None):
+        """Flat frame of ``by`` keys plus min, the ``quantiles`` and max of ``measure``.
+
+        Quantile columns are named ``q25``, ``q50``, ... after their percent.
+        ``cells`` restricts the result as in ``rollup``; ``where`` maps cube
+        keys to the single value each must have, e.g. ``{'Country': 'India',
+        'Year': 2020}`` with ``by=['MonthNum']`` gives India's monthly
+        distribution for 2020 from its city sketches.
+        """
+        sketches = self._groups_of(self.sketches, by, cells)[measure]
+        count_rows(len(sketches))
+        for key, value in (where or {}).items():
+            sketches = sketches[sketches.index.get_level_values(key) == value]
+        if list(by) != CUBE_KEYS:
+            grouped = sketches.groupby(level=by, observed=True, sort=True)
+            keys = grouped.size().index
+            sketches = pd.Series(TDigest.merge_groups(sketches.tolist(), grouped.ngroup().to_numpy(), len(keys)), index=keys)
+        sketches = sketches[[digest.count > 0 for digest in sketches]]
+
+        summary = pd.DataFrame(
+            [digest.quantile(quantiles) for digest in sketches],
+            index=sketches.index,
+            columns=[f"q{round(q * 100)}" for q in quantiles],
+        )
+        summary.insert(0, 'min', [digest.min for digest in sketches])
+        summary['max'] = [digest.max for digest in sketches]
+        summary['count'] = [digest.count for digest in sketches]
+        return summary.reset_index()
@@ -6,10 +6,8 @@ from bokeh.models import LabelSet
 from bokeh.layouts import column, row, gridplot
 from bokeh.palettes import Viridis256, RdYlGn, Category20, Category10
 from bokeh.models import CategoricalColorMapper, Slider
-import geopandas as gpd 
 import pandas as pd
 from bokeh.io import output_file, show
-from bokeh.models import GeoJSONDataSource
 from bokeh.palettes import RdYlGn11 as palette
 from math import pi
 from bokeh.transform import cumsum
@@ -17,7 +15,6 @@ from bokeh.palettes import Category20c
 from bokeh.models import DataTable, TableColumn, NumberFormatter, Button, Legend, DateFormatter, LegendItem, CustomJSTickFormatter
 from bokeh.plotting import curdoc
 from bokeh.transform import dodge
-from bokeh.transform import linear_cmap
 from random import choice
 from bokeh.transform import factor_cmap
 
@@ -29,1203 +26,1631 @@ from bokeh.plotting import figure
 import numpy as np
 
 from bokeh.models import Slider
-from bokeh.layouts import layout
 from itertools import cycle
 
 from random import randint
 from datetime import datetime, timedelta
+from collections import namedtuple
 
 import requests
 from bokeh.palettes import Spectral6
 
+from bokeh.models import RadioButtonGroup, LogColorMapper
+from bokeh.models import CDSView, IndexFilter, Spinner, Toggle
+from bokeh.events import RangesUpdate
 
-# Load dataset
-df = pd.read_csv('expanded_air_quality_data.csv')
-df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-df = df.dropna(subset=['Date'])  # Drop invalid dates
-df['Year'] = df['Date'].dt.year
+from aggregates import get_store
+from downsample import datetime_ms, level_of_detail
+from instrumentation import count_rows, session_instrumentation, start_metrics_server
+from live_feed import POLL_SECONDS, live_enabled, start_live_feed
+from memo import log_cache_info, memoized
+from profiling import session_profiler
+from rasterize import density_image_chunks
 
-# ---- Scatter Plot Tab ----
-scatter_df = df.sample(n=5000, random_state=42)  # Sample data to reduce density
-scatter_df['PM10_Scaled'] = (scatter_df['PM10'] - scatter_df['PM10'].min()) / (scatter_df['PM10'].max() - scatter_df['PM10'].min()) * 10 + 5
-
-# Add AQI categories
-def categorize_aqi(aqi):
-    if aqi <= 50:
-        return 'Good'
-    elif aqi <= 100:
-        return 'Moderate'
-    elif aqi <= 150:
-        return 'Unhealthy'
-    elif aqi <= 200:
-        return 'Very Unhealthy'
-    else:
-        return 'Hazardous'
-
-scatter_df['AQI_Category'] = scatter_df['AQI'].apply(categorize_aqi)
-scatter_source = ColumnDataSource(scatter_df)
-
-scatter_fig = figure(title="AQI vs PM2.5 Scatter Plot", tools="pan,box_zoom,reset,save", width=1000, height=600, background_fill_color="#CCF2F3", background_fill_alpha=0.8)
-scatter_fig.scatter(
-    x='PM2.5', y='AQI', source=scatter_source, size='PM10_Scaled', alpha=0.5,
-    color={'field': 'AQI', 'transform': LinearColorMapper(palette=RdYlGn[11], low=scatter_df['AQI'].min(), high=scatter_df['AQI'].max())}
-    
-)
-scatter_fig.xaxis.axis_label = "PM2.5"
-scatter_fig.yaxis.axis_label = "AQI"
-
-# Hover tool for scatter plot
-scatter_hover = HoverTool(tooltips=[
-    ('PM2.5', '@{PM2.5}'),
-    ('AQI', '@AQI'),
-    ('Category', '@{AQI_Category}'),
-    ('City', '@City'),
-    ('Country', '@Country'),
-    ('Date', '@Date{%F}')
-], formatters={'@Date': 'datetime'}, mode='mouse')
-scatter_fig.add_tools(scatter_hover)
-
-# Filters for scatter plot
-country_select = Select(title="Country", value="All", options=["All"] + list(df['Country'].unique()), width=200)
-city_select = Select(title="City", value="All", options=["All"], width=200)
-
-# Scatter update functions
-def update_city_dropdown(attr, old, new):
-    selected_country = country_select.value
-    if selected_country == "All":
-        city_select.options = ["All"]
-    else:
-        cities = ["All"] + list(df[df['Country'] == selected_country]['City'].unique())
-        city_select.options = cities
-    city_select.value = "All"
-    update_scatter(None, None, None)
-
-def update_scatter(attr, old, new):
-    filtered = scatter_df
-    if country_select.value != "All":
-        filtered = filtered[filtered['Country'] == country_select.value]
-    if city_select.value != "All":
-        filtered = filtered[filtered['City'] == city_select.value]
-    scatter_source.data = ColumnDataSource.from_df(filtered)
-
-country_select.on_change('value', update_city_dropdown)
-city_select.on_change('value', update_scatter)
-
-scatter_tab = TabPanel(
-    child=column(row(country_select, city_select), scatter_fig),
-    title="Scatter Plot"
-)
 
-# ---- Regional Trends Tab ----
-regional_data = df.groupby(['Country', 'Year'])['AQI'].mean().reset_index()
-regional_data['Year'] = regional_data['Year'].astype(str)
-regional_source = ColumnDataSource(regional_data)
+# Debug profiling of this session's build and callbacks (see profiling.py)
+profiler = session_profiler(curdoc())
+if profiler:
+    profiler.start('document')
 
-regional_fig = figure(
-    title="Regional AQI Trends", x_axis_label="Year", y_axis_label="Average AQI",
-    tools="pan,box_zoom,reset,save", width=1200, height=700, x_range=sorted(regional_data['Year'].unique())
-)
+# Load dataset and aggregates (computed once per server process and shared
+# read-only by every session; this script only creates the Bokeh models)
+store = get_store()
+start_live_feed(store)
+start_metrics_server()
 
-color_map = Category20[20]
-countries = regional_data['Country'].unique()
+# Handlers registered through this are timed per callback when metrics are on
+# and profiled when profiling is
+instrumented = session_instrumentation(curdoc(), profiler)
+curdoc().on_session_destroyed(log_cache_info)
 
-lines = {}
-for i, country in enumerate(countries):
-    country_data = regional_data[regional_data['Country'] == country]
-    source = ColumnDataSource(country_data)
-    lines[country] = regional_fig.line(
-        x='Year', y='AQI', source=source, line_width=2, color=color_map[i % len(color_map)], legend_label=country, alpha=0.7
-    )
 
-regional_hover = HoverTool(tooltips=[
-    ("Year", "@Year"),
-    ("Average AQI", "@AQI{0.2f}"),
-    ("Country", "@Country")
-], mode='mouse')
-regional_fig.add_tools(regional_hover)
-regional_fig.legend.click_policy = "hide"
-
-multi_select = MultiSelect(title="Select Countries:", options=[(c, c) for c in countries], size=8, width=200)
-callback = CustomJS(
-    args=dict(lines=lines, multi_select=multi_select),
-    code="""
-    const selected = multi_select.value;
-    for (const [country, line] of Object.entries(lines)) {
-        line.visible = selected.includes(country);
-    }
-    """
-)
-multi_select.js_on_change("value", callback)
-
-regional_tab = TabPanel(
-    child=column(row(multi_select, regional_fig)),
-    title="Regional Trends"
-)
+# ---- Shared by the tabs ----
+# Pollutants offered by the heatmap, grouped bar and box plot tabs
+pollutant_columns = ['PM2.5', 'PM10', 'Ozone', 'NO2', 'SO2', 'CO']
 
+# Every tab is built by its build_*_tab function the first time it is
+# selected (see the end of this script).  A built tab registers here how to
+# reset it and how to bring it up to date with live rows.
+tab_resets = []
+live_tabs = []  # [store version drawn, refresh] per built tab
 
+def reset_dashboard(event):
+    # Tabs not built yet are still in their initial state
+    for reset in tab_resets:
+        reset()
 
-# --- Heatmap Tab ----
-# Load Dataset
-hm_df = pd.read_csv('expanded_air_quality_data.csv')
+def register_tab(figures, reset, refresh_live):
+    """Hook a built tab into the dashboard-wide reset and the live updates.
 
-# Ensure 'Date' is in datetime format and drop invalid rows
-hm_df['Date'] = pd.to_datetime(hm_df['Date'], errors='coerce')
-hm_df = hm_df.dropna(subset=['Date'])
+    ``refresh_live(changes)`` receives the rows appended since the tab was
+    last refreshed as a ``LiveRows``, or ``None`` when it must redraw from
+    the aggregates.
+    """
+    tab_resets.append(reset)
+    live_tabs.append([store.version, refresh_live])
+    for fig in figures:
+        fig.on_event('reset', instrumented(reset_dashboard))
 
-# Define pollutants and months
-pollutant_columns = ['PM2.5', 'PM10', 'Ozone', 'NO2', 'SO2', 'CO']
-months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-
-# Define units for pollutants
-pollutant_units = {
-    "PM2.5": "µg/m³",
-    "PM10": "µg/m³",
-    "Ozone": "ppb",
-    "NO2": "ppb",
-    "SO2": "ppb",
-    "CO": "ppm"
-}
-# Prepare Heatmap Data
-hm_df['Month'] = hm_df['Date'].dt.strftime('%b')  # Extract month abbreviation
-hm_df['MonthNum'] = hm_df['Date'].dt.month        # Numeric month for slider
-hm_df['Year'] = hm_df['Date'].dt.year             # Extract year
-
-# Group data for pollutants by country, year, and month
-hm_data = hm_df.groupby(['Country', 'Year', 'Month', 'MonthNum'])[pollutant_columns].mean().reset_index()
-
-# Initialize default data
-default_year = hm_data['Year'].min()
-default_pollutant = 'PM2.5'
-default_month = 1  # January
-filtered_monthly_data = hm_data[(hm_data['Year'] == default_year) & (hm_data['MonthNum'] == default_month)]
-filtered_yr_data = hm_data[hm_data['Year'] == default_year]
-
-# Initialize ColumnDataSources
-monthly_source = ColumnDataSource(data=dict(
-    Month=filtered_monthly_data['Month'],
-    Country=filtered_monthly_data['Country'],
-    Value=filtered_monthly_data[default_pollutant]
-))
-
-yr_source = ColumnDataSource(data=dict(
-    Month=filtered_yr_data['Month'],
-    Country=filtered_yr_data['Country'],
-    Value=filtered_yr_data[default_pollutant]
-))
-
-# Color Mappers
-monthly_color_mapper = LinearColorMapper(palette="Viridis256", low=filtered_monthly_data[default_pollutant].min(),
-                                         high=filtered_monthly_data[default_pollutant].max())
-
-yr_color_mapper = LinearColorMapper(palette="Viridis256", low=filtered_yr_data[default_pollutant].min(),
-                                    high=filtered_yr_data[default_pollutant].max())
-
-# Create Monthly Heatmap Figure
-monthly_fig = figure(
-    title=f"Monthly Pollutant Concentrations ({default_pollutant}, {default_year}, {months[default_month - 1]})",
-    x_range=months,
-    y_range=sorted(filtered_monthly_data['Country'].unique(), key=lambda c: -filtered_monthly_data[filtered_monthly_data['Country'] == c][default_pollutant].values[0]),
-    height=400,
-    width=1200,
-    tools="pan,box_zoom,reset,save,wheel_zoom"
-)
-monthly_fig.rect(
-    x="Month", y="Country", width=1, height=1, source=monthly_source,
-    fill_color={'field': 'Value', 'transform': monthly_color_mapper}, line_color=None
-)
+def extends_drawn_series(drawn_length, old_x, old_y, x, y, width):
+    """Whether ``(x, y)`` only adds points after a series drawn in full.
 
-# Add the hover tool only once
-monthly_hover = HoverTool(tooltips=[
-    ("Month", "@Month"),
-    ("Country", "@Country"),
-    ("Concentration", "@Value{0.2f}")
-])
-monthly_fig.add_tools(monthly_hover)
-
-monthly_fig.add_layout(ColorBar(color_mapper=monthly_color_mapper, title=f"{default_pollutant} Concentration"), 'right')
-
-# Create Yearly Heatmap Figure
-yr_fig = figure(
-    title=f"Yearly Pollutant Concentrations ({default_pollutant}, {default_year})",
-    x_range=months,
-    y_range=sorted(filtered_yr_data['Country'].unique()),
-    height=400,
-    width=1200,
-    tools="pan,box_zoom,reset,save,wheel_zoom"
-)
-yr_fig.rect(
-    x="Month", y="Country", width=1, height=1, source=yr_source,
-    fill_color={'field': 'Value', 'transform': yr_color_mapper}, line_color=None
-)
+    Then the new points can be streamed; otherwise (the old points changed,
+    or the series is, or would need to be, downsampled) it must be redrawn.
+    """
+    n = len(old_x)
+    return drawn_length == n and len(x) <= width and np.array_equal(x[:n], old_x) and np.array_equal(y[:n], old_y, equal_nan=True)
 
-# Add the hover tool only once
-yr_hover = HoverTool(tooltips=[
-    ("Month", "@Month"),
-    ("Country", "@Country"),
-    ("Concentration", "@Value{0.2f}")
-])
-yr_fig.add_tools(yr_hover)
-
-yr_fig.add_layout(ColorBar(color_mapper=yr_color_mapper, title=f"{default_pollutant} Concentration"), 'right')
-
-# Dropdowns
-pollutant_dropdown = Select(title="Select Pollutant:", value=default_pollutant, options=pollutant_columns, width=200)
-yr_dropdown = Select(title="Select Year:", value=str(default_year), options=[str(year) for year in sorted(hm_data['Year'].unique())], width=200)
-
-# Slider for Month Selection
-month_slider = Slider(title="Select Month:", start=1, end=12, value=default_month, step=1, width=800, bar_color="#FAFAFA", css_classes=["custom-slider"])
-
-# Update Function
-# Update Function
-def update_plots(attr, old, new):
-    selected_pollutant = pollutant_dropdown.value  # Get selected pollutant
-    selected_unit = pollutant_units[selected_pollutant]  # Get the unit for the pollutant
-    selected_year = int(yr_dropdown.value)  # Get selected year
-    selected_month = month_slider.value  # Get selected month
-
-    # Update Monthly Heatmap
-    filtered_monthly = hm_data[(hm_data['Year'] == selected_year) & (hm_data['MonthNum'] == selected_month)]
-    if not filtered_monthly.empty:
-        # Sort countries by descending pollutant values
-        sorted_countries_monthly = (
-            filtered_monthly.groupby("Country")[selected_pollutant]
-            .mean()
-            .sort_values(ascending=True)
-            .index.tolist()
-        )
 
-        monthly_source.data = {
-            "Month": filtered_monthly['Month'],
-            "Country": filtered_monthly['Country'],
-            "Value": filtered_monthly[selected_pollutant],
-        }
-        monthly_fig.y_range.factors = sorted_countries_monthly
-        monthly_color_mapper.low = filtered_monthly[selected_pollutant].min()
-        monthly_color_mapper.high = filtered_monthly[selected_pollutant].max()
-        monthly_fig.title.text = (
-            f"Monthly Pollutant Concentrations ({selected_pollutant}, {selected_year}, {months[selected_month - 1]})"
-        )
-    else:
-        monthly_source.data = {"Month": [], "Country": [], "Value": []}
-        monthly_fig.y_range.factors = []
-        monthly_color_mapper.low, monthly_color_mapper.high = 0, 1
-        monthly_fig.title.text = f"No Data Available for {selected_pollutant} ({selected_year}, {months[selected_month - 1]})"
-
-    # Update Yearly Heatmap
-    filtered_yr = hm_data[hm_data['Year'] == selected_year]
-    if not filtered_yr.empty:
-        sorted_countries_yr = (
-            filtered_yr.groupby("Country")[selected_pollutant]
-            .mean()
-            .sort_values(ascending=False)
-            .index.tolist()
-        )
-        yr_source.data = {
-            "Month": filtered_yr['Month'],
-            "Country": filtered_yr['Country'],
-            "Value": filtered_yr[selected_pollutant],
-        }
-        yr_fig.y_range.factors = sorted_countries_yr
-        yr_color_mapper.low = filtered_yr[selected_pollutant].min()
-        yr_color_mapper.high = filtered_yr[selected_pollutant].max()
-        yr_fig.title.text = f"Yearly Pollutant Concentrations ({selected_pollutant}, {selected_year})"
-    else:
-        yr_source.data = {"Month": [], "Country": [], "Value": []}
-        yr_fig.y_range.factors = []
-        yr_color_mapper.low, yr_color_mapper.high = 0, 1
-        yr_fig.title.text = f"No Data Available for {selected_pollutant} ({selected_year})"
-
-
-# Attach Callbacks
-pollutant_dropdown.on_change('value', update_plots)
-yr_dropdown.on_change('value', update_plots)
-month_slider.on_change('value', update_plots)
-
-# Combine Controls and Plots
-layout = column(row(pollutant_dropdown, yr_dropdown), yr_fig, month_slider, monthly_fig)
-
-# Create Heatmap Tab
-heatmap_tab = TabPanel(
-    child=layout,
-    title="Heatmap"
-)
+# ---- Scatter Plot Tab ----
+def build_scatter_tab():
+    """AQI vs PM2.5 scatter of the sample, or a density image of every row."""
+    scatter_df = store.scatter_df  # Sampled to reduce density, with PM10_Scaled and AQI_Category
+    scatter_source = ColumnDataSource(scatter_df)
 
+    scatter_fig = figure(title="AQI vs PM2.5 Scatter Plot", tools="pan,box_zoom,reset,save", width=1000, height=600, background_fill_color="#CCF2F3", background_fill_alpha=0.8)
+    scatter_renderer = scatter_fig.scatter(
+        x='PM2.5', y='AQI', source=scatter_source, size='PM10_Scaled', alpha=0.5,
+        color={'field': 'AQI', 'transform': LinearColorMapper(palette=RdYlGn[11], low=scatter_df['AQI'].min(), high=scatter_df['AQI'].max())}
 
+    )
+    scatter_fig.xaxis.axis_label = "PM2.5"
+    scatter_fig.yaxis.axis_label = "AQI"
+
+    # Hover tool for scatter plot
+    scatter_hover = HoverTool(tooltips=[
+        ('PM2.5', '@{PM2.5}'),
+        ('AQI', '@AQI'),
+        ('Category', '@{AQI_Category}'),
+        ('City', '@City'),
+        ('Country', '@Country'),
+        ('Date', '@Date{%F}')
+    ], formatters={'@Date': 'datetime'}, mode='mouse', renderers=[scatter_renderer])
+    scatter_fig.add_tools(scatter_hover)
+
+    # Density mode: every row of the dataset (not just the sample) is binned
+    # into a fixed-size image on the server and re-rasterised whenever the
+    # visible ranges change, so the payload does not grow with the data.
+    DENSITY_BIN_PIXELS = 4  # Screen pixels per density bin
+    density_shape = (scatter_fig.height // DENSITY_BIN_PIXELS, scatter_fig.width // DENSITY_BIN_PIXELS)
+    density_source = ColumnDataSource(data=dict(image=[], mean_aqi=[], x=[], y=[], dw=[], dh=[]))
+    density_mapper = LogColorMapper(palette=Viridis256, nan_color=(0, 0, 0, 0))
+    density_renderer = scatter_fig.image(
+        image='image', x='x', y='y', dw='dw', dh='dh', source=density_source,
+        color_mapper=density_mapper, visible=False
+    )
+    scatter_fig.add_tools(HoverTool(tooltips=[
+        ('PM2.5', '$x{0.0}'),
+        ('AQI', '$y{0.0}'),
+        ('Readings', '@image{0,0}'),
+        ('Mean AQI', '@mean_aqi{0.0}')
+    ], mode='mouse', renderers=[density_renderer]))
+
+    # Invisible corners of the full-data extent: in density mode the axes
+    # auto-fit to these rather than to the image, which would otherwise grow
+    # the ranges (and trigger a new raster) every time it is redrawn.
+    density_extent_source = ColumnDataSource(data=dict(x=[], y=[]))
+    density_extent_renderer = scatter_fig.scatter(x='x', y='y', source=density_extent_source, alpha=0, visible=False)
+    for scatter_range in (scatter_fig.x_range, scatter_fig.y_range):
+        scatter_range.renderers = [scatter_renderer, density_extent_renderer]
+        scatter_range.only_visible = True
+
+    # Chunked loads keep raw rows only with AIR_QUALITY_RAW_STORE set; without
+    # them there is nothing to rasterise
+    scatter_mode = RadioButtonGroup(labels=["Sampled points", "Density (all rows)"], active=0, disabled=store.raw is None)
+    density_rows_key = None
+    density_rows = None
+
+    def density_cities():
+        if country_select.value == "All":
+            return None
+        if city_select.value != "All":
+            return [city_select.value]
+        return store.cell_index.labels(country_select.value)
+
+    def density_points():
+        """PM2.5 and AQI of every row matching the country/city filters, chunk by chunk."""
+        nonlocal density_rows_key, density_rows
+        key = (country_select.value, city_select.value, store.version)
+        if key != density_rows_key:
+            # In-memory rows are kept per filter; on-disk rows are re-read per zoom
+            density_rows = list(store.raw.iter_columns(['PM2.5', 'AQI'], density_cities())) if store.raw.in_memory else None
+            density_rows_key = key
+        if density_rows is None:
+            return store.raw.iter_columns(['PM2.5', 'AQI'], density_cities())
+        return density_rows
+
+    def padded_extent(lows, highs):
+        if not lows:
+            return 0.0, 1.0
+        low, high = float(min(lows)), float(max(highs))
+        pad = (high - low) * 1e-6 or 1.0  # Keep the maximum inside the last bin
+        return low, high + pad
+
+    def density_extent(chunks):
+        bounds = ([], [], [], [])
+        for x, y in chunks:
+            for values, lows, highs in ((x, bounds[0], bounds[1]), (y, bounds[2], bounds[3])):
+                finite = values[~np.isnan(values)]
+                if finite.size:
+                    lows.append(finite.min())
+                    highs.append(finite.max())
+        return padded_extent(bounds[0], bounds[1]), padded_extent(bounds[2], bounds[3])
+
+    def update_density(x_range=None, y_range=None):
+        if store.raw is None:
+            return
+        if x_range is None:
+            x_range, y_range = density_extent(density_points())
+            density_extent_source.data = dict(x=list(x_range), y=list(y_range))
+        counts, means = density_image_chunks(((x, y, y) for x, y in density_points()), x_range, y_range, density_shape)
+        density_source.data = dict(
+            image=[counts], mean_aqi=[means], x=[x_range[0]], y=[y_range[0]],
+            dw=[x_range[1] - x_range[0]], dh=[y_range[1] - y_range[0]]
+        )
+        max_count = np.nanmax(counts) if not np.isnan(counts).all() else 1.0
+        density_mapper.low = 1
+        density_mapper.high = max(float(max_count), 2.0)
+
+    def update_scatter_mode(attr, old, new):
+        density = scatter_mode.active == 1
+        scatter_renderer.visible = not density
+        density_renderer.visible = density
+        density_extent_renderer.visible = density
+        if density:
+            update_density()
+
+    def rerasterize_density(event):
+        if scatter_mode.active == 1:
+            update_density((event.x0, event.x1), (event.y0, event.y1))
+
+    scatter_mode.on_change('active', instrumented(update_scatter_mode))
+    scatter_fig.on_event(RangesUpdate, instrumented(rerasterize_density))
+
+    # Filters for scatter plot
+    country_select = Select(title="Country", value="All", options=["All"] + store.countries, width=200, name="country_select")
+    city_select = Select(title="City", value="All", options=["All"], width=200)
+
+    # Scatter update functions
+    def update_city_dropdown(attr, old, new):
+        selected_country = country_select.value
+        if selected_country == "All":
+            city_select.options = ["All"]
+        else:
+            cities = ["All"] + store.cell_index.labels(selected_country)
+            city_select.options = cities
+        city_select.value = "All"
+        update_scatter(None, None, None)
+
+    def update_scatter(attr, old, new):
+        filtered = store.scatter_df
+        if country_select.value != "All":
+            if city_select.value != "All":
+                filtered = store.scatter_index.rows(country_select.value, city_select.value)
+            else:
+                filtered = store.scatter_index.rows(country_select.value)
+        scatter_source.data = ColumnDataSource.from_df(filtered)
+        if scatter_mode.active == 1:
+            update_density()
+
+    country_select.on_change('value', instrumented(update_city_dropdown))
+    city_select.on_change('value', instrumented(update_scatter))
+
+    def stream_scatter_rows(rows):
+        if country_select.value != "All":
+            rows = rows[rows['Country'] == country_select.value]
+            if city_select.value != "All":
+                rows = rows[rows['City'] == city_select.value]
+        if rows.empty:
+            return
+        if len(scatter_source.data['index']) + len(rows) > len(store.scatter_df):
+            update_scatter(None, None, None)  # The store has dropped its oldest live rows
+        else:
+            scatter_source.stream(ColumnDataSource.from_df(rows))
+        if scatter_mode.active == 1:
+            x_range, y_range = scatter_fig.x_range, scatter_fig.y_range
+            if None in (x_range.start, x_range.end, y_range.start, y_range.end):
+                update_density()
+            else:
+                update_density((x_range.start, x_range.end), (y_range.start, y_range.end))
+
+    def refresh_live(changes):
+        # Live rows may bring new countries and cities into the filters
+        country_select.options = ["All"] + store.countries
+        if country_select.value != "All":
+            city_select.options = ["All"] + store.cell_index.labels(country_select.value)
+        if changes is None:
+            update_scatter(None, None, None)
+        else:
+            stream_scatter_rows(changes.rows)
+
+    initial_scatter_source = scatter_source.data.copy()
+
+    def reset():
+        scatter_source.data = initial_scatter_source
+        country_select.value = "All"
+        city_select.value = "All"
+
+    register_tab([scatter_fig], reset, refresh_live)
+    return column(row(country_select, city_select, scatter_mode), scatter_fig)
 
 
+# ---- Regional Trends Tab ----
+def build_regional_tab():
+    """Yearly AQI line per country."""
+    regional_data = store.regional_data
+    regional_source = ColumnDataSource(regional_data)
+
+    regional_fig = figure(
+        title="Regional AQI Trends", x_axis_label="Year", y_axis_label="Average AQI",
+        tools="pan,box_zoom,reset,save", width=1200, height=700, x_range=sorted(regional_data['Year'].unique())
+    )
 
+    color_map = Category20[20]
+    countries = regional_data['Country'].unique()
 
+    lines = {}
+    for i, country in enumerate(countries):
+        country_data = regional_data[regional_data['Country'] == country]
+        source = ColumnDataSource(country_data)
+        lines[country] = regional_fig.line(
+            x='Year', y='AQI', source=source, line_width=2, color=color_map[i % len(color_map)], legend_label=country, alpha=0.7
+        )
 
-# ---- Time Series Tab ----
+    regional_hover = HoverTool(tooltips=[
+        ("Year", "@Year"),
+        ("Average AQI", "@AQI{0.2f}"),
+        ("Country", "@Country")
+    ], mode='mouse')
+    regional_fig.add_tools(regional_hover)
+    regional_fig.legend.click_policy = "hide"
+
+    multi_select = MultiSelect(title="Select Countries:", options=[(c, c) for c in countries], size=8, width=200)
+    callback = CustomJS(
+        args=dict(lines=lines, multi_select=multi_select),
+        code="""
+        const selected = multi_select.value;
+        for (const [country, line] of Object.entries(lines)) {
+            line.visible = selected.includes(country);
+        }
+        """
+    )
+    multi_select.js_on_change("value", callback)
 
+    def refresh_regional(countries):
+        regional_data = store.regional_data
+        for country in countries:
+            if country in lines:
+                lines[country].data_source.data = ColumnDataSource.from_df(regional_data[regional_data['Country'] == country])
 
-# Pollutant Columns (example data) 
-# Pollutant Columns (example data) 
-from itertools import cycle
-from bokeh.models import GlyphRenderer
-# Read Dataset
-# Read Dataset
-air_quality_data = pd.read_csv("expanded_air_quality_data.csv")
-
-# Ensure 'Date' is converted to datetime
-air_quality_data['Date'] = pd.to_datetime(air_quality_data['Date'], errors='coerce')
-
-# Extract 'Year' and 'YearMonth'
-air_quality_data['Year'] = air_quality_data['Date'].dt.year
-air_quality_data['YearMonth'] = air_quality_data['Date'].dt.to_period('M').dt.to_timestamp()
-
-# Drop rows with missing required data
-air_quality_data = air_quality_data.dropna(subset=['Date', 'Year', 'YearMonth'])
-
-# Define pollutants, units, and line styles
-pollutants = {
-    'PM2.5': 'µg/m³',
-    'PM10': 'µg/m³',
-    'Ozone': 'ppb',
-    'NO2': 'ppb',
-    'SO2': 'ppb',
-    'CO': 'ppm'
-}
-line_styles = ['solid', 'dashed', 'dotted', 'dotdash', 'dashdot', 'solid']
-
-# Custom color palette for cities
-custom_colors = ['red', 'yellow', 'black', 'blue', 'green', 'orange', 'purple', 'pink', 'brown', 'cyan']
-color_cycle = cycle(custom_colors)
-cities = air_quality_data['City'].dropna().unique()
-city_color_map = {city: next(color_cycle) for city in cities}
-
-# Widgets
-time_year_select = Select(
-    title="Select Year:",
-    value=str(int(air_quality_data['Year'].max())),
-    options=[str(int(year)) for year in sorted(air_quality_data['Year'].unique())],
-    width=200
-)
+    def refresh_live(changes):
+        refresh_regional(list(lines) if changes is None else changes.countries)
 
-time_city_select = MultiSelect(
-    title="Select Cities (Max 3):",
-    value=[],
-    options=sorted(cities),
-    size=8, width=300
-)
+    initial_regional_source = regional_source.data.copy()
 
-unit_filter_checkboxes = CheckboxGroup(
-    labels=list(set(pollutants.values())),
-    active=list(range(len(set(pollutants.values()))))
-)
+    def reset():
+        regional_source.data = initial_regional_source
 
-legend_toggle_button = Button(label="Toggle Legend", button_type="primary")
-
-# Time-Series Figure
-time_series_fig = figure(
-    title="Time-Series Pollutant Trends",
-    x_axis_type="datetime",
-    x_axis_label="Date",
-    y_axis_label="Concentration",
-    width=1000, height=500,
-    tools="pan,box_zoom,reset,save",
-    toolbar_location="above"
-)
+    register_tab([regional_fig], reset, refresh_live)
+    return column(row(multi_select, regional_fig))
 
-# Hover Tool
-time_series_fig.add_tools(HoverTool(
-    tooltips=[
-        ("Date", "@x{%F}"),
-        ("Value", "@y{0.00}"),
-        ("Pollutant", "@pollutant"),
-        ("City", "@city"),
-        ("Unit", "@unit")
-    ],
-    formatters={
-        "@x": "datetime",
-    },
-    mode="mouse"
-))
-
-# Update function
-def update_time_series(attr, old, new):
-    # Clear all renderers
-    time_series_fig.renderers.clear()
-
-    # Remove existing legends completely
-    legends_to_remove = [obj for obj in time_series_fig.right if isinstance(obj, Legend)]
-    for legend in legends_to_remove:
-        time_series_fig.right.remove(legend)
-
-    # Enforce maximum city selection limit
-    selected_cities = time_city_select.value[:3]
-    time_city_select.value = selected_cities
-
-    # Parse selected year
-    selected_year = int(time_year_select.value)
-
-    if not selected_cities:
-        return
 
-    unit_renderers = {unit: [] for unit in set(pollutants.values())}
-    active_units = [unit_filter_checkboxes.labels[i] for i in unit_filter_checkboxes.active]
+# ---- Heatmap Tab ----
+def build_heatmap_tab():
+    """Monthly and yearly pollutant heatmaps by country."""
+    # Define months
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 
-    # Loop through pollutants and cities
-    for pollutant_idx, (pollutant, unit) in enumerate(pollutants.items()):
-        if unit not in active_units:
-            continue
+    # Define units for pollutants
+    pollutant_units = {
+        "PM2.5": "µg/m³",
+        "PM10": "µg/m³",
+        "Ozone": "ppb",
+        "NO2": "ppb",
+        "SO2": "ppb",
+        "CO": "ppm"
+    }
+    # Pollutants grouped by country, year, and month
+    hm_data = store.hm_data
+
+    # Initialize default data
+    default_year = hm_data['Year'].min()
+    default_pollutant = 'PM2.5'
+    default_month = 1  # January
+    filtered_monthly_data = hm_data[(hm_data['Year'] == default_year) & (hm_data['MonthNum'] == default_month)]
+    filtered_yr_data = hm_data[hm_data['Year'] == default_year]
+
+    # Initialize ColumnDataSources
+    monthly_source = ColumnDataSource(data=dict(
+        Month=filtered_monthly_data['Month'],
+        Country=filtered_monthly_data['Country'],
+        Value=filtered_monthly_data[default_pollutant]
+    ))
+
+    yr_source = ColumnDataSource(data=dict(
+        Month=filtered_yr_data['Month'],
+        Country=filtered_yr_data['Country'],
+        Value=filtered_yr_data[default_pollutant]
+    ))
+
+    # Color Mappers
+    monthly_color_mapper = LinearColorMapper(palette="Viridis256", low=filtered_monthly_data[default_pollutant].min(),
+                                             high=filtered_monthly_data[default_pollutant].max())
+
+    yr_color_mapper = LinearColorMapper(palette="Viridis256", low=filtered_yr_data[default_pollutant].min(),
+                                        high=filtered_yr_data[default_pollutant].max())
+
+    # Create Monthly Heatmap Figure
+    monthly_fig = figure(
+        title=f"Monthly Pollutant Concentrations ({default_pollutant}, {default_year}, {months[default_month - 1]})",
+        x_range=months,
+        y_range=sorted(filtered_monthly_data['Country'].unique(), key=lambda c: -filtered_monthly_data[filtered_monthly_data['Country'] == c][default_pollutant].values[0]),
+        height=400,
+        width=1200,
+        tools="pan,box_zoom,reset,save,wheel_zoom"
+    )
+    monthly_renderer = monthly_fig.rect(
+        x="Month", y="Country", width=1, height=1, source=monthly_source,
+        fill_color={'field': 'Value', 'transform': monthly_color_mapper}, line_color=None
+    )
 
-        for city in selected_cities:
-            city_data = air_quality_data[
-                (air_quality_data['City'] == city) & (air_quality_data['Year'] == selected_year)
-            ].copy()
+    # Add the hover tool only once
+    monthly_hover = HoverTool(tooltips=[
+        ("Month", "@Month"),
+        ("Country", "@Country"),
+        ("Concentration", "@Value{0.2f}")
+    ])
+    monthly_fig.add_tools(monthly_hover)
+
+    monthly_fig.add_layout(ColorBar(color_mapper=monthly_color_mapper, title=f"{default_pollutant} Concentration"), 'right')
+
+    # Create Yearly Heatmap Figure
+    yr_fig = figure(
+        title=f"Yearly Pollutant Concentrations ({default_pollutant}, {default_year})",
+        x_range=months,
+        y_range=sorted(filtered_yr_data['Country'].unique()),
+        height=400,
+        width=1200,
+        tools="pan,box_zoom,reset,save,wheel_zoom"
+    )
+    yr_fig.rect(
+        x="Month", y="Country", width=1, height=1, source=yr_source,
+        fill_color={'field': 'Value', 'transform': yr_color_mapper}, line_color=None
+    )
 
-            if city_data.empty:
+    # Add the hover tool only once
+    yr_hover = HoverTool(tooltips=[
+        ("Month", "@Month"),
+        ("Country", "@Country"),
+        ("Concentration", "@Value{0.2f}")
+    ])
+    yr_fig.add_tools(yr_hover)
+
+    yr_fig.add_layout(ColorBar(color_mapper=yr_color_mapper, title=f"{default_pollutant} Concentration"), 'right')
+
+    # Dropdowns
+    pollutant_dropdown = Select(title="Select Pollutant:", value=default_pollutant, options=pollutant_columns, width=200, name="pollutant_dropdown")
+    yr_dropdown = Select(title="Select Year:", value=str(default_year), options=[str(year) for year in sorted(hm_data['Year'].unique())], width=200, name="yr_dropdown")
+
+    # Slider for Month Selection
+    month_slider = Slider(title="Select Month:", start=1, end=12, value=default_month, step=1, width=800, bar_color="#FAFAFA", css_classes=["custom-slider"], name="month_slider")
+
+    # Browser-side month scrubbing: the monthly heatmap's source holds the whole
+    # selected year and a CustomJS callback shows the slider's month, re-ranks
+    # the countries and rescales the colours, so moving the slider costs no
+    # server round-trip.  The server only resends data when the year or
+    # pollutant changes.
+    month_scrub_toggle = Toggle(label="Scrub months in browser", active=False, width=200)
+    monthly_filter = IndexFilter(indices=None)
+    monthly_renderer.view = CDSView(filter=monthly_filter)
+    month_slider.js_on_change('value', CustomJS(
+        args=dict(
+            toggle=month_scrub_toggle, source=monthly_source, filter=monthly_filter, y_range=monthly_fig.y_range,
+            mapper=monthly_color_mapper, title=monthly_fig.title, pollutant=pollutant_dropdown, year=yr_dropdown,
+            names=months
+        ),
+        code="""
+        if (!toggle.active)
+            return
+        const month = cb_obj.value
+        const month_nums = source.data.MonthNum, values = source.data.Value, countries = source.data.Country
+        const missing = (v) => v == null || Number.isNaN(v)
+        const indices = []
+        let low = Infinity, high = -Infinity
+        for (let i = 0; i < month_nums.length; i++) {
+            if (month_nums[i] != month)
                 continue
+            indices.push(i)
+            if (!missing(values[i])) {
+                low = Math.min(low, values[i])
+                high = Math.max(high, values[i])
+            }
+        }
+        filter.indices = indices
+        const label = `${pollutant.value}, ${year.value}, ${names[month - 1]}`
+        if (indices.length) {
+            // Ascending by value with missing values last, as the server sorts
+            const order = indices.slice().sort((a, b) =>
+                (missing(values[a]) - missing(values[b])) || (missing(values[a]) ? 0 : values[a] - values[b]))
+            y_range.factors = order.map((i) => countries[i])
+            mapper.low = low
+            mapper.high = high
+            title.text = `Monthly Pollutant Concentrations (${label})`
+        } else {
+            y_range.factors = []
+            mapper.low = 0
+            mapper.high = 1
+            title.text = `No Data Available for ${pollutant.value} (${year.value}, ${names[month - 1]})`
+        }
+    """
+    ))
+
+    @memoized('heatmap_year_columns')
+    def heatmap_year_columns(version, pollutant, year):
+        """Monthly heatmap source columns for every month of ``year`` (browser-side scrubbing)."""
+        filtered = store.hm_index.rows(year)
+        return {
+            "Month": filtered['Month'],
+            "MonthNum": filtered['MonthNum'],
+            "Country": filtered['Country'],
+            "Value": filtered[pollutant],
+        }
 
-            grouped_data = city_data.groupby('YearMonth')[pollutant].mean().reset_index()
-
-            source = ColumnDataSource(data={
-                "x": grouped_data['YearMonth'],
-                "y": grouped_data[pollutant],
-                "pollutant": [pollutant] * len(grouped_data),
-                "city": [city] * len(grouped_data),
-                "unit": [unit] * len(grouped_data)
-            })
-            line = time_series_fig.line(
-                'x', 'y', source=source, line_width=2,
-                line_dash=line_styles[pollutant_idx % len(line_styles)],
-                line_color=city_color_map[city]
+    # Heatmap views are shared by every session through the callback cache
+    @memoized('heatmap_view')
+    def heatmap_view(version, pollutant, year, month=None):
+        """Source columns, country order and colour range of one heatmap (``month=None``: the yearly one)."""
+        filtered = store.hm_index.rows(year) if month is None else store.hm_index.rows(year, month)
+        if filtered.empty:
+            return None
+        # Monthly countries are sorted ascending by value, yearly ones descending
+        sorted_countries = (
+            filtered.groupby("Country", observed=True)[pollutant]
+            .mean()
+            .sort_values(ascending=month is not None)
+            .index.tolist()
+        )
+        data = {
+            "Month": filtered['Month'],
+            "Country": filtered['Country'],
+            "Value": filtered[pollutant],
+        }
+        return data, sorted_countries, filtered[pollutant].min(), filtered[pollutant].max()
+
+    # Update Function
+    def update_plots(attr, old, new):
+        selected_pollutant = pollutant_dropdown.value  # Get selected pollutant
+        selected_unit = pollutant_units[selected_pollutant]  # Get the unit for the pollutant
+        selected_year = int(yr_dropdown.value)  # Get selected year
+        selected_month = month_slider.value  # Get selected month
+
+        # Update Monthly Heatmap
+        monthly_view = heatmap_view(store.version, selected_pollutant, selected_year, selected_month)
+        if month_scrub_toggle.active:
+            # The whole year goes to the browser; the filter shows one month
+            year_columns = heatmap_year_columns(store.version, selected_pollutant, selected_year)
+            monthly_source.data = dict(year_columns)
+            monthly_filter.indices = np.flatnonzero(year_columns['MonthNum'].to_numpy() == selected_month).tolist()
+        else:
+            monthly_filter.indices = None
+        if monthly_view is not None:
+            data, sorted_countries_monthly, low, high = monthly_view
+            if not month_scrub_toggle.active:
+                monthly_source.data = dict(data)
+            monthly_fig.y_range.factors = sorted_countries_monthly
+            monthly_color_mapper.low = low
+            monthly_color_mapper.high = high
+            monthly_fig.title.text = (
+                f"Monthly Pollutant Concentrations ({selected_pollutant}, {selected_year}, {months[selected_month - 1]})"
             )
-            unit_renderers[unit].append(line)
-
-    # Add a single legend for units without lines
-    legend_items = [LegendItem(label=unit, renderers=renderers) for unit, renderers in unit_renderers.items() if renderers]
-
-    if legend_items:
-        legend = Legend(items=legend_items, click_policy="hide", title="Units")
-        time_series_fig.add_layout(legend, 'right')
-
-# Toggle legend visibility
-def toggle_legend():
-    for legend in time_series_fig.right:
-        if isinstance(legend, Legend):
-            legend.visible = not legend.visible
-
-legend_toggle_button.on_click(toggle_legend)
-
-# Attach callbacks
-def limit_city_selection(attr, old, new):
-    if len(new) > 3:
-        time_city_select.value = old[:3]
-
-unit_filter_checkboxes.on_change("active", update_time_series)
-time_city_select.on_change("value", limit_city_selection)
-time_year_select.on_change("value", update_time_series)
-time_city_select.on_change("value", update_time_series)
-
-# Initial call to update
-update_time_series(None, None, None)
-
-# Layout
-time_series_layout = column(
-    row(time_year_select, time_city_select),
-    unit_filter_checkboxes,
-    legend_toggle_button,
-    time_series_fig
-)
-
-
-time_series_tab = TabPanel(child=time_series_layout, title="Time-Series Trends")
-
+        else:
+            if not month_scrub_toggle.active:
+                monthly_source.data = {"Month": [], "Country": [], "Value": []}
+            monthly_fig.y_range.factors = []
+            monthly_color_mapper.low, monthly_color_mapper.high = 0, 1
+            monthly_fig.title.text = f"No Data Available for {selected_pollutant} ({selected_year}, {months[selected_month - 1]})"
+
+        # Update Yearly Heatmap
+        yr_view = heatmap_view(store.version, selected_pollutant, selected_year)
+        if yr_view is not None:
+            data, sorted_countries_yr, low, high = yr_view
+            yr_source.data = dict(data)
+            yr_fig.y_range.factors = sorted_countries_yr
+            yr_color_mapper.low = low
+            yr_color_mapper.high = high
+            yr_fig.title.text = f"Yearly Pollutant Concentrations ({selected_pollutant}, {selected_year})"
+        else:
+            yr_source.data = {"Month": [], "Country": [], "Value": []}
+            yr_fig.y_range.factors = []
+            yr_color_mapper.low, yr_color_mapper.high = 0, 1
+            yr_fig.title.text = f"No Data Available for {selected_pollutant} ({selected_year})"
+
+
+    def update_month(attr, old, new):
+        # When scrubbing in the browser the monthly heatmap is already redrawn
+        if not month_scrub_toggle.active:
+            update_plots(attr, old, new)
+
+    # Attach Callbacks
+    pollutant_dropdown.on_change('value', instrumented(update_plots))
+    yr_dropdown.on_change('value', instrumented(update_plots))
+    month_slider.on_change('value', instrumented(update_month))
+    month_scrub_toggle.on_change('active', instrumented(update_plots))
+
+    def refresh_live(changes):
+        yr_dropdown.options = [str(year) for year in store.years]  # Live rows may start a new year
+        if changes is None or int(yr_dropdown.value) in changes.years:
+            update_plots(None, None, None)
+
+    initial_monthly_source = monthly_source.data.copy()
+    initial_yr_source = yr_source.data.copy()
+
+    def reset():
+        monthly_source.data = initial_monthly_source
+        monthly_filter.indices = None
+        yr_source.data = initial_yr_source
+        pollutant_dropdown.value = 'PM2.5'
+        yr_dropdown.value = str(default_year)
+        month_slider.value = 1
+        month_scrub_toggle.active = False
+
+    register_tab([monthly_fig, yr_fig], reset, refresh_live)
+
+    # Combine Controls and Plots
+    return column(row(pollutant_dropdown, yr_dropdown, month_scrub_toggle), yr_fig, month_slider, monthly_fig)
 
 
+# ---- Time Series Tab ----
+def build_time_series_tab():
+    """Daily pollutant lines for up to three cities."""
+    # Define pollutants, units, and line styles
+    pollutants = {
+        'PM2.5': 'µg/m³',
+        'PM10': 'µg/m³',
+        'Ozone': 'ppb',
+        'NO2': 'ppb',
+        'SO2': 'ppb',
+        'CO': 'ppm'
+    }
+    line_styles = ['solid', 'dashed', 'dotted', 'dotdash', 'dashdot', 'solid']
+
+    # Custom color palette for cities
+    custom_colors = ['red', 'yellow', 'black', 'blue', 'green', 'orange', 'purple', 'pink', 'brown', 'cyan']
+    color_cycle = cycle(custom_colors)
+    cities = store.cities
+    city_color_map = {city: next(color_cycle) for city in cities}
+
+    # Widgets
+    time_year_select = Select(
+        title="Select Year:",
+        value=str(store.years[-1]),
+        options=[str(year) for year in store.years] + ["All"],
+        width=200,
+        name="time_year_select"
+    )
 
+    time_city_select = MultiSelect(
+        title="Select Cities (Max 3):",
+        value=[],
+        options=sorted(cities),
+        size=8, width=300,
+        name="time_city_select"
+    )
 
+    unit_filter_checkboxes = CheckboxGroup(
+        labels=list(set(pollutants.values())),
+        active=list(range(len(set(pollutants.values()))))
+    )
 
-# ---- Grouped Bar Chart Tab ---- 
-# Example pollutant columns (replace with your actual pollutant column names)
-pollutant_columns = ["PM2.5", "PM10", "Ozone", "NO2", "SO2", "CO"]
+    legend_toggle_button = Button(label="Toggle Legend", button_type="primary")
+
+    # Time-Series Figure
+    time_series_fig = figure(
+        title="Time-Series Pollutant Trends",
+        x_axis_type="datetime",
+        x_axis_label="Date",
+        y_axis_label="Concentration",
+        width=1000, height=500,
+        tools="pan,box_zoom,reset,save",
+        toolbar_location="above"
+    )
 
-# Sample dataframe structure (replace with your dataset path)
-# Load data and inspect columns
-air_quality_df = pd.read_csv("expanded_air_quality_data.csv")
-#print("Columns in dataset:", air_quality_df.columns)  # Debugging: check column names
+    # Hover Tool
+    time_series_fig.add_tools(HoverTool(
+        tooltips=[
+            ("Date", "@x{%F}"),
+            ("Value", "@y{0.00}"),
+            ("Pollutant", "@pollutant"),
+            ("City", "@city"),
+            ("Unit", "@unit")
+        ],
+        formatters={
+            "@x": "datetime",
+        },
+        mode="mouse"
+    ))
+
+    # Fixed pool of line renderers: one per (pollutant, city slot). Their
+    # sources are updated in place and their visibility follows the unit
+    # checkboxes, so a change sends data diffs instead of new renderers.
+    MAX_TIME_SERIES_CITIES = 3
+    time_series_lines = {}
+    for pollutant_idx, pollutant in enumerate(pollutants):
+        for slot in range(MAX_TIME_SERIES_CITIES):
+            time_series_lines[(pollutant, slot)] = time_series_fig.line(
+                'x', 'y', source=ColumnDataSource(data={"x": [], "y": [], "pollutant": [], "city": [], "unit": []}),
+                line_width=2, line_dash=line_styles[pollutant_idx % len(line_styles)], visible=False
+            )
+    time_series_line_keys = {key: None for key in time_series_lines}  # (city, year) each line currently shows
+    time_series_full = {}  # (pollutant, slot) -> full daily (x in ms, y) series behind the drawn points
+    time_series_view = None  # visible (start, end) in ms, or None for the whole series
+
+    # A single legend for units, built once
+    time_series_legend = Legend(items=[
+        LegendItem(label=unit, renderers=[line for (pollutant, slot), line in time_series_lines.items() if pollutants[pollutant] == unit], visible=False)
+        for unit in unit_filter_checkboxes.labels
+    ], click_policy="hide", title="Units")
+    time_series_fig.add_layout(time_series_legend, 'right')
+
+    def update_time_series_visibility(attr, old, new):
+        active_units = [unit_filter_checkboxes.labels[i] for i in unit_filter_checkboxes.active]
+        for (pollutant, slot), line in time_series_lines.items():
+            line.visible = time_series_line_keys[(pollutant, slot)] is not None and pollutants[pollutant] in active_units
+        for item in time_series_legend.items:
+            item.visible = any(line.visible for line in item.renderers)
+
+    def draw_time_series_line(pollutant, slot):
+        # Send only the points of the full series that the current view can show
+        line = time_series_lines[(pollutant, slot)]
+        city = time_series_line_keys[(pollutant, slot)][0]
+        x, y = time_series_full[(pollutant, slot)]
+        view = time_series_view
+        if view is not None and np.searchsorted(x, view[1], side='right') - np.searchsorted(x, view[0]) < 2:
+            view = None
+        keep = level_of_detail(x, y, view, time_series_fig.width)
+        line.data_source.data = {
+            "x": x[keep],
+            "y": y[keep],
+            "pollutant": [pollutant] * len(keep),
+            "city": [city] * len(keep),
+            "unit": [pollutants[pollutant]] * len(keep)
+        }
 
-# Ensure Year column exists
-if 'Year' not in air_quality_df.columns:
-    if 'Date' in air_quality_df.columns:  # If Date column exists, extract Year
-        air_quality_df['Date'] = pd.to_datetime(air_quality_df['Date'], errors='coerce')
-        air_quality_df['Year'] = air_quality_df['Date'].dt.year
-    else:
-        raise KeyError("The dataset must contain either 'Year' or 'Date' column.")
+    # Update function
+    def update_time_series(attr, old, new):
+        nonlocal time_series_view
 
-# Drop invalid rows where Year is not present
-air_quality_df = air_quality_df.dropna(subset=['Year'])
-air_quality_df['Year'] = pd.to_numeric(air_quality_df['Year'], errors='coerce')
+        # Enforce maximum city selection limit
+        selected_cities = time_city_select.value[:MAX_TIME_SERIES_CITIES]
+        time_city_select.value = selected_cities
 
-# Prepare Grouped Bar Chart Data with Sorting
-def prepare_grouped_bar_chart_data(selected_countries, selected_year, sort_by_pollutant='PM2.5'):
-    filtered_data = air_quality_df[air_quality_df['Year'] == selected_year]
-    filtered_data = filtered_data[filtered_data['Country'].isin(selected_countries)]
-    grouped_data = filtered_data.groupby(['Country'])[pollutant_columns].mean().reset_index()
-    
-    # Sort based on the selected pollutant values (descending order)
-    grouped_data = grouped_data.sort_values(by=sort_by_pollutant, ascending=False)
-    
-    return grouped_data
+        # Parse selected year ("All" keeps every year)
+        selected_year = time_year_select.value
 
-# Initialize ColumnDataSource for Grouped Bar Chart
-grouped_bar_source = ColumnDataSource(data=dict(Country=[], PM2_5=[], PM10=[], Ozone=[], NO2=[], SO2=[], CO=[]))
+        # Daily means per selected city, from the City index
+        city_daily = {}
+        for city in selected_cities:
+            city_data = store.city_daily_index.rows(city)
+            if selected_year != "All":
+                city_data = city_data[city_data['Date'].dt.year == int(selected_year)]
+            if not city_data.empty:
+                city_daily[city] = city_data
+
+        # Fill each (pollutant, city slot) line, skipping lines that already
+        # show the right city and year
+        changed = False
+        for (pollutant, slot), line in time_series_lines.items():
+            city = selected_cities[slot] if slot < len(selected_cities) else None
+            key = (city, selected_year) if city in city_daily else None
+            if key == time_series_line_keys[(pollutant, slot)]:
+                continue
+            time_series_line_keys[(pollutant, slot)] = key
+            changed = True
 
-# Create Grouped Bar Chart Figure
-grouped_bar_fig = figure(
-    y_range=FactorRange(),
-    height=600,
-    width=1000,
-    title="Grouped Bar Chart: Pollutant Concentrations",
-    tools="pan,box_zoom,reset,save",
-    toolbar_location="above"
-)
+            if key is None:
+                time_series_full.pop((pollutant, slot), None)
+                line.data_source.data = {"x": [], "y": [], "pollutant": [], "city": [], "unit": []}
+                continue
 
-# Add grouped bars for each pollutant (horizontal bars)
-pollutant_colors = Category20[len(pollutant_columns)]
-bar_width = 0.15  # Width for each bar
-
-for i, pollutant in enumerate(pollutant_columns):
-    grouped_bar_fig.hbar(
-        y=dodge('Country', -0.3 + (i * bar_width), range=grouped_bar_fig.y_range),
-        right=pollutant,
-        height=bar_width,
-        source=grouped_bar_source,
-        color=pollutant_colors[i],
-        legend_label=pollutant
+            series = city_daily[city][['Date', pollutant]].dropna()
+            time_series_full[(pollutant, slot)] = (datetime_ms(series['Date']), series[pollutant].to_numpy(dtype='float64'))
+            line.glyph.line_color = city_color_map[city]
+
+        # A new selection starts from its whole date span
+        if changed:
+            time_series_view = None
+            for pollutant, slot in time_series_full:
+                draw_time_series_line(pollutant, slot)
+
+        update_time_series_visibility(None, None, None)
+
+    def requery_time_series(event):
+        # Re-pick the drawn points for the new x-range after a pan or zoom
+        nonlocal time_series_view
+        time_series_view = (event.x0, event.x1)
+        for pollutant, slot in time_series_full:
+            draw_time_series_line(pollutant, slot)
+
+    # Toggle legend visibility
+    def toggle_legend():
+        for legend in time_series_fig.right:
+            if isinstance(legend, Legend):
+                legend.visible = not legend.visible
+
+    legend_toggle_button.on_click(instrumented(toggle_legend))
+
+    # Attach callbacks
+    def limit_city_selection(attr, old, new):
+        if len(new) > MAX_TIME_SERIES_CITIES:
+            time_city_select.value = old[:MAX_TIME_SERIES_CITIES]
+
+    unit_filter_checkboxes.on_change("active", instrumented(update_time_series_visibility))
+    time_city_select.on_change("value", instrumented(limit_city_selection))
+    time_year_select.on_change("value", instrumented(update_time_series))
+    time_city_select.on_change("value", instrumented(update_time_series))
+    time_series_fig.on_event(RangesUpdate, instrumented(requery_time_series))
+
+    # Initial call to update
+    update_time_series(None, None, None)
+
+    def stream_time_series(cities):
+        for (pollutant, slot), key in time_series_line_keys.items():
+            if key is None or key[0] not in cities:
+                continue
+            city, year = key
+            city_data = store.city_daily_index.rows(city)
+            if year != "All":
+                city_data = city_data[city_data['Date'].dt.year == int(year)]
+            series = city_data[['Date', pollutant]].dropna()
+            x, y = datetime_ms(series['Date']), series[pollutant].to_numpy(dtype='float64')
+            old_x, old_y = time_series_full[(pollutant, slot)]
+            time_series_full[(pollutant, slot)] = (x, y)
+
+            line_source = time_series_lines[(pollutant, slot)].data_source
+            if not extends_drawn_series(len(line_source.data['x']), old_x, old_y, x, y, time_series_fig.width):
+                draw_time_series_line(pollutant, slot)
+            elif len(x) > len(old_x):
+                added = len(x) - len(old_x)
+                line_source.stream({
+                    "x": x[len(old_x):],
+                    "y": y[len(old_x):],
+                    "pollutant": [pollutant] * added,
+                    "city": [city] * added,
+                    "unit": [pollutants[pollutant]] * added
+                })
+
+    def refresh_live(changes):
+        # Live rows may bring new years and cities into the pickers
+        time_year_select.options = [str(year) for year in store.years] + ["All"]
+        time_city_select.options = store.cities
+        for city in store.cities:
+            city_color_map.setdefault(city, next(color_cycle))
+        if changes is None:
+            for key in time_series_line_keys:
+                time_series_line_keys[key] = None
+            update_time_series(None, None, None)
+        else:
+            stream_time_series(changes.cities)
+
+    def reset():
+        for key in time_series_line_keys:
+            time_series_line_keys[key] = None
+        time_series_full.clear()
+        update_time_series_visibility(None, None, None)
+
+    register_tab([time_series_fig], reset, refresh_live)
+
+    # Layout
+    return column(
+        row(time_year_select, time_city_select),
+        unit_filter_checkboxes,
+        legend_toggle_button,
+        time_series_fig
     )
 
-# Customize axes and legend
-grouped_bar_fig.yaxis.axis_label = "Country"
-grouped_bar_fig.xaxis.axis_label = "Average Concentration"
-grouped_bar_fig.legend.title = "Pollutants"
-grouped_bar_fig.legend.location = "top_right"
-grouped_bar_fig.legend.click_policy = "hide"
-
-# Dropdown for country selection
-grouped_bar_country_select = MultiSelect(
-    title="Select Countries:",
-    value=["USA", "India", "China"],
-    options=list(air_quality_df['Country'].unique()),
-    size=8,
-    width=300
-)
 
-# Slider for Single Year Selection
-grouped_bar_year_slider = Slider(
-    title="Select Year:",
-    start=int(air_quality_df['Year'].min()),
-    end=int(air_quality_df['Year'].max()),
-    value=int(air_quality_df['Year'].max()),
-    step=1,
-    width=400,
-    bar_color="#FAFAFA",
-    css_classes=["custom-slider"]
-)
+# ---- Grouped Bar Chart Tab ----
+def build_grouped_bar_tab():
+    """Yearly pollutant averages of the selected countries."""
+    # Yearly pollutant averages per country (rolled up from the aggregate cube)
+    country_year_means = store.map_data
 
-# Update Grouped Bar Chart Data
-def update_grouped_bar_chart(attr, old, new):
-    selected_countries = grouped_bar_country_select.value
-    selected_year = grouped_bar_year_slider.value
-
-    # Call the function and automatically sort by 'PM2.5'
-    grouped_data = prepare_grouped_bar_chart_data(selected_countries, selected_year, sort_by_pollutant='PM2.5')
-
-    # Update the grouped bar chart data source
-    grouped_bar_source.data = {
-        'Country': grouped_data['Country'],
-        'PM2.5': grouped_data['PM2.5'],
-        'PM10': grouped_data['PM10'],
-        'Ozone': grouped_data['Ozone'],
-        'NO2': grouped_data['NO2'],
-        'SO2': grouped_data['SO2'],
-        'CO': grouped_data['CO']
-    }
+    # Prepare Grouped Bar Chart Data with Sorting
+    @memoized('grouped_bar_data')
+    def prepare_grouped_bar_chart_data(version, selected_countries, selected_year, sort_by_pollutant='PM2.5'):
+        filtered_data = store.map_index.rows(selected_year)
+        filtered_data = filtered_data[filtered_data['Country'].isin(selected_countries)]
+        grouped_data = filtered_data[['Country'] + pollutant_columns]
 
-    # Update y_range with sorted country names for horizontal bar chart
-    grouped_bar_fig.y_range.factors = list(grouped_data['Country'])
-    grouped_bar_fig.title.text = f"Grouped Bar Chart: Pollutant Concentrations ({selected_year})"
+        # Sort based on the selected pollutant values (descending order)
+        grouped_data = grouped_data.sort_values(by=sort_by_pollutant, ascending=False)
 
-# Attach update functions to widgets
-grouped_bar_country_select.on_change("value", update_grouped_bar_chart)
-grouped_bar_year_slider.on_change("value", update_grouped_bar_chart)
+        return grouped_data
 
-# Initialize Grouped Bar Chart Data
-update_grouped_bar_chart(None, None, None)
+    # Initialize ColumnDataSource for Grouped Bar Chart
+    grouped_bar_source = ColumnDataSource(data=dict(Country=[], PM2_5=[], PM10=[], Ozone=[], NO2=[], SO2=[], CO=[]))
 
-# Layout for Grouped Bar Chart Tab
-grouped_bar_tab = TabPanel(
-    child=column(row(grouped_bar_country_select, grouped_bar_year_slider), grouped_bar_fig),
-    title="Grouped Bar Chart"
-)
+    # Create Grouped Bar Chart Figure
+    grouped_bar_fig = figure(
+        y_range=FactorRange(),
+        height=600,
+        width=1000,
+        title="Grouped Bar Chart: Pollutant Concentrations",
+        tools="pan,box_zoom,reset,save",
+        toolbar_location="above"
+    )
 
+    # Add grouped bars for each pollutant (horizontal bars)
+    pollutant_colors = Category20[len(pollutant_columns)]
+    bar_width = 0.15  # Width for each bar
+
+    for i, pollutant in enumerate(pollutant_columns):
+        grouped_bar_fig.hbar(
+            y=dodge('Country', -0.3 + (i * bar_width), range=grouped_bar_fig.y_range),
+            right=pollutant,
+            height=bar_width,
+            source=grouped_bar_source,
+            color=pollutant_colors[i],
+            legend_label=pollutant
+        )
 
-# ---- Map Plot Tab ----
+    # Customize axes and legend
+    grouped_bar_fig.yaxis.axis_label = "Country"
+    grouped_bar_fig.xaxis.axis_label = "Average Concentration"
+    grouped_bar_fig.legend.title = "Pollutants"
+    grouped_bar_fig.legend.location = "top_right"
+    grouped_bar_fig.legend.click_policy = "hide"
+
+    # Dropdown for country selection
+    grouped_bar_country_select = MultiSelect(
+        title="Select Countries:",
+        value=["USA", "India", "China"],
+        options=list(country_year_means['Country'].unique()),
+        size=8,
+        width=300,
+        name="grouped_bar_country_select"
+    )
 
-# Load Dataset
-file_path = 'expanded_air_quality_data.csv'
-data = pd.read_csv(file_path)
-
-# Ensure numeric columns are correctly typed
-for col in ['PM2.5', 'AQI', 'PM10', 'CO', 'SO2', 'NO2', 'Ozone']:
-    data[col] = pd.to_numeric(data[col], errors='coerce')
-
-# Parse dates with the correct format (dd-mm-yyyy)
-data['Date'] = pd.to_datetime(data['Date'], format='%d-%m-%Y', errors='coerce')
-
-# Add year column
-data['Year'] = data['Date'].dt.year
-
-# Select only numeric columns for aggregation
-numeric_columns = ['PM2.5', 'AQI', 'PM10', 'CO', 'SO2', 'NO2', 'Ozone']
-map_data = data.groupby(['Country', 'Year'])[numeric_columns].mean().reset_index()
-
-# Load GeoJSON File (replace with the path to your shapefile)
-shapefile_path = "ne_110m_admin_0_countries/ne_110m_admin_0_countries.shp"
-world = gpd.read_file(shapefile_path)
-
-# Merge GeoJSON with Dataset
-merged_data = world.merge(map_data, left_on='NAME', right_on='Country', how='left')
-
-# Initialize GeoJSONDataSource
-geo_source = GeoJSONDataSource(geojson=merged_data.to_json())
-
-# Prepare Map Figure
-map_fig = figure(
-    title="Interactive Map: PM2.5 by Country",
-    width=1000,
-    height=600,
-    tools="pan,wheel_zoom,reset,save,hover",
-    toolbar_location="left",
-    background_fill_color="lightblue",
-    background_fill_alpha=0.9,
-    x_range=(-180, 180),  # Fix x-axis range to cover the world
-    y_range=(-90, 90)     # Fix y-axis range to cover the world
-)
+    # Slider for Single Year Selection
+    grouped_bar_year_slider = Slider(
+        title="Select Year:",
+        start=int(country_year_means['Year'].min()),
+        end=int(country_year_means['Year'].max()),
+        value=int(country_year_means['Year'].max()),
+        step=1,
+        width=400,
+        bar_color="#FAFAFA",
+        css_classes=["custom-slider"],
+        name="grouped_bar_year_slider"
+    )
 
-# Define Color Mapping
-color_mapper = LinearColorMapper(
-    palette=Viridis256,
-    low=merged_data['PM2.5'].min(skipna=True),
-    high=merged_data['PM2.5'].max(skipna=True),
-    nan_color="white"
-)
+    # Update Grouped Bar Chart Data
+    def update_grouped_bar_chart(attr, old, new):
+        selected_countries = tuple(sorted(grouped_bar_country_select.value))  # Selection order does not matter
+        selected_year = grouped_bar_year_slider.value
+
+        # Call the function and automatically sort by 'PM2.5'
+        grouped_data = prepare_grouped_bar_chart_data(store.version, selected_countries, selected_year, 'PM2.5')
+
+        # Update the grouped bar chart data source
+        grouped_bar_source.data = {
+            'Country': grouped_data['Country'],
+            'PM2.5': grouped_data['PM2.5'],
+            'PM10': grouped_data['PM10'],
+            'Ozone': grouped_data['Ozone'],
+            'NO2': grouped_data['NO2'],
+            'SO2': grouped_data['SO2'],
+            'CO': grouped_data['CO']
+        }
 
-# Add Patches to Map
-# Add Patches to Map (Only Once)
-map_fig.patches(
-    'xs', 'ys',
-    source=geo_source,
-    fill_color=linear_cmap(
-        'display_value', palette=Viridis256, low=color_mapper.low, high=color_mapper.high, nan_color="white"
-    ),
-    line_color="black",
-    line_width=0.5,
-    fill_alpha=0.7
-)
+        # Update y_range with sorted country names for horizontal bar chart
+        grouped_bar_fig.y_range.factors = list(grouped_data['Country'])
+        grouped_bar_fig.title.text = f"Grouped Bar Chart: Pollutant Concentrations ({selected_year})"
 
-# Add Enhanced Hover Tool
-map_hover = HoverTool(tooltips=[
-    ("Country", "@NAME"),
-    ("Year", "@Year"),
-    ("PM2.5 (µg/m³)", "@{PM2.5}{0.2f}"),
-    ("AQI", "@AQI{0.2f}"),
-    ("PM10 (µg/m³)", "@PM10{0.2f}"),
-    ("CO (ppm)", "@CO{0.2f}"),
-    ("SO2 (µg/m³)", "@SO2{0.2f}"),
-    ("NO2 (µg/m³)", "@NO2{0.2f}"),
-    ("Ozone (µg/m³)", "@Ozone{0.2f}"),
-    ("Selected Pollutant", "@display_value{0.2f}")
-])
-map_fig.add_tools(map_hover)
-
-# Add Color Bar
-color_bar = ColorBar(
-    color_mapper=color_mapper,
-    label_standoff=12,
-    location=(0, 0),
-    title="Pollutant Level"
-)
-map_fig.add_layout(color_bar, 'right')
+    # Attach update functions to widgets
+    grouped_bar_country_select.on_change("value", instrumented(update_grouped_bar_chart))
+    grouped_bar_year_slider.on_change("value", instrumented(update_grouped_bar_chart))
 
-# Create a dynamic pollutant selector
-pollutant_select = Select(
-    title="Select Pollutant:",
-    value="PM2.5",
-    options=numeric_columns
-)
+    # Initialize Grouped Bar Chart Data
+    update_grouped_bar_chart(None, None, None)
 
-# Create year dropdown
-year_select = Select(
-    title="Select Year:",
-    value=str(int(data['Year'].min())),
-    options=[str(year) for year in sorted(data['Year'].dropna().unique())]
-)
+    def refresh_live(changes):
+        # Live rows may bring new countries and years into the pickers
+        grouped_bar_country_select.options = store.countries
+        grouped_bar_year_slider.start, grouped_bar_year_slider.end = store.years[0], store.years[-1]
+        if changes is None or grouped_bar_year_slider.value in changes.years:
+            update_grouped_bar_chart(None, None, None)
 
-# Create a Slider for Year Selection
-year_slider = Slider(
-    start=int(data['Year'].min()), 
-    end=int(data['Year'].max()), 
-    value=int(data['Year'].min()), 
-    step=1, 
-    title="Select Year",
-    bar_color='#FAFAFA',  # Ensures the slider starts with a white bar
-    css_classes=["custom-slider"]
-)
+    initial_grouped_bar_source = grouped_bar_source.data.copy()
 
-# Updated Map Initialization
-def update_map(attr, old, new):
-    selected_pollutant = pollutant_select.value
-    selected_year = int(year_slider.value)
+    def reset():
+        grouped_bar_source.data = initial_grouped_bar_source
+        grouped_bar_year_slider.value = grouped_bar_year_slider.start
 
-    # Step 1: Filter and prepare data for the selected year
-    year_data = map_data[map_data['Year'] == selected_year]
-    merged = world.merge(year_data, left_on='NAME', right_on='Country', how='left')
+    register_tab([grouped_bar_fig], reset, refresh_live)
 
-    # Step 2: Update display_value for the selected pollutant
-    merged['display_value'] = merged[selected_pollutant].apply(
-        lambda x: None if pd.isna(x) or x == 0 else x
-    )
+    # Layout for Grouped Bar Chart Tab
+    return column(row(grouped_bar_country_select, grouped_bar_year_slider), grouped_bar_fig)
 
-    # Step 3: Update GeoJSON data without re-rendering the map
-    geo_source.geojson = merged.to_json()
-
-    # Step 4: Dynamically adjust the color mapper range without recreating it
-    valid_data = merged['display_value'].dropna()
-    if not valid_data.empty:
-        color_mapper.low = valid_data.min()
-        color_mapper.high = valid_data.max()
-
-    # Step 5: Update only the title dynamically
-    map_fig.title.text = f"Interactive Map: {selected_pollutant} in {selected_year}"
-
-
-# Global Variables for Animation State
-animation_running = False
-callback_id = None  # Initialize callback_id to None globally
-
-# Animation Logic
-def animate():
-    current_year = int(year_slider.value)
-    if current_year < int(year_slider.end):
-        year_slider.value = current_year + 1  # Increment year slider
-    else:
-        stop_animation()  # Stop when reaching the last year
-
-def toggle_animation():
-    """Start or stop the animation."""
-    global animation_running, callback_id
-    if not animation_running:
-        animation_running = True
-        animate_button.label = "Stop"
-        callback_id = curdoc().add_periodic_callback(animate, 1000)  # 1000ms interval
-    else:
-        stop_animation()
 
-def stop_animation():
-    """Stop the animation and reset the button."""
-    global animation_running, callback_id
-    if animation_running and callback_id:
-        curdoc().remove_periodic_callback(callback_id)
-        animation_running = False
-        animate_button.label = "Play"
+# ---- Map Plot Tab ----
+def build_map_tab():
+    """World map of one pollutant and year, with animation."""
+    # Select only numeric columns for aggregation
+    numeric_columns = ['PM2.5', 'AQI', 'PM10', 'CO', 'SO2', 'NO2', 'Ozone']
+    map_data = store.map_data
+
+    # Country outlines as static patches coordinates, and the per-(year, pollutant)
+    # value vectors in the same country order (both precomputed once per process)
+    map_patches = store.map_patches
+    missing_values = np.full(len(map_patches['NAME']), np.nan)
+
+    def map_value_columns(selected_pollutant, selected_year):
+        """Value columns of the map source for one pollutant and year."""
+        columns = {col: store.map_values.get((selected_year, col), missing_values) for col in numeric_columns}
+        selected = columns[selected_pollutant]
+        columns['display_value'] = np.where(selected == 0, np.nan, selected)  # Zero is treated as no data
+        columns['Year'] = np.full(len(selected), selected_year)
+        return columns
+
+    # Initialize ColumnDataSource (outlines are sent once; updates swap value columns)
+    map_source = ColumnDataSource(data=dict(map_patches, **map_value_columns("PM2.5", store.years[0])))
+
+    # Prepare Map Figure
+    map_fig = figure(
+        title="Interactive Map: PM2.5 by Country",
+        width=1000,
+        height=600,
+        tools="pan,wheel_zoom,reset,save,hover",
+        toolbar_location="left",
+        background_fill_color="lightblue",
+        background_fill_alpha=0.9,
+        x_range=(-180, 180),  # Fix x-axis range to cover the world
+        y_range=(-90, 90)     # Fix y-axis range to cover the world
+    )
 
-# Reset Functionality
-def reset_animation():
-    """Reset slider to start year and stop animation."""
-    stop_animation()
-    year_slider.value = year_slider.start  # Reset slider to the starting year
-    update_map(None, None, None)  # Update the map to reflect the reset year
-
-# Attach Button Callbacks
-animate_button = Button(label="Play", button_type="success")
-reset_button = Button(label="Reset", button_type="warning", width=100)
-
-animate_button.on_click(toggle_animation)
-reset_button.on_click(reset_animation)
-
-# Update Map Function
-def update_map(attr, old, new):
-    selected_pollutant = pollutant_select.value
-    selected_year = int(year_slider.value)
-
-    # Filter and merge data for the selected year
-    year_data = map_data[map_data['Year'] == selected_year]
-    filtered_data = world.copy()
-    merged = filtered_data.merge(year_data, left_on='NAME', right_on='Country', how='left')
-
-    # Assign display_value for visualization
-    merged['display_value'] = merged[selected_pollutant].apply(
-        lambda x: None if pd.isna(x) or x == 0 else x
+    # Define Color Mapping
+    color_mapper = LinearColorMapper(
+        palette=Viridis256,
+        low=map_data['PM2.5'].min(skipna=True),
+        high=map_data['PM2.5'].max(skipna=True),
+        nan_color="white"
     )
-    # Update GeoJSON source
-    geojson_data = merged.to_json()
-    geo_source.geojson = geojson_data
-
-    # Update color mapper range dynamically
-    valid_data = merged['display_value'].dropna()
-    if not valid_data.empty:
-        color_mapper.low = valid_data.min()  # Dynamically set low value
-        color_mapper.high = valid_data.max()  # Dynamically set high value
-    else:
-        color_mapper.low, color_mapper.high = 0, 1  # Default values if no data
-        
-    map_fig.renderers = []  # Clear previous patches
+
+    # Add Patches to Map (Only Once). The renderer and its colour mapper are
+    # kept for the lifetime of the session; updates only change the source's
+    # value columns and the mapper's low/high.
     map_fig.patches(
         'xs', 'ys',
-        source=geo_source,
-        fill_color=linear_cmap(
-            'display_value', palette=Viridis256, 
-            low=color_mapper.low, high=color_mapper.high, 
-            nan_color="white"
-        ),
+        source=map_source,
+        fill_color={'field': 'display_value', 'transform': color_mapper},
         line_color="black",
         line_width=0.5,
         fill_alpha=0.7
     )
 
-    # Update map title
-    map_fig.title.text = f"Interactive Map: {selected_pollutant} in {selected_year}"
+    # Add Enhanced Hover Tool
+    map_hover = HoverTool(tooltips=[
+        ("Country", "@NAME"),
+        ("Year", "@Year"),
+        ("PM2.5 (µg/m³)", "@{PM2.5}{0.2f}"),
+        ("AQI", "@AQI{0.2f}"),
+        ("PM10 (µg/m³)", "@PM10{0.2f}"),
+        ("CO (ppm)", "@CO{0.2f}"),
+        ("SO2 (µg/m³)", "@SO2{0.2f}"),
+        ("NO2 (µg/m³)", "@NO2{0.2f}"),
+        ("Ozone (µg/m³)", "@Ozone{0.2f}"),
+        ("Selected Pollutant", "@display_value{0.2f}")
+    ])
+    map_fig.add_tools(map_hover)
+
+    # Add Color Bar
+    color_bar = ColorBar(
+        color_mapper=color_mapper,
+        label_standoff=12,
+        location=(0, 0),
+        title="Pollutant Level"
+    )
+    map_fig.add_layout(color_bar, 'right')
+
+    # Create a dynamic pollutant selector
+    pollutant_select = Select(
+        title="Select Pollutant:",
+        value="PM2.5",
+        options=numeric_columns,
+        name="pollutant_select"
+    )
 
+    # Create a Slider for Year Selection
+    year_slider = Slider(
+        start=store.years[0], 
+        end=store.years[-1], 
+        value=store.years[0], 
+        step=1, 
+        title="Select Year",
+        bar_color='#FAFAFA',  # Ensures the slider starts with a white bar
+        css_classes=["custom-slider"],
+        name="year_slider"
+    )
 
+    # Browser-side animation: every year's value vectors are sent to the
+    # browser once, and stepping the slider (by hand or from Play) swaps them
+    # into the displayed columns in JS, at the chosen frame rate, without a
+    # server round-trip per frame
+    map_js_toggle = Toggle(label="Animate in browser", active=False, width=200)
+    map_fps_spinner = Spinner(title="Frames per second", low=1, high=60, step=1, value=10, width=120)
+    map_preloaded_version = None
+
+    def map_year_columns():
+        """Every measure's value vector for every slider year, named ``measure|year``."""
+        return {
+            f"{col}|{year}": store.map_values.get((year, col), missing_values)
+            for year in range(year_slider.start, year_slider.end + 1) for col in numeric_columns
+        }
 
+    year_slider.js_on_change('value', CustomJS(
+        args=dict(toggle=map_js_toggle, source=map_source, mapper=color_mapper, title=map_fig.title, pollutant=pollutant_select, measures=numeric_columns),
+        code="""
+        if (!toggle.active)
+            return
+        const year = cb_obj.value
+        const data = source.data
+        for (const measure of measures)
+            data[measure] = data[`${measure}|${year}`]
+        const display = Array.from(data[pollutant.value], (v) => v === 0 ? NaN : v)  // Zero is treated as no data
+        data.display_value = display
+        data.Year = new Array(display.length).fill(year)
+        let low = Infinity, high = -Infinity
+        for (const v of display) {
+            if (v != null && !Number.isNaN(v)) {
+                low = Math.min(low, v)
+                high = Math.max(high, v)
+            }
+        }
+        mapper.low = low <= high ? low : 0
+        mapper.high = low <= high ? high : 1
+        title.text = `Interactive Map: ${pollutant.value} in ${year}`
+        source.change.emit()
+    """
+    ))
+
+    # Play/Stop in the browser; the timer is kept on the button's JS model
+    stop_js_animation = """
+        if (button._map_timer != null) {
+            clearInterval(button._map_timer)
+            button._map_timer = null
+            button.label = "Play"
+        }
+    """
+    play_js_animation = """
+        if (!toggle.active)
+            return
+        if (button._map_timer != null) {
+            clearInterval(button._map_timer)
+            button._map_timer = null
+            button.label = "Play"
+            return
+        }
+        button.label = "Stop"
+        button._map_timer = setInterval(() => {
+            if (slider.value < slider.end) {
+                slider.value = slider.value + 1
+            } else {
+                clearInterval(button._map_timer)
+                button._map_timer = null
+                button.label = "Play"
+            }
+        }, 1000 / Math.max(fps.value, 1))
+    """
 
-# Link Dropdowns and Slider to Map Update
-pollutant_select.on_change('value', lambda attr, old, new: update_map(None, None, None))
-year_slider.on_change('value', update_map)
+    # Global Variables for Animation State
+    animation_running = False
+    callback_id = None  # Initialize callback_id to None globally
+
+    # Animation Logic
+    def animate():
+        current_year = int(year_slider.value)
+        if current_year < int(year_slider.end):
+            year_slider.value = current_year + 1  # Increment year slider
+        else:
+            stop_animation()  # Stop when reaching the last year
+
+    def toggle_animation():
+        """Start or stop the animation."""
+        nonlocal animation_running, callback_id
+        if map_js_toggle.active:
+            return  # Animated in the browser
+        if not animation_running:
+            animation_running = True
+            animate_button.label = "Stop"
+            callback_id = curdoc().add_periodic_callback(instrumented(animate), 1000)  # 1000ms interval
+        else:
+            stop_animation()
+
+    def stop_animation():
+        """Stop the animation and reset the button."""
+        nonlocal animation_running
+        if animation_running and callback_id:
+            curdoc().remove_periodic_callback(callback_id)
+            animation_running = False
+            animate_button.label = "Play"
+
+    # Reset Functionality
+    def reset_animation():
+        """Reset slider to start year and stop animation."""
+        stop_animation()
+        year_slider.value = year_slider.start  # Reset slider to the starting year
+        update_map(None, None, None)  # Update the map to reflect the reset year
+
+    # Attach Button Callbacks
+    animate_button = Button(label="Play", button_type="success")
+    reset_button = Button(label="Reset", button_type="warning", width=100)
+
+    animate_button.on_click(instrumented(toggle_animation))
+    reset_button.on_click(instrumented(reset_animation))
+    animate_button.js_on_event('button_click', CustomJS(
+        args=dict(toggle=map_js_toggle, button=animate_button, slider=year_slider, fps=map_fps_spinner), code=play_js_animation
+    ))
+    reset_button.js_on_event('button_click', CustomJS(args=dict(button=animate_button), code=stop_js_animation))
+    map_js_toggle.js_on_change('active', CustomJS(args=dict(button=animate_button), code=stop_js_animation))
+
+    # Update Map Function
+    def update_map(attr, old, new):
+        nonlocal map_preloaded_version
+        selected_pollutant = pollutant_select.value
+        selected_year = int(year_slider.value)
+
+        # Swap in the precomputed value columns for the selected year
+        columns = map_value_columns(selected_pollutant, selected_year)
+        map_source.data.update(columns)
+
+        # Update color mapper range dynamically
+        valid_data = columns['display_value'][~np.isnan(columns['display_value'])]
+        if valid_data.size:
+            color_mapper.low = valid_data.min()  # Dynamically set low value
+            color_mapper.high = valid_data.max()  # Dynamically set high value
+        else:
+            color_mapper.low, color_mapper.high = 0, 1  # Default values if no data
+
+        # Update map title
+        map_fig.title.text = f"Interactive Map: {selected_pollutant} in {selected_year}"
+
+        # Browser-side animation needs every year, resent only after live appends
+        if map_js_toggle.active and map_preloaded_version != store.version:
+            map_source.data.update(map_year_columns())
+            map_preloaded_version = store.version
+
+    def update_map_year(attr, old, new):
+        # When animating in the browser the year is already drawn there
+        if not map_js_toggle.active:
+            update_map(attr, old, new)
+
+    def update_map_mode(attr, old, new):
+        stop_animation()
+        update_map(None, None, None)
 
-# Add a JavaScript callback to modify the slider bar
-# Add a JavaScript callback to ensure the slider bar stays white
-slider_callback = CustomJS(args=dict(slider=year_slider), code="""
-    // Access the slider element in the DOM
-    let sliderElement = slider.el.querySelector('.noUi-connects');
-    
-    // Ensure the slider's line is fully #FAFAFA at all times
-    if (sliderElement) {
-        sliderElement.style.background = 'white';  // Set the slider line color to #FAFAFA
-    }
-""");
 
-# Attach the callback to the slider's value change
-year_slider.js_on_change("value", slider_callback)
 
 
-# Layout
-buttons_layout = row(animate_button, reset_button, sizing_mode='stretch_width')
-map_layout = column(pollutant_select, year_slider, buttons_layout, map_fig)
+    # Link Dropdowns and Slider to Map Update
+    pollutant_select.on_change('value', instrumented(lambda attr, old, new: update_map(None, None, None), name='update_map'))
+    year_slider.on_change('value', instrumented(update_map_year))
+    map_js_toggle.on_change('active', instrumented(update_map_mode))
 
+    # Add a JavaScript callback to modify the slider bar
+    # Add a JavaScript callback to ensure the slider bar stays white
+    slider_callback = CustomJS(args=dict(slider=year_slider), code="""
+        // Access the slider element in the DOM
+        let sliderElement = slider.el.querySelector('.noUi-connects');
 
-# Initialize Map with Default Settings
-update_map(None, None, None)
+        // Ensure the slider's line is fully #FAFAFA at all times
+        if (sliderElement) {
+            sliderElement.style.background = 'white';  // Set the slider line color to #FAFAFA
+        }
+    """);
 
-goespa_tab = TabPanel(child=map_layout, title="Pollutants Map")
+    # Attach the callback to the slider's value change
+    year_slider.js_on_change("value", slider_callback)
 
 
+    # Layout
+    buttons_layout = row(animate_button, reset_button, map_js_toggle, map_fps_spinner, sizing_mode='stretch_width')
+    map_layout = column(pollutant_select, year_slider, buttons_layout, map_fig)
 
-# ---- Box Plot Tab ----
-# Pollutant Columns with Units
-# Define a function to get units for pollutants
-def get_unit(pollutant):
-    units = {
-        "PM2.5": "µg/m³",
-        "PM10": "µg/m³",
-        "Ozone": "ppb",
-        "NO2": "ppb",
-        "SO2": "ppb",
-        "CO": "ppm"
-    }
-    return units.get(pollutant, "")
-
-
-# Prepare Data
-df['Month'] = df['Date'].dt.strftime('%b')  # Extract Month Abbreviation
-df['Year'] = df['Date'].dt.year  # Extract Year
-
-# Function to Prepare Boxplot Data
-def prepare_boxplot_data(data, pollutant, year, city):
-    filtered_data = data[(data['Year'] == year) & (data['City'] == city)]
-    boxplot_data = []
-    
-    for month in filtered_data['Month'].unique():
-        month_data = filtered_data[filtered_data['Month'] == month][pollutant].dropna()
-        if not month_data.empty:
-            boxplot_data.append({
-                'Month': month,
-                'Q1': month_data.quantile(0.25),
-                'Q2': month_data.median(),
-                'Q3': month_data.quantile(0.75),
-                'Lower': month_data.min(),
-                'Upper': month_data.max()
-            })
-    
-    return pd.DataFrame(boxplot_data)
-
-# Initialize Default Data
-# Define a function to get units for pollutants
-def get_unit(pollutant):
-    units = {
-        "PM2.5": "µg/m³",
-        "PM10": "µg/m³",
-        "Ozone": "ppb",
-        "NO2": "ppb",
-        "SO2": "ppb",
-        "CO": "ppm"
-    }
-    return units.get(pollutant, "")
-
-# Prepare Data
-df['Month'] = df['Date'].dt.strftime('%b')  # Extract Month Abbreviation
-df['Year'] = df['Date'].dt.year  # Extract Year
-
-# Group data for pollutants by city, year, and month
-box_data = df.groupby(['City', 'Year', 'Month'])[pollutant_columns].describe().reset_index()
-
-# Default selections
-default_city = box_data['City'].unique()[0]
-default_year = box_data['Year'].min()
-default_pollutant = 'PM2.5'
-
-# Function to prepare boxplot data
-# Function to prepare boxplot data
-def prepare_boxplot_data(city, year, pollutant):
-    filtered = box_data[(box_data['City'] == city) & (box_data['Year'] == year)]
-    
-    # Extract quartile statistics
-    q1 = filtered[(pollutant, '25%')]
-    q2 = filtered[(pollutant, '50%')]  # Median
-    q3 = filtered[(pollutant, '75%')]
-    lower = filtered[(pollutant, 'min')]
-    upper = filtered[(pollutant, 'max')]
-    months = filtered['Month']
-
-    return ColumnDataSource(data=dict(
-        Month=months,
-        Lower=lower,
-        Q1=q1,
-        Median=q2,
-        Q3=q3,
-        Upper=upper
-    )), lower.min(), upper.max()  # Return min and max for y-axis adjustment
-
-
-# Initialize data for the default display
-box_source, global_min, global_max = prepare_boxplot_data(default_city, default_year, default_pollutant)
-
-# Box Plot Figure
-box_fig = figure(
-    title=f"{default_pollutant} ({get_unit(default_pollutant)}) Distribution by Month for {default_city} ({default_year})",
-    x_axis_label="Month",
-    y_axis_label=f"Concentration ({get_unit(default_pollutant)})",
-    width=1000,
-    height=600,
-    tools="pan,box_zoom,reset,save",
-    x_range=sorted(box_source.data['Month']),  # Ensure month names are sorted
-    y_range=(global_min * 0.9, global_max * 1.1)  # Dynamically set y-range
-)
 
-# Add boxes (Q1 to Q3)
-box_fig.vbar(
-    x='Month', width=0.7, top='Q3', bottom='Q1',
-    source=box_source, fill_color="lightblue", line_color="black"
-)
+    # Initialize Map with Default Settings
+    update_map(None, None, None)
 
-# Add whiskers for min and max
-whisker = Whisker(base="Month", lower="Lower", upper="Upper", source=box_source, line_width=2)
-box_fig.add_layout(whisker)
+    def refresh_live(changes):
+        # Widen the slider first, so the browser-side preload covers new years
+        year_slider.start, year_slider.end = store.years[0], store.years[-1]
+        if changes is None or int(year_slider.value) in changes.years or map_js_toggle.active:
+            update_map(None, None, None)
 
-# Add median markers
-box_fig.scatter(x='Month', y='Median', size=8, color="red", source=box_source)
+    initial_map_values = {col: map_source.data[col] for col in map_source.data if col not in map_patches}
 
-# Add hover tool
-hover = HoverTool(
-    tooltips=[
-        ("Month", "@Month"),
-        ("Q1 (25%)", "@Q1{0.2f}"),
-        ("Median (50%)", "@Median{0.2f}"),
-        ("Q3 (75%)", "@Q3{0.2f}"),
-        ("Min", "@Lower{0.2f}"),
-        ("Max", "@Upper{0.2f}")
-    ],
-    mode="mouse"
-)
-box_fig.add_tools(hover)
-
-# Dropdowns for city, year, and pollutant
-box_city_select = Select(title="Select City:", value=default_city, options=sorted(box_data['City'].unique()))
-box_year_select = Select(
-    title="Select Year:",
-    value=str(default_year),
-    options=[str(year) for year in sorted(box_data['Year'].unique())]
-)
-box_pollutant_select = Select(title="Select Pollutant:", value=default_pollutant, options=pollutant_columns)
-
-# Update function
-def update_box_plot(attr, old, new):
-    selected_city = box_city_select.value
-    selected_year = int(box_year_select.value)
-    selected_pollutant = box_pollutant_select.value
-    
-    # Prepare new data
-    new_source, new_min, new_max = prepare_boxplot_data(selected_city, selected_year, selected_pollutant)
-    box_source.data.update(new_source.data)
-    
-    # Update y-range dynamically
-    box_fig.y_range.start = new_min * 0.9
-    box_fig.y_range.end = new_max * 1.1
-
-    # Update title
-    box_fig.title.text = f"{selected_pollutant} ({get_unit(selected_pollutant)}) Distribution by Month for {selected_city} ({selected_year})"
-
-# Attach callbacks
-box_city_select.on_change("value", update_box_plot)
-box_year_select.on_change("value", update_box_plot)
-box_pollutant_select.on_change("value", update_box_plot)
-
-# Layout
-box_plot_layout = column(row(box_city_select, box_year_select, box_pollutant_select), box_fig)
-
-boxplot_tab = TabPanel(child=box_plot_layout, title="Box Plot")
-
-
-# ---- stacked area plot Tab ----
-
-
-# Load dataset
-df = pd.read_csv('expanded_air_quality_data.csv')  # Update this path
-df['Date'] = pd.to_datetime(df['Date'], dayfirst=True)
-
-# Pollutant and unit mappings
-pollutants_units = {
-    'PM2.5': 'µg/m³',
-    'PM10': 'µg/m³',
-    'Ozone': 'ppb',
-    'NO2': 'ppb',
-    'SO2': 'ppb',
-    'CO': 'ppm'
-}
-
-# Add colors for pollutants
-pollutant_colors = {
-    'PM2.5': 'dodgerblue',
-    'PM10': 'orange',
-    'Ozone': 'green',
-    'NO2': 'red',
-    'SO2': 'purple',
-    'CO': 'brown'
-}
-
-# Preprocess data
-df_long = pd.melt(df, id_vars=['Date'], value_vars=pollutants_units.keys(),
-                  var_name='Pollutant', value_name='Concentration')
-df_long['Unit'] = df_long['Pollutant'].map(lambda x: pollutants_units[x])
-df_long['Color'] = df_long['Pollutant'].map(lambda x: pollutant_colors[x])
-
-# Extract unique years and units
-years = sorted(df_long['Date'].dt.year.unique())
-units = list(set(pollutants_units.values()))  # Unique units
-initial_unit = units[0]
-initial_year = years[0]
-
-# Initialize ColumnDataSource
-source = ColumnDataSource(data={'Date': [], 'Concentration': []})
-
-# Create the figure
-plot = figure(title=f"Pollutant Concentrations Over Time ({initial_year})",
-              x_axis_label="Date", y_axis_label="Concentration",
-              x_axis_type="datetime", width=900, height=500,
-              tools="pan,box_zoom,reset,save")
-
-# Add hover tool
-hover = HoverTool(tooltips=[
-    ("Date", "@Date{%F}"),
-    ("Pollutant", "$name"),
-    ("Concentration", "@$name{0.2f}"),
-    ("Unit", "@Unit")
-], formatters={'@Date': 'datetime'}, mode='vline')
-plot.add_tools(hover)
-
-
-
-# Function to prepare data
-def prepare_data(unit, year):
-    filtered = df_long[(df_long['Unit'] == unit) & (df_long['Date'].dt.year == year)]
-    if filtered.empty:  # If no data exists, return an empty DataFrame
-        return pd.DataFrame({'Date': [], 'Pollutant': [], 'Concentration': []})
-    grouped = filtered.groupby(['Date', 'Pollutant'])['Concentration'].mean().reset_index()
-    pivoted = grouped.pivot(index='Date', columns='Pollutant', values='Concentration').fillna(0)
-    return pivoted
-
-def update_plot(attr, old, new):
-    selected_unit = unit_dropdown.label
-    selected_year = int(year_dropdown.value)
-
-    pivoted = prepare_data(selected_unit, selected_year)
-    if pivoted.empty:  # Handle empty dataset
-        source.data = {'Date': []}
-        for col in pollutants_units.keys():
-            source.data[col] = []
-        plot.title.text = f"No data available for {selected_unit} in {selected_year}"
-        plot.renderers = []  # Remove existing renderers
-        plot.legend.items = []  # Clear legend
-        return
+    def reset():
+        map_source.data.update(initial_map_values)
+        animate_button.label = "Play"
+
+    register_tab([map_fig], reset, refresh_live)
+    return map_layout
 
-    # Update source data directly
-    new_data = {'Date': pivoted.index.tolist()}
-    for col in pivoted.columns:
-        new_data[col] = pivoted[col].tolist()
-    source.data = new_data
-
-    # Update the title
-    plot.title.text = f"Pollutant Concentrations Over Time ({selected_year})"
-
-    # Update the varea_stack
-    stackers = list(pivoted.columns)
-    colors = [pollutant_colors[stacker] for stacker in stackers]
-
-    # Remove existing renderers to avoid duplication
-    plot.renderers = []
-
-    renderers = plot.varea_stack(
-        stackers=stackers,
-        x='Date',
-        source=source,
-        color=colors,
-        legend_label=[f"{stacker} ({pollutants_units[stacker]})" for stacker in stackers],
-        name=stackers  # Assign `name` to each renderer for dynamic updates
+
+# ---- Box Plot Tab ----
+def build_box_plot_tab():
+    """Monthly pollutant distributions for a city, country or everywhere."""
+    # Pollutant Columns with Units
+    # Define a function to get units for pollutants
+    def get_unit(pollutant):
+        units = {
+            "PM2.5": "µg/m³",
+            "PM10": "µg/m³",
+            "Ozone": "ppb",
+            "NO2": "ppb",
+            "SO2": "ppb",
+            "CO": "ppm"
+        }
+        return units.get(pollutant, "")
+
+
+    # Initialize Default Data
+    # Pollutant quartiles by city, year, and month (from the aggregate cube's
+    # quantile sketches, one row per pollutant)
+    box_data = store.box_data
+
+    # Default selections
+    default_city = box_data['City'].unique()[0]
+    default_year = box_data['Year'].min()
+    default_pollutant = 'PM2.5'
+
+    # Scopes the distribution can be pooled over; everything but a single
+    # city and year merges the cube's per-cell sketches on demand
+    BOX_SCOPES = ["City", "Country", "All countries"]
+
+    def box_scope_label(city, year, scope):
+        place = {"City": city, "Country": store.city_country.get(city, city), "All countries": "all countries"}[scope]
+        return f"{place} ({'all years' if year == 'All' else year})"
+
+    # Function to prepare boxplot data
+    @memoized('boxplot_data')
+    def prepare_boxplot_data(version, city, year, pollutant, scope="City"):
+        if scope == "City" and year != "All":
+            filtered = store.box_index.rows(city, int(year), pollutant)
+        else:
+            where = {} if year == "All" else {'Year': int(year)}
+            if scope == "City":
+                where['City'] = city
+            elif scope == "Country":
+                where['Country'] = store.city_country.get(city)
+            filtered = store.box_summary(pollutant, **where)
+
+        # Extract quartile statistics
+        q1 = filtered['Q1']
+        q2 = filtered['Median']
+        q3 = filtered['Q3']
+        lower = filtered['Lower']
+        upper = filtered['Upper']
+        months = filtered['Month']
+
+        return dict(
+            Month=months,
+            Lower=lower,
+            Q1=q1,
+            Median=q2,
+            Q3=q3,
+            Upper=upper
+        ), lower.min(), upper.max()  # Return min and max for y-axis adjustment
+
+
+    # Initialize data for the default display
+    box_data_columns, global_min, global_max = prepare_boxplot_data(store.version, default_city, str(default_year), default_pollutant)
+    box_source = ColumnDataSource(data=dict(box_data_columns))
+
+    # Box Plot Figure
+    box_fig = figure(
+        title=f"{default_pollutant} ({get_unit(default_pollutant)}) Distribution by Month for {default_city} ({default_year})",
+        x_axis_label="Month",
+        y_axis_label=f"Concentration ({get_unit(default_pollutant)})",
+        width=1000,
+        height=600,
+        tools="pan,box_zoom,reset,save",
+        x_range=sorted(box_source.data['Month']),  # Ensure month names are sorted
+        y_range=(global_min * 0.9, global_max * 1.1)  # Dynamically set y-range
     )
 
-    # Dynamically update the legend
-    legend_items = [
-        LegendItem(label=f"{stacker} ({pollutants_units[stacker]})", renderers=[renderer])
-        for stacker, renderer in zip(stackers, renderers)
-    ]
-    plot.legend.items = legend_items
-    plot.legend.click_policy = "hide"  # Make legend items clickable
+    # Add boxes (Q1 to Q3)
+    box_fig.vbar(
+        x='Month', width=0.7, top='Q3', bottom='Q1',
+        source=box_source, fill_color="lightblue", line_color="black"
+    )
 
-# Dropdown for unit selection
-unit_dropdown = Dropdown(label=initial_unit, button_type="success",
-                         menu=[(unit, unit) for unit in units])
+    # Add whiskers for min and max
+    whisker = Whisker(base="Month", lower="Lower", upper="Upper", source=box_source, line_width=2)
+    box_fig.add_layout(whisker)
+
+    # Add median markers
+    box_fig.scatter(x='Month', y='Median', size=8, color="red", source=box_source)
+
+    # Add hover tool
+    hover = HoverTool(
+        tooltips=[
+            ("Month", "@Month"),
+            ("Q1 (25%)", "@Q1{0.2f}"),
+            ("Median (50%)", "@Median{0.2f}"),
+            ("Q3 (75%)", "@Q3{0.2f}"),
+            ("Min", "@Lower{0.2f}"),
+            ("Max", "@Upper{0.2f}")
+        ],
+        mode="mouse"
+    )
+    box_fig.add_tools(hover)
+
+    # Dropdowns for city, year, and pollutant
+    box_city_select = Select(title="Select City:", value=default_city, options=sorted(box_data['City'].unique()), name="box_city_select")
+    box_year_select = Select(
+        title="Select Year:",
+        value=str(default_year),
+        options=[str(year) for year in sorted(box_data['Year'].unique())] + ["All"],
+        name="box_year_select"
+    )
+    box_pollutant_select = Select(title="Select Pollutant:", value=default_pollutant, options=pollutant_columns)
+    box_scope_select = Select(title="Scope:", value="City", options=BOX_SCOPES, name="box_scope_select")
+
+    # Update function
+    def update_box_plot(attr, old, new):
+        selected_city = box_city_select.value
+        selected_year = box_year_select.value
+        selected_pollutant = box_pollutant_select.value
+        selected_scope = box_scope_select.value
+
+        # Prepare new data
+        new_data, new_min, new_max = prepare_boxplot_data(store.version, selected_city, selected_year, selected_pollutant, selected_scope)
+        box_source.data.update(new_data)
+
+        # Update y-range dynamically
+        box_fig.y_range.start = new_min * 0.9
+        box_fig.y_range.end = new_max * 1.1
+
+        # Update title
+        box_fig.title.text = f"{selected_pollutant} ({get_unit(selected_pollutant)}) Distribution by Month for {box_scope_label(selected_city, selected_year, selected_scope)}"
+
+    # Attach callbacks
+    box_city_select.on_change("value", instrumented(update_box_plot))
+    box_year_select.on_change("value", instrumented(update_box_plot))
+    box_pollutant_select.on_change("value", instrumented(update_box_plot))
+    box_scope_select.on_change("value", instrumented(update_box_plot))
+
+    def refresh_live(changes):
+        # Live rows may bring new cities and years into the pickers
+        box_city_select.options = store.cities
+        box_year_select.options = [str(year) for year in store.years] + ["All"]
+        if changes is not None:
+            box_places = {"City": changes.cities, "Country": changes.countries}.get(box_scope_select.value)
+            box_place = box_city_select.value if box_scope_select.value == "City" else store.city_country.get(box_city_select.value)
+            if box_places is not None and box_place not in box_places:
+                return
+            if box_year_select.value != "All" and int(box_year_select.value) not in changes.years:
+                return
+        update_box_plot(None, None, None)
+
+    initial_box_source = box_source.data.copy()
+
+    def reset():
+        box_source.data = initial_box_source
+        box_city_select.value = default_city
+        box_year_select.value = str(default_year)
+        box_pollutant_select.value = 'PM2.5'
+        box_scope_select.value = "City"
+
+    register_tab([box_fig], reset, refresh_live)
+
+    # Layout
+    return column(row(box_city_select, box_year_select, box_pollutant_select, box_scope_select), box_fig)
+
+
+# ---- Stacked Area Plot Tab ----
+def build_stacked_tab():
+    """Daily pollutants of one unit, stacked."""
+    # Pollutant and unit mappings
+    pollutants_units = {
+        'PM2.5': 'µg/m³',
+        'PM10': 'µg/m³',
+        'Ozone': 'ppb',
+        'NO2': 'ppb',
+        'SO2': 'ppb',
+        'CO': 'ppm'
+    }
 
-def update_unit(event):
-    unit_dropdown.label = event.item
-    update_plot(None, None, None)
+    # Add colors for pollutants
+    pollutant_colors = {
+        'PM2.5': 'dodgerblue',
+        'PM10': 'orange',
+        'Ozone': 'green',
+        'NO2': 'red',
+        'SO2': 'purple',
+        'CO': 'brown'
+    }
+
+    # Daily means of every pollutant, indexed by date
+    daily_means = store.daily_means
+    stacked_view = None  # visible (start, end) in ms, or None for the whole series
+    stacked_pivoted = None  # full daily table behind the drawn points
+
+    # Extract unique years and units
+    years = sorted(daily_means.index.year.unique())
+    units = list(set(pollutants_units.values()))  # Unique units
+    initial_unit = units[0]
+    initial_year = years[0]
+
+    # Initialize ColumnDataSource
+    source = ColumnDataSource(data={'Date': [], 'Concentration': []})
+
+    # Create the figure
+    plot = figure(title=f"Pollutant Concentrations Over Time ({initial_year})",
+                  x_axis_label="Date", y_axis_label="Concentration",
+                  x_axis_type="datetime", width=900, height=500,
+                  tools="pan,box_zoom,reset,save")
+
+    # Add hover tool
+    hover = HoverTool(tooltips=[
+        ("Date", "@Date{%F}"),
+        ("Pollutant", "$name"),
+        ("Concentration", "@$name{0.2f}"),
+        ("Unit", "@Unit")
+    ], formatters={'@Date': 'datetime'}, mode='vline')
+    plot.add_tools(hover)
+
+
+
+    # Function to prepare data
+    def prepare_data(unit, year):
+        columns = [pollutant for pollutant, pollutant_unit in pollutants_units.items() if pollutant_unit == unit]
+        daily_means = store.daily_means
+        count_rows(len(daily_means))
+        filtered = daily_means if year == "All" else daily_means[daily_means.index.year == int(year)]
+        pivoted = filtered[columns].dropna(how='all').fillna(0)
+        pivoted.index.name = 'Date'
+        return pivoted
+
+    def stacked_source_data(pivoted):
+        # One set of dates for every layer, picked by LTTB on the stack total so
+        # the outline of the stack survives the downsampling
+        x = datetime_ms(pivoted.index)
+        view = stacked_view
+        if view is not None and np.searchsorted(x, view[1], side='right') - np.searchsorted(x, view[0]) < 2:
+            view = None
+        keep = level_of_detail(x, pivoted.sum(axis=1).to_numpy(), view, plot.width)
+        new_data = {'Date': x[keep]}
+        for col in pivoted.columns:
+            new_data[col] = pivoted[col].to_numpy()[keep]
+        return new_data
+
+    def update_plot(attr, old, new):
+        nonlocal stacked_view, stacked_pivoted
+        selected_unit = unit_dropdown.label
+        selected_year = year_dropdown.value
+        stacked_view = None
+
+        pivoted = stacked_pivoted = prepare_data(selected_unit, selected_year)
+        if pivoted.empty:  # Handle empty dataset
+            source.data = {'Date': []}
+            for col in pollutants_units.keys():
+                source.data[col] = []
+            plot.title.text = f"No data available for {selected_unit} in {selected_year}"
+            plot.renderers = []  # Remove existing renderers
+            plot.legend.items = []  # Clear legend
+            return
+
+        # Update source data directly
+        source.data = stacked_source_data(pivoted)
+
+        # Update the title
+        plot.title.text = f"Pollutant Concentrations Over Time ({selected_year})"
+
+        # Update the varea_stack
+        stackers = list(pivoted.columns)
+        colors = [pollutant_colors[stacker] for stacker in stackers]
+
+        # Remove existing renderers to avoid duplication
+        plot.renderers = []
+
+        renderers = plot.varea_stack(
+            stackers=stackers,
+            x='Date',
+            source=source,
+            color=colors,
+            legend_label=[f"{stacker} ({pollutants_units[stacker]})" for stacker in stackers],
+            name=stackers  # Assign `name` to each renderer for dynamic updates
+        )
 
-unit_dropdown.on_click(update_unit)
+        # Dynamically update the legend
+        legend_items = [
+            LegendItem(label=f"{stacker} ({pollutants_units[stacker]})", renderers=[renderer])
+            for stacker, renderer in zip(stackers, renderers)
+        ]
+        plot.legend.items = legend_items
+        plot.legend.click_policy = "hide"  # Make legend items clickable
 
-# Dropdown for year selection
-year_dropdown = Select(title="Select Year", value=str(initial_year),
-                       options=[str(year) for year in years])
-year_dropdown.on_change("value", update_plot)
+    # Dropdown for unit selection
+    unit_dropdown = Dropdown(label=initial_unit, button_type="success",
+                             menu=[(unit, unit) for unit in units])
 
-# Initial plot setup
-update_plot(None, None, None)
+    def update_unit(event):
+        unit_dropdown.label = event.item
+        update_plot(None, None, None)
 
-# Layout
-layout = column(row(unit_dropdown, year_dropdown), plot)
-stacked_tab = TabPanel(child=layout, title="Stacked Area Chart")
+    unit_dropdown.on_click(instrumented(update_unit))
 
+    # Dropdown for year selection
+    year_dropdown = Select(title="Select Year", value=str(initial_year),
+                           options=[str(year) for year in years] + ["All"], name="year_dropdown")
+    year_dropdown.on_change("value", instrumented(update_plot))
+
+    def requery_stacked(event):
+        # Re-pick the drawn dates for the new x-range after a pan or zoom
+        nonlocal stacked_view
+        stacked_view = (event.x0, event.x1)
+        if not stacked_pivoted.empty:
+            source.data = stacked_source_data(stacked_pivoted)
+
+    plot.on_event(RangesUpdate, instrumented(requery_stacked))
+
+    # Initial plot setup
+    update_plot(None, None, None)
+
+    def stream_stacked_area():
+        nonlocal stacked_pivoted
+        old = stacked_pivoted
+        pivoted = prepare_data(unit_dropdown.label, year_dropdown.value)
+        if old.empty or list(pivoted.columns) != list(old.columns):
+            update_plot(None, None, None)  # Renderers need (re)building
+            return
+        stacked_pivoted = pivoted
+        old_x, x = datetime_ms(old.index), datetime_ms(pivoted.index)
+        if stacked_view is not None or not extends_drawn_series(
+            len(source.data['Date']), old_x, old.to_numpy(), x, pivoted.to_numpy(), plot.width
+        ):
+            source.data = stacked_source_data(pivoted)
+        elif len(x) > len(old_x):
+            added = pivoted.iloc[len(old_x):]
+            source.stream({'Date': x[len(old_x):], **{col: added[col].to_numpy() for col in added.columns}})
+
+    def refresh_live(changes):
+        year_dropdown.options = [str(year) for year in store.years] + ["All"]  # Live rows may start a new year
+        if changes is None:
+            update_plot(None, None, None)
+        elif year_dropdown.value == "All" or int(year_dropdown.value) in changes.years:
+            stream_stacked_area()
+
+    def reset():
+        unit_dropdown.label = initial_unit
+        year_dropdown.value = str(initial_year)
+
+    register_tab([], reset, refresh_live)
+
+    # Layout
+    return column(row(unit_dropdown, year_dropdown), plot)
 
 
 # Custom CSS for the slider
@@ -1255,67 +1680,64 @@ custom_css = """
 css_div = Div(text=custom_css)
 
 
+# ---- Live updates ----
+# In live mode a background thread appends new rows to the shared store.
+# Each session polls for them and hands every built tab the rows it has not
+# seen: new points are streamed to the scatter, time-series and stacked area
+# plots, and the aggregate tabs whose current selection the rows fall in are
+# refreshed from the updated roll-ups.
+LiveRows = namedtuple('LiveRows', 'rows years cities countries')
+
+def live_rows(batches):
+    rows = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+    return LiveRows(rows, set(rows['Year'].tolist()), set(rows['City'].astype(str)), set(rows['Country'].astype(str)))
+
+def apply_live_updates():
+    changes = {}  # Tabs that have seen the same versions get the same rows
+    for tab in live_tabs:
+        seen, refresh = tab
+        tab[0], batches = store.batches_since(seen)
+        if batches is None:
+            refresh(None)  # Too far behind to stream: redraw from the aggregates
+        elif batches:
+            key = (seen, tab[0])
+            if key not in changes:
+                changes[key] = live_rows(batches)
+            refresh(changes[key])
+
+if live_enabled():
+    curdoc().add_periodic_callback(instrumented(apply_live_updates), int(POLL_SECONDS * 1000))
+
+
+# ---- Tabs ----
+# Each tab is a placeholder until it is first selected; only then are its
+# figures, sources and callbacks built and its data sent to the browser.
+tab_builders = [
+    ("Scatter Plot", build_scatter_tab),
+    ("Regional Trends", build_regional_tab),
+    ("Heatmap", build_heatmap_tab),
+    ("Time-Series Trends", build_time_series_tab),
+    ("Grouped Bar Chart", build_grouped_bar_tab),
+    ("Pollutants Map", build_map_tab),
+    ("Box Plot", build_box_plot_tab),
+    ("Stacked Area Chart", build_stacked_tab),
+]
+tabs = Tabs(tabs=[TabPanel(child=Div(text="Loading…"), title=title) for title, _ in tab_builders])
+built_tab_indices = set()
+
+def build_selected_tab(attr, old, new):
+    if tabs.active in built_tab_indices:
+        return
+    built_tab_indices.add(tabs.active)
+    tabs.tabs[tabs.active].child = tab_builders[tabs.active][1]()
 
-
-# Store initial states
-initial_scatter_source = scatter_source.data.copy()
-initial_regional_source = regional_source.data.copy()
-initial_monthly_source = monthly_source.data.copy()
-initial_yr_source = yr_source.data.copy()
-initial_grouped_bar_source = grouped_bar_source.data.copy()
-initial_box_source = box_source.data.copy()
-initial_time_series_fig_renderers = time_series_fig.renderers.copy()
-initial_map_geojson = geo_source.geojson
-
-def reset_dashboard(event):
-    # Reset data sources
-    scatter_source.data = initial_scatter_source
-    regional_source.data = initial_regional_source
-    monthly_source.data = initial_monthly_source
-    yr_source.data = initial_yr_source
-    grouped_bar_source.data = initial_grouped_bar_source
-    box_source.data = initial_box_source
-
-    # Reset plot renderers and legends
-    time_series_fig.renderers = initial_time_series_fig_renderers.copy()
-    geo_source.geojson = initial_map_geojson
-    
-    # Reset dropdowns, sliders, and titles
-    country_select.value = "All"
-    city_select.value = "All"
-    pollutant_dropdown.value = 'PM2.5'
-    yr_dropdown.value = str(default_year)
-    month_slider.value = 1
-    grouped_bar_year_slider.value = grouped_bar_year_slider.start
-    box_city_select.value = default_city
-    box_year_select.value = str(default_year)
-    box_pollutant_select.value = 'PM2.5'
-    unit_dropdown.label = initial_unit
-    year_dropdown.value = str(initial_year)
-    animate_button.label = "Play"
-
-# Attach reset callback to each figure
-scatter_fig.on_event('reset', reset_dashboard)
-regional_fig.on_event('reset', reset_dashboard)
-monthly_fig.on_event('reset', reset_dashboard)
-yr_fig.on_event('reset', reset_dashboard)
-grouped_bar_fig.on_event('reset', reset_dashboard)
-box_fig.on_event('reset', reset_dashboard)
-time_series_fig.on_event('reset', reset_dashboard)
-map_fig.on_event('reset', reset_dashboard)
-
-
-
-# Define Tabs
-tabs = Tabs(tabs=[
-    scatter_tab, regional_tab, heatmap_tab, time_series_tab,
-    grouped_bar_tab,
-    goespa_tab, boxplot_tab,stacked_tab
-])
-
+tabs.on_change('active', instrumented(build_selected_tab))
+build_selected_tab(None, None, None)
 
 
 # Assemble Dashboard
 dashboard_layout = column(css_div,tabs)
 curdoc().add_root(dashboard_layout)
 curdoc().title = "Air Quality Dashboard"
+if profiler:
+    profiler.stop()
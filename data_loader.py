@@ -0,0 +1,221 @@
+"""Shared loading of the air quality measurements.
+
+Every tab in ``dashboard.py`` reads from the frame returned by
+``load_air_quality_data``.  The CSV is parsed once per process with explicit
+dtypes and a single date format, the calendar columns the tabs need are
+derived once, and the same frame is handed to every tab.  Labels are
+categorical, measurements float32 and the calendar columns small integers,
+so the frame takes a fraction of pandas' default footprint.  The parsed frame
+is kept in a columnar cache (see ``frame_cache``) so later server starts
+memory-map it instead of parsing the CSV again.
+
+For CSVs larger than memory, ``iter_measurement_chunks`` parses the file in
+fixed-size blocks instead; ``aggregates`` folds each block into its
+aggregates and keeps no frame (set ``AIR_QUALITY_CHUNK_ROWS``).
+"""
+import io
+import logging
+import os
+import threading
+
+import pandas as pd
+
+from frame_cache import read_cached_frame, source_fingerprint, write_cached_frame
+
+
+DATA_PATH = 'expanded_air_quality_data.csv'
+DATE_FORMAT = '%d-%m-%Y'
+CHUNK_ROWS = int(os.environ.get('AIR_QUALITY_CHUNK_ROWS') or 0)  # 0: load the whole CSV into memory
+
+POLLUTANT_COLUMNS = ['PM2.5', 'PM10', 'Ozone', 'NO2', 'SO2', 'CO']
+MEASURE_COLUMNS = ['AQI'] + POLLUTANT_COLUMNS
+POLLUTANT_UNITS = {
+    "PM2.5": "µg/m³",
+    "PM10": "µg/m³",
+    "Ozone": "ppb",
+    "NO2": "ppb",
+    "SO2": "ppb",
+    "CO": "ppm"
+}
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+MONTH_DTYPE = pd.CategoricalDtype(MONTHS, ordered=True)
+
+# Country/City are low-cardinality labels and the measurements never need
+# more than single precision.
+CSV_DTYPES = {'Date': str, 'Country': 'category', 'City': 'category', **{col: 'float32' for col in MEASURE_COLUMNS}}
+
+# Copy-on-Write makes every frame derived from the shared one (filters,
+# samples, added columns) a lazy copy, so no tab can write through to the
+# frame the other tabs are reading.  It is always on from pandas 3.
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+logger = logging.getLogger(__name__)
+
+_frames = {}
+_loaded_sizes = {}  # path -> bytes of the CSV its measurements were loaded from
+_lock = threading.Lock()
+
+
+class _FileHead(io.RawIOBase):
+    """The first ``size`` bytes of a file, as a stream."""
+
+    def __init__(self, path, size):
+        self._file = open(path, 'rb')
+        self._remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self._file.readinto(memoryview(buffer)[:self._remaining])
+        self._remaining -= count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def _read_csv(source, size, dtype):
+    if size is None or not isinstance(source, str):
+        return pd.read_csv(source, usecols=list(CSV_DTYPES), dtype=dtype)
+    with io.BufferedReader(_FileHead(source, size)) as handle:
+        return pd.read_csv(handle, usecols=list(CSV_DTYPES), dtype=dtype)
+
+
+def complete_size(path):
+    """Bytes of ``path`` up to the end of its last complete line.
+
+    Rows are loaded up to there: a last line without a newline may still be
+    being written, and is read by the live feed once it is complete.
+    """
+    with open(path, 'rb') as handle:
+        size = end = handle.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - 65536, 0)
+            handle.seek(start)
+            newline = handle.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+    if end < size:
+        logger.warning("Leaving out the last %d bytes of %s: the line has no newline yet", size - end, path)
+    return end
+
+
+def loaded_size(path):
+    """Bytes of the CSV at ``path`` that the measurements were loaded from, or ``None`` before loading."""
+    return _loaded_sizes.get(path)
+
+
+def read_measurements(path, size=None):
+    """Parse the CSV at ``path`` (or an open file) into a frame with the documented dtypes.
+
+    With ``size``, only the first ``size`` bytes of the file at ``path`` are read.
+    """
+    try:
+        frame = _read_csv(path, size, CSV_DTYPES)
+    except ValueError:
+        # A malformed measurement somewhere in the file: parse leniently and
+        # coerce the bad cells to NaN rather than refusing to load.
+        if hasattr(path, 'seek'):
+            path.seek(0)
+        frame = _read_csv(path, size, {'Date': str, 'Country': 'category', 'City': 'category'})
+        _coerce_measures(frame)
+    return frame
+
+
+def _coerce_measures(frame):
+    for col in MEASURE_COLUMNS:
+        frame[col] = pd.to_numeric(frame[col], errors='coerce').astype('float32')
+
+
+def iter_measurement_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Yield the measurements at ``path`` as frames of at most ``chunk_rows`` rows.
+
+    Each chunk has the dtypes and calendar columns of the full load, and
+    malformed measurements are always coerced to NaN (a bad cell cannot
+    be found before the whole file has been read).  ``Country``/``City``
+    categories only grow from chunk to chunk: every chunk's categories
+    are the sorted labels seen so far, as in the full load.  Lines
+    appended once iteration has started are left out (see ``loaded_size``).
+    """
+    size = _loaded_sizes[path] = complete_size(path)
+    categories = {'Country': pd.Index([], dtype=object), 'City': pd.Index([], dtype=object)}
+    dtypes = {'Date': str, 'Country': str, 'City': str}
+    with io.BufferedReader(_FileHead(path, size)) as handle:
+        for chunk in pd.read_csv(handle, usecols=list(CSV_DTYPES), dtype=dtypes, chunksize=chunk_rows):
+            _coerce_measures(chunk)
+            for col, known in categories.items():
+                labels = pd.Index(chunk[col].dropna().unique())
+                categories[col] = known.union(labels).sort_values()
+                chunk[col] = pd.Categorical(chunk[col], categories=categories[col])
+            yield add_calendar_columns(chunk)
+
+
+def add_calendar_columns(frame):
+    """Parse ``Date`` and derive ``Year``/``Month``/``MonthNum``/``YearMonth``."""
+    frame['Date'] = pd.to_datetime(frame['Date'], format=DATE_FORMAT, errors='coerce')
+    frame = frame.dropna(subset=['Date']).reset_index(drop=True)  # Drop invalid dates
+
+    # Small integer codes and a categorical month name keep the calendar
+    # columns to a few bytes per row
+    dates = frame['Date'].to_numpy()
+    month_num = (dates.astype('datetime64[M]').astype('int64') % 12 + 1).astype('int8')
+    frame['Year'] = (dates.astype('datetime64[Y]').astype('int64') + 1970).astype('int16')
+    frame['MonthNum'] = month_num
+    frame['Month'] = pd.Categorical.from_codes(month_num - 1, dtype=MONTH_DTYPE)
+    frame['YearMonth'] = dates.astype('datetime64[M]').astype('datetime64[ns]')
+    return frame
+
+
+def concat_measurements(frame, rows):
+    """Append ``rows`` to ``frame`` keeping the categorical columns categorical.
+
+    The categories are the sorted union of both, the order ``read_csv``
+    gives a categorical column.
+    """
+    frame, rows = frame.copy(deep=False), rows.copy(deep=False)
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype) and isinstance(rows[col].dtype, pd.CategoricalDtype):
+            labels = frame[col].cat.categories.union(rows[col].cat.categories).sort_values()
+            frame[col] = frame[col].cat.set_categories(labels)
+            rows[col] = rows[col].cat.set_categories(labels)
+    return pd.concat([frame, rows], ignore_index=True)
+
+
+def load_air_quality_data(path=DATA_PATH):
+    """Return the measurement frame for ``path``, parsing it on first use.
+
+    The frame is shared by every tab and every session in the process and
+    must be treated as read-only.
+    """
+    with _lock:
+        if path not in _frames:
+            _frames[path] = _load(path)
+        return _frames[path]
+
+
+def memory_footprint(frame):
+    """Bytes held by each column of ``frame``, object contents included."""
+    return frame.memory_usage(index=False, deep=True)
+
+
+def _load(path):
+    # Lines appended from here on are left to the live feed, which starts
+    # reading at loaded_size(path)
+    size = complete_size(path)
+    frame = read_cached_frame(path, size)
+    if frame is None:
+        fingerprint = source_fingerprint(path, size)
+        frame = add_calendar_columns(read_measurements(path, size))
+        write_cached_frame(path, frame, fingerprint)
+    _loaded_sizes[path] = size
+    footprint = memory_footprint(frame)
+    logger.info(
+        "Measurement frame: %d rows, %.1f MiB (%s)", len(frame), footprint.sum() / 2 ** 20,
+        ", ".join(f"{col} {nbytes / 2 ** 20:.1f}" for col, nbytes in footprint.items()),
+    )
+    return frame
@@ -0,0 +1,70 @@
+"""Level-of-detail downsampling for line and area plots.
+
+A plot cannot show more points than it has horizontal pixels, so
+``level_of_detail`` keeps only the points inside the visible x-range and,
+when there are more of them than the plot is wide, reduces them with
+Largest-Triangle-Three-Buckets (LTTB).  LTTB keeps the points that carry
+the visual shape of the series — peaks and troughs included — so a
+multi-year daily series looks the same at a bounded payload.
+"""
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """Indices of ``threshold`` points of ``(x, y)`` chosen by LTTB.
+
+    ``x`` must be sorted and ``y`` free of NaN (drop missing points
+    first).  The first and last points are always kept; the rest are split
+    into ``threshold - 2`` buckets and each bucket keeps the point forming
+    the largest triangle with the previously kept point and the mean of
+    the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype('int64')
+    selected = np.empty(threshold, dtype='int64')
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        following = slice(stop, edges[bucket + 2]) if bucket + 2 < len(edges) else slice(n - 1, n)
+        next_x, next_y = x[following].mean(), y[following].mean()
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def visible_span(x, start, end):
+    """``(lo, hi)`` positions of sorted ``x`` covering ``[start, end]``.
+
+    One point beyond each edge is included so lines run off the sides of
+    the plot instead of stopping short of them.
+    """
+    lo = max(int(np.searchsorted(x, start, side='left')) - 1, 0)
+    hi = min(int(np.searchsorted(x, end, side='right')) + 1, len(x))
+    return lo, hi
+
+
+def level_of_detail(x, y, x_range, width):
+    """Indices of the points of ``(x, y)`` to draw for ``x_range`` at ``width`` pixels.
+
+    ``x`` must be sorted and ``y`` free of NaN; ``x_range`` is ``(start,
+    end)`` in the same units, or ``None`` for the whole series.
+    """
+    lo, hi = (0, len(x)) if x_range is None else visible_span(x, *x_range)
+    if hi - lo <= width:
+        return np.arange(lo, hi)
+    return lo + lttb(x[lo:hi], y[lo:hi], width)
+
+
+def datetime_ms(values):
+    """Milliseconds since the epoch, the unit of Bokeh's datetime ranges."""
+    return np.asarray(values, dtype='datetime64[ms]').astype('int64').astype('float64')
@@ -0,0 +1,136 @@
+"""Columnar on-disk cache of the parsed measurement frame.
+
+The first start parses the CSV and writes the result as an uncompressed
+Arrow IPC file next to it (``.cache/<name>.arrow``).  Later starts
+memory-map that file instead of re-reading the CSV text.  A JSON sidecar
+records the size, mtime and content hash of the CSV the cache was built
+from: a size/mtime match is trusted as is, anything else is settled by
+re-hashing the CSV, and a hash mismatch rebuilds the cache.
+
+pyarrow is optional; without it ``read_cached_frame`` always misses and
+``write_cached_frame`` does nothing.
+"""
+import hashlib
+import json
+import logging
+import os
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - the cache is an optional speed-up
+    pa = None
+
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of the cached frame changes
+CACHE_VERSION = 2
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def cache_enabled():
+    return pa is not None and os.environ.get('AIR_QUALITY_CACHE', '1') != '0'
+
+
+def cache_paths(csv_path):
+    """Return the ``(arrow_path, meta_path)`` pair caching ``csv_path``."""
+    csv_path = os.path.abspath(csv_path)
+    cache_dir = os.environ.get('AIR_QUALITY_CACHE_DIR') or os.path.join(os.path.dirname(csv_path), '.cache')
+    stem = os.path.join(cache_dir, os.path.basename(csv_path))
+    return stem + '.arrow', stem + '.json'
+
+
+def file_hash(path, size=None):
+    """Hash of ``path``'s contents, or of its first ``size`` bytes."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        remaining = os.fstat(f.fileno()).st_size if size is None else size
+        while remaining > 0:
+            block = f.read(min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def source_fingerprint(csv_path, size=None):
+    """Fingerprint ``csv_path`` (its first ``size`` bytes); take it *before* parsing the file."""
+    if not cache_enabled():
+        return None
+    key = _stat_key(csv_path)
+    if size is not None:
+        key['size'] = size
+    return {'version': CACHE_VERSION, **key, 'hash': file_hash(csv_path, key['size'])}
+
+
+def _write_json(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def read_cached_frame(csv_path, size=None):
+    """Return the cached frame for ``csv_path``, or ``None`` on a miss.
+
+    With ``size``, the cache must have been built from exactly the first
+    ``size`` bytes of the file, which may have grown since.
+    """
+    if not cache_enabled():
+        return None
+    arrow_path, meta_path = cache_paths(csv_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION or not os.path.exists(arrow_path):
+        return None
+
+    current = _stat_key(csv_path)
+    if (current['size'] if size is None else size) != meta['size']:
+        return None
+    if current['mtime_ns'] != meta['mtime_ns']:
+        # Touched, copied or appended to but possibly unchanged: let the content decide
+        if file_hash(csv_path, meta['size']) != meta['hash']:
+            return None
+        if current['size'] == meta['size']:  # Not when appended to: the sidecar describes the prefix
+            meta.update(current)
+            try:
+                _write_json(meta_path, meta)
+            except OSError:
+                pass
+
+    # Numeric columns without nulls are handed to pandas straight from the
+    # memory-mapped buffers (split_blocks avoids consolidating them); the
+    # mapping stays open for as long as those buffers are referenced.
+    table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+    frame = table.to_pandas(split_blocks=True)
+    logger.info("Loaded %d rows for %s from columnar cache %s", len(frame), csv_path, arrow_path)
+    return frame
+
+
+def write_cached_frame(csv_path, frame, fingerprint):
+    """Write ``frame`` parsed from the file matching ``fingerprint``.
+
+    Failures to write only log: the dashboard works without a cache.
+    """
+    if fingerprint is None:
+        return
+    arrow_path, meta_path = cache_paths(csv_path)
+    try:
+        os.makedirs(os.path.dirname(arrow_path), exist_ok=True)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        tmp_path = arrow_path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, arrow_path)
+        _write_json(meta_path, fingerprint)
+    except OSError as exc:
+        logger.warning("Could not write columnar cache %s: %s", arrow_path, exc)
@@ -0,0 +1,275 @@
+"""Per-callback metrics for the dashboard, served in Prometheus text format.
+
+With ``AIR_QUALITY_METRICS_PORT`` set, every widget, event and periodic
+handler ``dashboard.py`` registers is wrapped by the session's
+``SessionInstrumentation``, which records per callback:
+
+* wall time (``air_quality_callback_seconds``);
+* rows the callback read from the store — through ``RowIndex`` offset
+  tables, the raw rows and the cube's cells (``air_quality_callback_rows_scanned``);
+* size of the PATCH-DOC message its model changes send to the browser, and
+  the time taken to serialise it (``air_quality_callback_patch_bytes``,
+  ``air_quality_callback_patch_serialize_seconds``).
+
+Wall time covers the pandas work and the source assignments; the patch
+metrics cover what is then serialised for the websocket.  The patch is
+serialised a second time to be measured, so leave metrics off when not
+needed.  Callback counts and time per session id are kept until the session
+closes.
+
+Everything is served at ``http://127.0.0.1:<port>/metrics`` by a daemon
+thread of the Bokeh server process, together with the shared callback
+cache's counters.  Only the outermost handler is measured: handlers that
+call other handlers directly (reset, live updates) are charged for them.
+"""
+import bisect
+import functools
+import http.server
+import logging
+import os
+import threading
+import time
+
+from memo import callback_cache
+
+
+METRICS_PORT = int(os.environ.get('AIR_QUALITY_METRICS_PORT', '0'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = tuple(10 ** k for k in range(9))
+BYTE_BUCKETS = tuple(4 ** k for k in range(4, 14))  # 256 B .. 64 MiB
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_active = threading.local()  # The call being measured on this thread, if any
+_server = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Prometheus histogram with one label."""
+
+    def __init__(self, name, help_text, label, buckets):
+        self.name, self.help_text, self.label = name, help_text, label
+        self.buckets = buckets
+        self._series = {}  # label value -> [count per bucket..., overflow, sum]
+
+    def observe(self, label_value, value):
+        with _lock:
+            series = self._series.setdefault(label_value, [0] * (len(self.buckets) + 1) + [0])
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with _lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {_format(values[-1])}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter with one label; series can be dropped with ``forget``."""
+
+    def __init__(self, name, help_text, label):
+        self.name, self.help_text, self.label = name, help_text, label
+        self._series = {}
+
+    def inc(self, label_value, value=1):
+        with _lock:
+            self._series[label_value] = self._series.get(label_value, 0) + value
+
+    def forget(self, label_value):
+        with _lock:
+            self._series.pop(label_value, None)
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with _lock:
+            series = dict(self._series)
+        for label_value, value in sorted(series.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {_format(value)}')
+        return lines
+
+
+CALLBACK_SECONDS = Histogram(
+    'air_quality_callback_seconds', "Wall time of dashboard callbacks.", 'callback', LATENCY_BUCKETS)
+CALLBACK_ROWS = Histogram(
+    'air_quality_callback_rows_scanned', "Store rows and cube cells read per callback.", 'callback', ROW_BUCKETS)
+PATCH_BYTES = Histogram(
+    'air_quality_callback_patch_bytes', "Size of the document patch each callback sends.", 'callback', BYTE_BUCKETS)
+PATCH_SECONDS = Histogram(
+    'air_quality_callback_patch_serialize_seconds', "Time to serialise each callback's document patch.",
+    'callback', LATENCY_BUCKETS)
+CALLBACK_ERRORS = Counter('air_quality_callback_errors_total', "Callbacks that raised.", 'callback')
+SESSION_CALLS = Counter('air_quality_session_callbacks_total', "Callbacks run per open session.", 'session')
+SESSION_SECONDS = Counter(
+    'air_quality_session_callback_seconds_total', "Callback wall time per open session.", 'session')
+METRICS = [
+    CALLBACK_SECONDS, CALLBACK_ROWS, PATCH_BYTES, PATCH_SECONDS, CALLBACK_ERRORS, SESSION_CALLS, SESSION_SECONDS,
+]
+
+
+def metrics_enabled():
+    return METRICS_PORT > 0
+
+
+def count_rows(n):
+    """Add ``n`` to the rows scanned by the callback being measured on this thread, if any."""
+    call = getattr(_active, 'call', None)
+    if call is not None:
+        call.rows += int(n)
+
+
+class _Call:
+    def __init__(self):
+        self.rows = 0
+        self.events = []
+
+
+class SessionInstrumentation:
+    """Wraps one session's handlers: ``widget.on_change('value', instrumented(handler))``."""
+
+    def __init__(self, doc):
+        from bokeh.document.events import DocumentPatchedEvent
+
+        self.doc = doc
+        self._patched_event = DocumentPatchedEvent
+        doc.on_change(self._collect)
+        doc.on_session_destroyed(self._forget_session)
+
+    @property
+    def session_id(self):
+        context = self.doc.session_context
+        return context.id if context is not None else 'none'
+
+    def __call__(self, func, name=None):
+        name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            if getattr(_active, 'call', None) is not None:
+                return func(*args)
+            call = _active.call = _Call()
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            except Exception:
+                CALLBACK_ERRORS.inc(name)
+                raise
+            finally:
+                _active.call = None
+                self._record(name, time.perf_counter() - start, call)
+        return wrapper
+
+    def _collect(self, event):
+        call = getattr(_active, 'call', None)
+        # Changes made by the browser (setter is its connection) are not sent back
+        if call is not None and isinstance(event, self._patched_event) and getattr(event, 'setter', None) is None:
+            call.events.append(event)
+
+    def _record(self, name, elapsed, call):
+        CALLBACK_SECONDS.observe(name, elapsed)
+        CALLBACK_ROWS.observe(name, call.rows)
+        SESSION_CALLS.inc(self.session_id)
+        SESSION_SECONDS.inc(self.session_id, elapsed)
+        if not call.events:
+            PATCH_BYTES.observe(name, 0)
+            return
+        from bokeh.protocol import Protocol
+
+        start = time.perf_counter()
+        try:
+            message = Protocol().create('PATCH-DOC', call.events)
+        except Exception as exc:  # Never mask the callback's own outcome
+            logger.warning("Could not measure the document patch of %s: %s", name, exc)
+            return
+        PATCH_SECONDS.observe(name, time.perf_counter() - start)
+        PATCH_BYTES.observe(name, len(message.content_json) + sum(buffer.data.nbytes for buffer in message.buffers))
+
+    def _forget_session(self, session_context):
+        SESSION_CALLS.forget(session_context.id)
+        SESSION_SECONDS.forget(session_context.id)
+
+
+def _passthrough(func, name=None):
+    return func
+
+
+def session_instrumentation(doc, profiler=None):
+    """The handler wrapper for ``doc``'s session.
+
+    Handlers are measured with metrics on and also profiled given a
+    ``profiler`` (see ``profiling.py``); with neither they are returned unchanged.
+    """
+    measure = SessionInstrumentation(doc) if metrics_enabled() else _passthrough
+    if profiler is None:
+        return measure
+    return lambda func, name=None: measure(profiler.wrap(func, name), name)
+
+
+def render_metrics():
+    """All metrics, in Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.exposition())
+    cache = callback_cache.info()
+    for key, kind, help_text in [
+        ('hits', 'counter', "Callback cache hits."),
+        ('misses', 'counter', "Callback cache misses."),
+        ('size', 'gauge', "Results held in the callback cache."),
+    ]:
+        name = f'air_quality_memo_{key}' + ('_total' if kind == 'counter' else '')
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {cache[key]}']
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve ``/metrics`` on ``127.0.0.1:port`` from a daemon thread, once per process."""
+    global _server
+    if port <= 0:
+        return
+    with _lock:
+        if _server is not None:
+            return
+        try:
+            _server = http.server.ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+        except OSError as exc:
+            # e.g. a second server process (--num-procs) on the same port
+            logger.warning("Could not serve metrics on port %d: %s", port, exc)
+            _server = False
+            return
+        _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='air-quality-metrics', daemon=True).start()
+    logger.info("Serving metrics at http://127.0.0.1:%d/metrics", port)
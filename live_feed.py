@@ -0,0 +1,126 @@
+"""Live ingestion of new measurements into the aggregate store.
+
+With ``AIR_QUALITY_LIVE=tail`` the CSV the dashboard was loaded from is
+watched for appended lines; with ``AIR_QUALITY_WATCH_DIR`` set, every new
+``*.csv`` file dropped into that directory is read once (write the file
+elsewhere and move it in, so it is never picked up half-written).  Both can
+be used together.  New rows are parsed with the same dtypes as the main
+load and folded into the store with ``AggregateStore.append``; sessions
+poll the store and stream them to their plots.
+
+Only the new bytes or files are read, never the whole CSV again.
+"""
+import glob
+import io
+import logging
+import os
+import threading
+import time
+
+from data_loader import DATA_PATH, add_calendar_columns, loaded_size, read_measurements
+
+
+POLL_SECONDS = float(os.environ.get('AIR_QUALITY_POLL_SECONDS', '2'))
+
+logger = logging.getLogger(__name__)
+
+_feeds = {}
+_lock = threading.Lock()
+
+
+def live_enabled():
+    """Whether live ingestion is configured for this process."""
+    return os.environ.get('AIR_QUALITY_LIVE', '').lower() == 'tail' or bool(os.environ.get('AIR_QUALITY_WATCH_DIR'))
+
+
+def parse_rows(source):
+    """Parse CSV ``source`` (a path or an open file) the way the main load does."""
+    return add_calendar_columns(read_measurements(source))
+
+
+class CsvTail:
+    """Complete lines appended to a CSV since the last read.
+
+    ``read_new`` returns a list of frames, like ``DropDirectory.read_new``.
+    Reading starts at ``offset``, the end of the rows already in the store
+    (the current end of the file by default).
+    """
+
+    def __init__(self, path, offset=None):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self.header = handle.readline()
+        self.offset = os.path.getsize(path) if offset is None else offset
+
+    def read_new(self):
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            # Truncated or replaced: new rows can no longer be told apart
+            logger.warning("%s shrank from %d to %d bytes; following it from the new end", self.path, self.offset, size)
+            self.offset = size
+        if size == self.offset:
+            return []
+        with open(self.path, 'rb') as handle:
+            handle.seek(self.offset)
+            chunk = handle.read(size - self.offset)
+        end = chunk.rfind(b'\n') + 1  # Leave a partially written last line for the next read
+        if not end:
+            return []
+        self.offset += end
+        return [parse_rows(io.BytesIO(self.header + chunk[:end]))]
+
+
+class DropDirectory:
+    """CSV files that appeared in a directory since the last read."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.seen = set()
+
+    def read_new(self):
+        paths = sorted(set(glob.glob(os.path.join(self.directory, '*.csv'))) - self.seen)
+        frames = []
+        for path in paths:
+            self.seen.add(path)
+            try:
+                frames.append(parse_rows(path))
+            except (OSError, ValueError) as exc:
+                logger.warning("Skipping %s: %s", path, exc)
+        return frames
+
+
+def _run(store, sources):
+    while True:
+        for source in sources:
+            try:
+                for rows in source.read_new():
+                    if not rows.empty:
+                        start = time.perf_counter()
+                        store.append(rows)
+                        logger.info("Appended %d live rows in %.2fs", len(rows), time.perf_counter() - start)
+            except Exception:
+                logger.exception("Live ingestion from %r failed", source)
+        time.sleep(POLL_SECONDS)
+
+
+def start_live_feed(store, path=DATA_PATH):
+    """Start the background thread feeding ``store``, once per process.
+
+    ``path`` is the CSV the store was loaded from.  Does nothing unless
+    ``live_enabled()``.
+    """
+    if not live_enabled():
+        return
+    with _lock:
+        if path in _feeds:
+            return
+        sources = []
+        if os.environ.get('AIR_QUALITY_LIVE', '').lower() == 'tail':
+            # From where the store's load stopped, so lines appended while it
+            # was being built are not lost
+            sources.append(CsvTail(path, loaded_size(path)))
+        if os.environ.get('AIR_QUALITY_WATCH_DIR'):
+            sources.append(DropDirectory(os.environ['AIR_QUALITY_WATCH_DIR']))
+        thread = threading.Thread(target=_run, args=(store, sources), name='air-quality-live-feed', daemon=True)
+        thread.start()
+        _feeds[path] = thread
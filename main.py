@@ -0,0 +1,13 @@
+"""Entry point of the dashboard as a Bokeh directory-format application.
+
+``bokeh serve --show .`` runs this script for every browser session, and
+loads the hooks in ``server_lifecycle.py`` once per server process, so the
+aggregate store is built before the first session is accepted.  The
+dashboard itself is ``dashboard.py``, which can still be served on its own
+(``bokeh serve --show dashboard.py``) without the hooks.
+"""
+import os
+import runpy
+
+
+runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dashboard.py'))
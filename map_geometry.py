@@ -0,0 +1,60 @@
+"""World geometry and per-year country values for the map tab.
+
+The map used to merge the shapefile with the yearly averages and serialise
+the result to GeoJSON on every slider tick.  Here the country outlines are
+simplified and turned into Bokeh ``patches`` coordinates once per process,
+and the value of every (year, measure) pair is precomputed as a vector in
+the same country order, so a map update only swaps value columns.
+"""
+import geopandas as gpd
+import numpy as np
+
+
+# Simplification tolerance in degrees: well below a pixel at the map's
+# default world extent, and it removes most vertices of the 1:110m outlines.
+SIMPLIFY_TOLERANCE = 0.05
+MAP_CRS = 'EPSG:4326'
+
+
+def _polygon_rings(geometry):
+    if geometry is None or geometry.is_empty:
+        return []
+    polygons = getattr(geometry, 'geoms', [geometry])
+    return [np.asarray(polygon.exterior.coords) for polygon in polygons]
+
+
+def load_world_patches(shapefile_path, tolerance=SIMPLIFY_TOLERANCE):
+    """Return ``NAME``, ``xs`` and ``ys`` columns for a ``patches`` glyph.
+
+    Outlines are projected to the map's lon/lat CRS and simplified; the
+    parts of a multi-polygon country are joined with NaN separators, which
+    ``patches`` draws as one glyph.
+    """
+    world = gpd.read_file(shapefile_path)
+    if world.crs is not None and world.crs != MAP_CRS:
+        world = world.to_crs(MAP_CRS)
+    geometries = world.geometry.simplify(tolerance, preserve_topology=True)
+
+    xs, ys = [], []
+    for geometry in geometries:
+        rings = _polygon_rings(geometry)
+        separator = np.array([[np.nan, np.nan]])
+        coords = np.concatenate([part for ring in rings for part in (ring, separator)][:-1]) if rings else np.empty((0, 2))
+        xs.append(coords[:, 0])
+        ys.append(coords[:, 1])
+    return {'NAME': world['NAME'].tolist(), 'xs': xs, 'ys': ys}
+
+
+def country_value_vectors(map_data, names, measures):
+    """Map ``(year, measure)`` to that year's values in ``names`` order.
+
+    Countries without data for the year are NaN.
+    """
+    vectors = {}
+    for measure in measures:
+        table = map_data.pivot(index='Country', columns='Year', values=measure)
+        table.index = table.index.astype(object)
+        values = table.reindex(names).to_numpy(dtype='float64')
+        for i, year in enumerate(table.columns):
+            vectors[(int(year), measure)] = values[:, i]
+    return vectors
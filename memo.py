@@ -0,0 +1,87 @@
+"""Process-wide memoisation of widget callback results.
+
+Users flip back and forth between the same selections, and every session
+asks for the same handful of them.  ``memoized`` caches what a callback
+computes from the aggregate store (the column dicts, factor lists and
+colour ranges it pushes to Bokeh) in one bounded LRU shared by every
+session of the process, keyed on a name and the normalised widget values.
+
+``dashboard.py`` is re-executed per session, so the functions it decorates
+are new objects every time: the cache is keyed on the explicit ``name``,
+never on the function.  Pass ``store.version`` as an argument so results
+computed before a live append are never served after it; they age out of
+the LRU.
+
+``AIR_QUALITY_MEMO_SIZE`` sets the number of results kept (default 512,
+``0`` disables caching).  Cached results are shared and must be treated as
+read-only.  The cache's counters are logged as each session closes (see
+``log_cache_info``).
+"""
+import collections
+import functools
+import logging
+import os
+import threading
+
+
+MEMO_SIZE = int(os.environ.get('AIR_QUALITY_MEMO_SIZE', '512'))
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Bounded mapping evicting the least recently used entry, with hit/miss counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # Computed outside the lock; two sessions missing the same key at
+        # once both compute it and the second result wins
+        value = compute()
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def info(self):
+        """``{'hits', 'misses', 'size', 'maxsize'}`` of the cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+callback_cache = LRUCache(MEMO_SIZE)
+
+
+def log_cache_info(session_context):
+    """Log the shared callback cache's counters; registered with ``on_session_destroyed``."""
+    logger.info("Callback cache: %(hits)d hits, %(misses)d misses, %(size)d/%(maxsize)d entries", callback_cache.info())
+
+
+def memoized(name, cache=callback_cache):
+    """Decorate a function of hashable positional arguments to cache its results under ``name``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            return cache.get_or_compute((name,) + args, lambda: func(*args))
+        wrapper.cache = cache
+        return wrapper
+    return decorate
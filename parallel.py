@@ -0,0 +1,52 @@
+"""Partitioned, multi-process building of the startup aggregates.
+
+The frame is split into partitions of whole years, each partition is
+aggregated in a worker process, and the partial results are merged.  Every
+aggregate keyed by year or date — the cube cells, the daily tables — is
+disjoint across such partitions, so merging them is a concatenation.
+
+``AIR_QUALITY_WORKERS`` sets the number of worker processes (default: one
+per CPU).  Frames smaller than ``PARALLEL_MIN_ROWS`` are aggregated in the
+calling process, where the cost of shipping partitions to workers would
+outweigh the gain.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+WORKERS = int(os.environ.get('AIR_QUALITY_WORKERS') or os.cpu_count() or 1)
+PARALLEL_MIN_ROWS = 250_000
+PARTITION_KEY = 'Year'
+
+
+def partition(frame, parts, key=PARTITION_KEY):
+    """Split ``frame`` into at most ``parts`` frames of whole ``key`` values.
+
+    Values are assigned largest first to the partition with the fewest rows
+    so far, which keeps the partitions close in size.
+    """
+    sizes = frame[key].value_counts(sort=True)
+    loads = [0] * min(parts, len(sizes))
+    members = [[] for _ in loads]
+    for value, size in sizes.items():
+        lightest = loads.index(min(loads))
+        members[lightest].append(value)
+        loads[lightest] += size
+    if len(members) <= 1:
+        return [frame]
+    return [frame[frame[key].isin(values)] for values in members]
+
+
+def map_partitions(func, frame, workers=None):
+    """``[func(part) for part in partition(frame, workers)]``, in worker processes.
+
+    ``func`` must be a module-level function (it is pickled by name).
+    """
+    workers = WORKERS if workers is None else workers
+    if workers <= 1 or len(frame) < PARALLEL_MIN_ROWS:
+        return [func(frame)]
+    parts = partition(frame, workers)
+    if len(parts) == 1:
+        return [func(frame)]
+    with ProcessPoolExecutor(max_workers=len(parts)) as pool:
+        return list(pool.map(func, parts))
@@ -0,0 +1,148 @@
+"""Debug profiling of individual sessions: the document build and every callback.
+
+``AIR_QUALITY_PROFILE=1`` profiles every session; ``AIR_QUALITY_PROFILE=url``
+profiles only sessions opened with ``?profile=1`` in the URL, e.g.
+``http://localhost:5006/dashboard?profile=1``.  Profiling is off otherwise,
+so a URL alone can never turn it on.
+
+Each profiled run — the script building the session's document, then each
+handler call — writes two files to
+``<AIR_QUALITY_PROFILE_DIR>/<session id>/<seq>-<callback>``, with any
+character of the session id other than letters, digits, ``_`` and ``-``
+replaced by ``_``:
+
+* ``.pstats``: a ``cProfile`` dump, for ``python -m pstats`` or snakeviz;
+* ``.collapsed``: stacks sampled every ``AIR_QUALITY_PROFILE_INTERVAL``
+  seconds by a helper thread, one ``frame;frame;frame count`` line per
+  distinct stack, for flamegraph.pl or speedscope.
+
+Both run at once, so the sampled stacks include cProfile's overhead.  Calls
+shorter than the interval may have no samples.  Handlers that call other
+handlers directly are profiled as part of the outer one.
+"""
+import collections
+import cProfile
+import functools
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+
+PROFILE_MODE = os.environ.get('AIR_QUALITY_PROFILE', '').lower()
+PROFILE_DIR = os.environ.get('AIR_QUALITY_PROFILE_DIR', 'profiles')
+SAMPLE_INTERVAL = float(os.environ.get('AIR_QUALITY_PROFILE_INTERVAL', '0.005'))
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Collapsed stacks of one thread, sampled from a helper thread."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='air-quality-profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+
+class SessionProfiler:
+    """Profiles one session's document build (``start``/``stop``) and handlers (``wrap``)."""
+
+    def __init__(self, session_id, directory=PROFILE_DIR):
+        # Clients can choose their session id: keep it to one safe path component
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9_-]', '_', session_id) or 'session')
+        self.runs = 0
+        self._current = None
+
+    def start(self, name):
+        """Start profiling run ``name``; ignored while another run is in progress."""
+        if self._current is not None:
+            return False
+        profile = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident())
+        self._current = (name, profile, sampler, time.perf_counter())
+        sampler.start()
+        profile.enable()
+        return True
+
+    def stop(self):
+        """Stop the current run and write its ``.pstats`` and ``.collapsed`` files."""
+        name, profile, sampler, start = self._current
+        profile.disable()
+        counts = sampler.stop()
+        elapsed = time.perf_counter() - start
+        self._current = None
+
+        self.runs += 1
+        stem = os.path.join(self.directory, f'{self.runs:04d}-{name}')
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(stem + '.pstats')
+            with open(stem + '.collapsed', 'w') as handle:
+                for stack, count in counts.most_common():
+                    handle.write(f'{stack} {count}\n')
+        except OSError as exc:
+            logger.warning("Could not write profile %s: %s", stem, exc)
+            return
+        logger.info("Profiled %s in %.1f ms (%d samples): %s.{pstats,collapsed}",
+                    name, elapsed * 1000, sum(counts.values()), stem)
+
+    def wrap(self, func, name=None):
+        """``func`` profiled as run ``name`` (its own name by default) on every call."""
+        name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            if not self.start(name):
+                return func(*args)
+            try:
+                return func(*args)
+            finally:
+                self.stop()
+        return wrapper
+
+
+def _requested(doc):
+    if PROFILE_MODE in ('1', 'true', 'yes'):
+        return True
+    if PROFILE_MODE != 'url' or doc.session_context is None:
+        return False
+    request = doc.session_context.request
+    value = request.arguments.get('profile', [b''])[0] if request is not None else b''
+    return value.decode(errors='replace').lower() in ('1', 'true', 'yes')
+
+
+def session_profiler(doc):
+    """A ``SessionProfiler`` for ``doc``'s session if profiling is on for it, else ``None``."""
+    if not _requested(doc):
+        return None
+    session_id = doc.session_context.id if doc.session_context is not None else f'script-{os.getpid()}'
+    profiler = SessionProfiler(session_id)
+    logger.info("Profiling session %s to %s", session_id, profiler.directory)
+    return profiler
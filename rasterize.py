@@ -0,0 +1,55 @@
+"""Server-side density rasterisation for scatter plots.
+
+Instead of sending a sample of points to the browser, ``density_image``
+bins every row into a fixed grid of pixels covering the visible ranges and
+returns the count and the mean of a value per pixel.  The payload is the
+size of the grid, however many rows there are.
+"""
+import numpy as np
+
+
+def density_image(x, y, values, x_range, y_range, shape):
+    """Bin ``(x, y)`` points into a ``shape = (rows, cols)`` grid.
+
+    ``x_range`` and ``y_range`` are ``(start, end)`` pairs; points outside
+    them, or with a missing coordinate, are ignored.  Returns ``(counts,
+    means)`` as float32 arrays indexed ``[row, col]`` with row 0 at
+    ``y_range[0]`` (the orientation Bokeh's ``image`` glyph expects).
+    Empty pixels are NaN in both, so they render transparent.
+    """
+    return density_image_chunks([(x, y, values)], x_range, y_range, shape)
+
+
+def density_image_chunks(chunks, x_range, y_range, shape):
+    """``density_image`` of the points in ``chunks``, an iterable of ``(x, y, values)``.
+
+    Only per-pixel totals are kept between chunks, so the points never have
+    to be in memory at once.
+    """
+    rows, cols = shape
+    x0, x1 = x_range
+    y0, y1 = y_range
+    if not (x1 > x0 and y1 > y0):
+        empty = np.full(shape, np.nan, dtype='float32')
+        return empty, empty.copy()
+
+    counts = np.zeros(rows * cols, dtype='int64')
+    value_counts = np.zeros(rows * cols, dtype='int64')
+    sums = np.zeros(rows * cols, dtype='float64')
+    for x, y, values in chunks:
+        col = np.floor((x - x0) * (cols / (x1 - x0)))
+        row = np.floor((y - y0) * (rows / (y1 - y0)))
+        inside = (col >= 0) & (col < cols) & (row >= 0) & (row < rows)  # NaN compares False
+        flat = row[inside].astype('int64') * cols + col[inside].astype('int64')
+
+        counts += np.bincount(flat, minlength=rows * cols)
+        weights = np.asarray(values)[inside]
+        present = ~np.isnan(weights)
+        value_counts += np.bincount(flat[present], minlength=rows * cols)
+        sums += np.bincount(flat[present], weights=weights[present], minlength=rows * cols)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums / value_counts).astype('float32')
+    counts = counts.astype('float32')
+    counts[counts == 0] = np.nan
+    return counts.reshape(shape), means.reshape(shape)
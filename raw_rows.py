@@ -0,0 +1,128 @@
+"""Raw measurement rows for the views that need every reading.
+
+Every tab but the scatter's density mode is drawn from aggregates; only
+that view reads individual rows.  ``FrameRows`` serves them from the
+in-memory frame and the live batches kept beside it.  ``ArrowRows`` serves them from Arrow IPC part files on
+disk, written one load chunk at a time and memory-mapped one part at a
+time when read, so the rows never have to fit in memory.
+
+Both yield the requested columns chunk by chunk from ``iter_columns``, and
+``append`` returns the object to use once live rows have been added.
+"""
+import glob
+import logging
+import os
+
+import numpy as np
+
+from data_loader import concat_measurements
+from instrumentation import count_rows
+from row_index import RowIndex
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - the on-disk store is optional
+    pa = None
+
+
+# Directory for the on-disk raw rows of a chunked load; unset keeps none
+RAW_STORE_DIR = os.environ.get('AIR_QUALITY_RAW_STORE')
+
+logger = logging.getLogger(__name__)
+
+
+class FrameRows:
+    """Rows of in-memory frames, sliced by city through a ``RowIndex`` per frame.
+
+    The loaded frame is the first part and every batch of live rows is
+    appended as another, indexed on its own, so an append sorts only the
+    new rows.  A part is merged into the one before it once that one is no
+    more than twice its size, which keeps the number of parts logarithmic
+    in the rows appended.
+    """
+
+    in_memory = True
+
+    def __init__(self, frame):
+        self.parts = [_indexed(frame)]
+
+    def __len__(self):
+        return sum(len(frame) for frame, _ in self.parts)
+
+    def iter_columns(self, names, cities=None):
+        """Yield ``[array per name]`` for the rows of ``cities`` (every row if ``None``), one part at a time."""
+        for frame, city_index in self.parts:
+            if cities is None:
+                count_rows(len(frame))
+                yield [frame[name].to_numpy() for name in names]
+                continue
+            positions = np.concatenate([city_index.positions(city) for city in cities] or [np.empty(0, dtype='int64')])
+            yield [frame[name].to_numpy()[positions] for name in names]
+
+    def append(self, rows):
+        """A ``FrameRows`` with ``rows`` added; ``self`` is left unchanged for its readers."""
+        parts = self.parts + [_indexed(rows.reset_index(drop=True))]
+        while len(parts) > 1 and len(parts[-2][0]) <= 2 * len(parts[-1][0]):
+            (older, _), (newer, _) = parts[-2:]
+            parts[-2:] = [_indexed(concat_measurements(older, newer))]
+        appended = FrameRows.__new__(FrameRows)
+        appended.parts = parts
+        return appended
+
+
+def _indexed(frame):
+    return frame, RowIndex(frame, ['City'])
+
+
+class ArrowRows:
+    """Rows kept as Arrow IPC part files in ``directory``.
+
+    Any parts left in ``directory`` by an earlier process are removed: the
+    store is rebuilt by every chunked load.
+    """
+
+    in_memory = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(os.path.join(directory, 'part-*.arrow')):
+            os.remove(stale)
+        self.parts = []
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, rows):
+        """Write ``rows`` as a new part file and return ``self``."""
+        path = os.path.join(self.directory, f'part-{len(self.parts):06d}.arrow')
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        tmp_path = path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, path)
+        self.parts = self.parts + [path]  # Readers iterate the old list undisturbed
+        self.rows += len(rows)
+        return self
+
+    def iter_columns(self, names, cities=None):
+        """Yield ``[array per name]`` for the rows of ``cities``, one part at a time."""
+        wanted = None if cities is None else pa.array([str(city) for city in cities], type=pa.string())
+        for path in self.parts:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            count_rows(table.num_rows)
+            if wanted is not None:
+                table = table.filter(pc.is_in(table['City'].cast(pa.string()), value_set=wanted))
+            yield [table[name].to_numpy() for name in names]
+
+
+def open_raw_store():
+    """``ArrowRows`` in ``RAW_STORE_DIR``, or ``None`` if unset or pyarrow is missing."""
+    if not RAW_STORE_DIR:
+        return None
+    if pa is None:
+        logger.warning("AIR_QUALITY_RAW_STORE is set but pyarrow is not installed; raw rows are not kept")
+        return None
+    return ArrowRows(RAW_STORE_DIR)
@@ -0,0 +1,71 @@
+"""Offset-table index for slicing a frame by key columns.
+
+Widget callbacks used to filter with boolean masks such as
+``frame[(frame['City'] == city) & (frame['Year'] == year)]``, a full scan
+per change.  ``RowIndex`` sorts the row positions once by the key columns
+and records where every distinct key — and every key prefix — starts and
+stops in that order, so a lookup is a dictionary hit plus an O(k) take of
+the matching rows.
+"""
+import numpy as np
+import pandas as pd
+
+from instrumentation import count_rows
+
+
+class RowIndex:
+    """Contiguous row ranges of ``frame`` for every value of ``keys``.
+
+    ``rows(*key)`` accepts the full key or any leading prefix of it, e.g.
+    ``RowIndex(frame, ['City', 'Year']).rows('Delhi')`` returns every Delhi
+    row and ``.rows('Delhi', 2020)`` only those from 2020.
+    """
+
+    def __init__(self, frame, keys):
+        self.frame = frame
+        self.key_columns = list(keys)
+
+        codes, uniques = [], []
+        for key in self.key_columns:
+            column = frame[key]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                level_codes, level_uniques = column.cat.codes.to_numpy(), column.cat.categories
+            else:
+                level_codes, level_uniques = pd.factorize(column, sort=True)
+            codes.append(level_codes)
+            # Missing values have code -1, which picks the trailing None
+            uniques.append(np.append(np.asarray(level_uniques, dtype=object), None))
+
+        # np.lexsort sorts by the last key first
+        self.order = np.lexsort(codes[::-1]) if len(frame) else np.empty(0, dtype='int64')
+        sorted_codes = [level_codes[self.order] for level_codes in codes]
+
+        self._offsets = {}
+        changed = np.zeros(len(frame), dtype=bool)
+        if len(frame):
+            changed[0] = True
+        for depth, level_codes in enumerate(sorted_codes, start=1):
+            changed[1:] |= level_codes[1:] != level_codes[:-1]
+            starts = np.flatnonzero(changed)
+            stops = np.append(starts[1:], len(frame))
+            labels = zip(*(uniques[i][sorted_codes[i][starts]].tolist() for i in range(depth)))
+            self._offsets.update(zip(labels, zip(starts.tolist(), stops.tolist())))
+
+    def span(self, *key):
+        """``(start, stop)`` of ``key`` in the sorted order, or ``(0, 0)``."""
+        return self._offsets.get(tuple(key), (0, 0))
+
+    def positions(self, *key):
+        """Row positions in ``frame`` matching ``key``, in sorted key order."""
+        start, stop = self.span(*key)
+        count_rows(stop - start)
+        return self.order[start:stop]
+
+    def rows(self, *key):
+        """Rows of ``frame`` matching ``key`` (or a leading prefix of it)."""
+        return self.frame.take(self.positions(*key))
+
+    def labels(self, *prefix):
+        """Distinct values of the key level following ``prefix``, in index order."""
+        depth = len(prefix) + 1
+        return [key[-1] for key in self._offsets if len(key) == depth and key[:-1] == tuple(prefix)]
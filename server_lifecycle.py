@@ -0,0 +1,26 @@
+"""Bokeh server lifecycle hooks.
+
+Bokeh runs these for directory-format applications (``bokeh serve .``,
+see ``main.py``).  Building the aggregate store in ``on_server_loaded``
+means the first browser session does not pay for loading the data; with
+``bokeh serve dashboard.py`` the same store is built by the first session
+instead and reused by all later ones.  The live feed and the metrics
+endpoint, if configured, are started alongside the store.
+"""
+import logging
+import time
+
+from aggregates import get_store
+from instrumentation import start_metrics_server
+from live_feed import start_live_feed
+
+
+logger = logging.getLogger(__name__)
+
+
+def on_server_loaded(server_context):
+    start = time.perf_counter()
+    store = get_store()
+    logger.info("Aggregate store ready (%d rows) in %.1fs", store.row_count, time.perf_counter() - start)
+    start_live_feed(store)
+    start_metrics_server()
@@ -0,0 +1,185 @@
+"""Mergeable quantile sketches for the aggregate cube.
+
+``TDigest`` is a small numpy implementation of Dunning's t-digest using the
+k1 scale function: sorted values are grouped into centroids whose size
+shrinks towards the tails, so extreme quantiles stay accurate while the
+sketch size is bounded by roughly ``compression / 2`` centroids.  Digests of
+disjoint data merge into a digest of the union, which is what lets the cube
+roll a month up to a year or a city up to a country without raw rows.
+"""
+import numpy as np
+
+
+DEFAULT_COMPRESSION = 200
+
+
+class TDigest:
+    """Centroid means/weights plus the exact minimum and maximum."""
+
+    __slots__ = ('means', 'weights', 'min', 'max')
+
+    def __init__(self, means, weights, min_value, max_value):
+        self.means = means
+        self.weights = weights
+        self.min = min_value
+        self.max = max_value
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0), np.empty(0), np.nan, np.nan)
+
+    @classmethod
+    def from_values(cls, values, compression=DEFAULT_COMPRESSION):
+        values = np.asarray(values, dtype='float64')
+        values = np.sort(values[~np.isnan(values)])
+        if not len(values):
+            return cls.empty()
+        return cls._from_sorted(values, np.ones(len(values)), compression)
+
+    @classmethod
+    def from_groups(cls, values, codes, n_groups, compression=DEFAULT_COMPRESSION):
+        """One digest per group of ``values``, built in a single vectorised pass.
+
+        ``codes`` gives the group (``0 .. n_groups - 1``) of every value.  The
+        result is the list of ``from_values`` digests of each group, but every
+        group is sorted and clustered at once by a lexsort instead of a
+        Python loop over the groups.
+        """
+        values = np.asarray(values, dtype='float64')
+        codes = np.asarray(codes, dtype='int64')
+        present = ~np.isnan(values)
+        values, codes = values[present], codes[present]
+        # Sort by value, then stably by group: the same order as
+        # lexsort((values, codes)), but the group pass is a radix sort on
+        # codes narrowed to the smallest integer type that holds them
+        order = np.argsort(values)
+        order = order[np.argsort(codes[order].astype(np.min_scalar_type(max(n_groups - 1, 0))), kind='stable')]
+        values, codes = values[order], codes[order]
+
+        sizes = np.bincount(codes, minlength=n_groups)
+        starts = np.cumsum(sizes) - sizes
+        # Same k1 clustering as _from_sorted, with each group's ranks restarting at 0
+        rank = np.arange(len(values)) - starts[codes]
+        scale = compression / (2 * np.pi)
+        k = scale * np.arcsin(2 * ((rank + 0.5) / sizes[codes]) - 1)
+        k_first = scale * np.arcsin(2 * (0.5 / np.maximum(sizes, 1)) - 1)
+        cluster = np.floor(k - k_first[codes]).astype('int64')
+
+        # (group, cluster) is non-decreasing in this order, so a new centroid
+        # starts wherever either changes
+        new_centroid = np.ones(len(values), dtype=bool)
+        new_centroid[1:] = (codes[1:] != codes[:-1]) | (cluster[1:] != cluster[:-1])
+        centroid = np.cumsum(new_centroid) - 1
+        weights = np.bincount(centroid).astype('float64')
+        means = np.bincount(centroid, weights=values) / weights
+        bounds = np.searchsorted(codes[new_centroid], np.arange(n_groups + 1))
+
+        digests = []
+        for group in range(n_groups):
+            if not sizes[group]:
+                digests.append(cls.empty())
+                continue
+            lo, hi = bounds[group], bounds[group + 1]
+            first = starts[group]
+            digests.append(cls(means[lo:hi], weights[lo:hi], values[first], values[first + sizes[group] - 1]))
+        return digests
+
+    @classmethod
+    def merge(cls, digests, compression=DEFAULT_COMPRESSION):
+        """Combine digests of disjoint data into one."""
+        digests = [d for d in digests if d.count]
+        if not digests:
+            return cls.empty()
+        if len(digests) == 1:
+            return digests[0]
+        means = np.concatenate([d.means for d in digests])
+        weights = np.concatenate([d.weights for d in digests])
+        order = np.argsort(means, kind='stable')
+        digest = cls._from_sorted(means[order], weights[order], compression)
+        digest.min = min(d.min for d in digests)
+        digest.max = max(d.max for d in digests)
+        return digest
+
+    @classmethod
+    def merge_groups(cls, digests, codes, n_groups, compression=DEFAULT_COMPRESSION):
+        """``merge`` of the digests in each group, every group clustered in one pass.
+
+        ``codes`` gives the group (``0 .. n_groups - 1``) of every digest.
+        The result is the list of ``merge`` results per group, computed like
+        ``from_groups`` with one lexsort instead of a Python loop.
+        """
+        codes = np.asarray(codes, dtype='int64')
+        sizes = np.fromiter((len(d.weights) for d in digests), dtype='int64', count=len(digests))
+        members = np.bincount(codes[sizes > 0], minlength=n_groups)
+        merged = [None] * n_groups
+        for i in np.flatnonzero((sizes > 0) & (members[codes] == 1)).tolist():
+            merged[codes[i]] = digests[i]  # A digest merged with nothing is unchanged
+
+        # Centroids of every digest in a group of two or more, sorted by
+        # group and then by mean
+        many = np.flatnonzero((sizes > 0) & (members[codes] > 1))
+        if len(many):
+            groups = np.repeat(codes[many], sizes[many])
+            means = np.concatenate([digests[i].means for i in many])
+            weights = np.concatenate([digests[i].weights for i in many])
+            order = np.lexsort((means, groups))
+            groups, means, weights = groups[order], means[order], weights[order]
+
+            # Same k1 clustering as _from_sorted, with each group's cumulative
+            # weight restarting at 0
+            starts = np.searchsorted(groups, np.arange(n_groups))
+            cumulative = np.cumsum(weights)
+            offsets = np.zeros(n_groups)
+            offsets[members > 1] = (cumulative - weights)[starts[members > 1]]
+            totals = np.bincount(groups, weights=weights, minlength=n_groups)
+            q = (cumulative - offsets[groups] - weights / 2) / totals[groups]
+            k = compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+            k_first = np.zeros(n_groups)
+            k_first[members > 1] = k[starts[members > 1]]
+            cluster = np.floor(k - k_first[groups]).astype('int64')
+
+            new_centroid = np.ones(len(means), dtype=bool)
+            new_centroid[1:] = (groups[1:] != groups[:-1]) | (cluster[1:] != cluster[:-1])
+            centroid = np.cumsum(new_centroid) - 1
+            new_weights = np.bincount(centroid, weights=weights)
+            new_means = np.bincount(centroid, weights=means * weights) / new_weights
+            bounds = np.searchsorted(groups[new_centroid], np.arange(n_groups + 1))
+
+            mins, maxs = np.full(n_groups, np.inf), np.full(n_groups, -np.inf)
+            np.minimum.at(mins, codes[many], [digests[i].min for i in many])
+            np.maximum.at(maxs, codes[many], [digests[i].max for i in many])
+            for group in np.flatnonzero(members > 1).tolist():
+                lo, hi = bounds[group], bounds[group + 1]
+                merged[group] = cls(new_means[lo:hi], new_weights[lo:hi], mins[group], maxs[group])
+        return [digest if digest is not None else cls.empty() for digest in merged]
+
+    @classmethod
+    def _from_sorted(cls, means, weights, compression):
+        total = weights.sum()
+        cumulative = np.cumsum(weights)
+        # Cluster index of each point: floor of the k1 scale at its mid-rank
+        q = (cumulative - weights / 2) / total
+        k = compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        cluster = np.floor(k - k[0]).astype('int64')
+        _, cluster = np.unique(cluster, return_inverse=True)
+        new_weights = np.bincount(cluster, weights=weights)
+        new_means = np.bincount(cluster, weights=means * weights) / new_weights
+        return cls(new_means, new_weights, means[0], means[-1])
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def quantile(self, q):
+        """Estimate the ``q`` quantile(s), interpolating like ``pandas.Series.quantile``.
+
+        Centroid ``i`` sits at the rank of its middle value, so a digest of
+        singleton centroids reproduces pandas' linear interpolation exactly.
+        """
+        if not self.count:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        cumulative = np.cumsum(self.weights)
+        centers = cumulative - (self.weights + 1) / 2
+        ranks = np.concatenate([[0.0], centers, [cumulative[-1] - 1]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(q) * (cumulative[-1] - 1), ranks, values)
@@ -0,0 +1,221 @@
+"""Synthetic air quality measurements with the dashboard's CSV schema.
+
+Rows have exactly the columns ``data_loader`` reads — ``Date`` as
+dd-mm-yyyy, ``Country``, ``City``, ``AQI`` and the six pollutants — with
+country names taken from the Natural Earth ``NAME`` field, so the map tab
+joins them.  Each city has its own pollution level; particulates, NO2, SO2
+and CO peak in the local winter and ozone in the local summer, levels drift
+down slowly from year to year, and AQI is derived from PM2.5 and PM10 on
+the US EPA breakpoints.
+
+Rows are generated in fixed blocks, each from its own seeded random stream,
+so the same ``seed`` gives the same rows whatever the chunk size, and any
+number of rows can be written without holding more than a chunk::
+
+    python synthetic_data.py 100M expanded_air_quality_data.csv --seed 7
+    python synthetic_data.py 1M measurements.arrow --start 2015-01-01
+
+``.arrow`` output (Arrow IPC, requires pyarrow) stores ``Date`` as a date,
+the labels dictionary-encoded and the measurements as float32.  CSV output
+uses pyarrow's writer when it is installed and pandas' otherwise.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATE_FORMAT
+
+
+COLUMNS = ['Date', 'Country', 'City', 'AQI', 'PM2.5', 'PM10', 'CO', 'NO2', 'SO2', 'Ozone']
+BLOCK_ROWS = 1 << 16
+CHUNK_ROWS = 1_000_000
+
+# Natural Earth NAME -> (cities, southern hemisphere, pollution level)
+COUNTRIES = {
+    'India': (['Delhi', 'Mumbai', 'Kolkata', 'Chennai', 'Bengaluru'], False, 2.6),
+    'China': (['Beijing', 'Shanghai', 'Chengdu', 'Guangzhou', 'Wuhan'], False, 2.1),
+    'Pakistan': (['Lahore', 'Karachi'], False, 2.5),
+    'Bangladesh': (['Dhaka'], False, 2.4),
+    'Egypt': (['Cairo', 'Alexandria'], False, 1.9),
+    'Nigeria': (['Lagos', 'Kano'], False, 1.8),
+    'Indonesia': (['Jakarta', 'Surabaya'], True, 1.5),
+    'Vietnam': (['Hanoi', 'Ho Chi Minh City'], False, 1.5),
+    'Thailand': (['Bangkok'], False, 1.3),
+    'Iran': (['Tehran'], False, 1.6),
+    'Turkey': (['Istanbul', 'Ankara'], False, 1.2),
+    'Saudi Arabia': (['Riyadh'], False, 1.7),
+    'Mexico': (['Mexico City', 'Guadalajara'], False, 1.3),
+    'Brazil': (['Sao Paulo', 'Rio de Janeiro'], True, 0.9),
+    'Chile': (['Santiago'], True, 1.0),
+    'Peru': (['Lima'], True, 1.1),
+    'Russia': (['Moscow', 'Saint Petersburg'], False, 0.9),
+    'Poland': (['Warsaw', 'Krakow'], False, 1.0),
+    'Italy': (['Milan', 'Rome'], False, 0.8),
+    'Spain': (['Madrid', 'Barcelona'], False, 0.6),
+    'France': (['Paris', 'Lyon'], False, 0.6),
+    'Germany': (['Berlin', 'Munich'], False, 0.6),
+    'United Kingdom': (['London', 'Manchester'], False, 0.6),
+    'United States of America': (['New York', 'Los Angeles', 'Chicago', 'Houston'], False, 0.5),
+    'Canada': (['Toronto', 'Vancouver'], False, 0.4),
+    'Japan': (['Tokyo', 'Osaka'], False, 0.6),
+    'South Korea': (['Seoul', 'Busan'], False, 0.9),
+    'South Africa': (['Johannesburg', 'Cape Town'], True, 1.0),
+    'Kenya': (['Nairobi'], True, 0.9),
+    'Australia': (['Sydney', 'Melbourne'], True, 0.4),
+}
+
+# Pollutant -> (level at pollution level 1, seasonal amplitude, peaks in winter)
+POLLUTANTS = {
+    'PM2.5': (25.0, 0.45, True),   # µg/m³
+    'PM10': (50.0, 0.35, True),    # µg/m³
+    'CO': (0.8, 0.30, True),       # ppm
+    'NO2': (22.0, 0.25, True),     # ppb
+    'SO2': (6.0, 0.30, True),      # ppb
+    'Ozone': (32.0, 0.35, False),  # ppb
+}
+YEARLY_DRIFT = -0.02  # Relative change in every level per year
+NOISE_SIGMA = 0.35  # Day-to-day lognormal noise
+
+# US EPA breakpoints: concentration -> AQI, interpolated linearly
+AQI_LEVELS = [0, 50, 100, 150, 200, 300, 400, 500]
+PM25_BREAKPOINTS = [0.0, 12.0, 35.4, 55.4, 150.4, 250.4, 350.4, 500.4]
+PM10_BREAKPOINTS = [0.0, 54.0, 154.0, 254.0, 354.0, 424.0, 504.0, 604.0]
+
+
+def _cities():
+    rows = [
+        (code, city, southern, level)
+        for code, (cities, southern, level) in enumerate(COUNTRIES.values()) for city in cities
+    ]
+    return pd.DataFrame(rows, columns=['country_code', 'City', 'southern', 'level'])
+
+
+def _block(index, seed, cities, city_factors, days, day_labels, start_year):
+    """Rows of block ``index``: every block has its own random stream."""
+    rng = np.random.default_rng([seed, index])
+    which = rng.integers(0, len(cities), BLOCK_ROWS)
+    day = rng.integers(0, len(days), BLOCK_ROWS)
+    dates = days[day]
+
+    # Day of the year shifted by half a year south of the equator, so
+    # "winter" is the local winter everywhere
+    day_of_year = (dates - dates.astype('datetime64[Y]')).astype('int64')
+    local_day = (day_of_year + np.where(cities['southern'].to_numpy()[which], 182, 0)) % 365
+    winter = np.cos(2 * np.pi * (local_day - 15) / 365)  # 1 in mid-January, -1 in mid-July
+    years = dates.astype('datetime64[Y]').astype('int64') + 1970 - start_year
+
+    block = {
+        'Date': day_labels[day],
+        'Country': pd.Categorical.from_codes(cities['country_code'].to_numpy()[which], categories=list(COUNTRIES)),
+        'City': pd.Categorical.from_codes(which, categories=cities['City']),
+    }
+    base = cities['level'].to_numpy()[which] * (1 + YEARLY_DRIFT) ** years
+    for i, (pollutant, (level, amplitude, winter_peak)) in enumerate(POLLUTANTS.items()):
+        season = 1 + amplitude * (winter if winter_peak else -winter)
+        noise = rng.lognormal(-NOISE_SIGMA ** 2 / 2, NOISE_SIGMA, BLOCK_ROWS)
+        block[pollutant] = (level * base * city_factors[which, i] * season * noise).astype('float32')
+    block['AQI'] = np.maximum(
+        np.interp(block['PM2.5'], PM25_BREAKPOINTS, AQI_LEVELS),
+        np.interp(block['PM10'], PM10_BREAKPOINTS, AQI_LEVELS),
+    ).astype('float32')
+    return pd.DataFrame(block, columns=COLUMNS)
+
+
+def generate_chunks(rows, seed=0, chunk_rows=CHUNK_ROWS, start='2019-01-01', end='2023-12-31'):
+    """Yield ``rows`` synthetic measurements as frames of at most ``chunk_rows`` rows.
+
+    Dates are uniform over ``start``..``end`` (inclusive).  The rows depend
+    only on ``rows``, ``seed`` and the date range, not on ``chunk_rows``.
+    """
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    day_labels = pd.DatetimeIndex(days).strftime(DATE_FORMAT).to_numpy(dtype=object)
+    cities = _cities()
+    # Fixed per-city, per-pollutant character, from the seed alone
+    city_factors = np.random.default_rng([seed, 2 ** 32 - 1]).lognormal(0, 0.25, (len(cities), len(POLLUTANTS)))
+    start_year = int(str(np.datetime64(start, 'Y')))
+
+    for offset in range(0, rows, chunk_rows):
+        stop = min(offset + chunk_rows, rows)
+        first, last = offset // BLOCK_ROWS, (stop - 1) // BLOCK_ROWS
+        blocks = [_block(i, seed, cities, city_factors, days, day_labels, start_year) for i in range(first, last + 1)]
+        chunk = pd.concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+        skip = offset - first * BLOCK_ROWS
+        yield chunk.iloc[skip:skip + stop - offset].reset_index(drop=True)
+
+
+def write_dataset(path, rows, seed=0, chunk_rows=CHUNK_ROWS, start='2019-01-01', end='2023-12-31'):
+    """Write ``rows`` synthetic measurements to ``path`` (``.csv`` or ``.arrow``), chunk by chunk."""
+    chunks = generate_chunks(rows, seed, chunk_rows, start, end)
+    tmp_path = path + '.tmp'
+    if path.endswith('.arrow'):
+        _write_arrow(tmp_path, chunks)
+    else:
+        _write_csv(tmp_path, chunks)
+    os.replace(tmp_path, path)
+
+
+def _write_csv(path, chunks):
+    # pyarrow's CSV writer is an order of magnitude faster than pandas'
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        pa = None
+    with open(path, 'wb') as handle:
+        handle.write((','.join(COLUMNS) + '\n').encode())
+        for chunk in chunks:
+            # Two decimals, written in their shortest form
+            chunk = chunk.astype({col: 'float64' for col in COLUMNS[3:]}).round(2)
+            if pa is None:
+                handle.write(chunk.to_csv(index=False, header=False).encode())
+            else:
+                options = pa_csv.WriteOptions(include_header=False, quoting_style='none')
+                pa_csv.write_csv(pa.Table.from_pandas(chunk, preserve_index=False), handle, options)
+
+
+def _write_arrow(path, chunks):
+    import pyarrow as pa
+
+    labels = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema(
+        [('Date', pa.date32()), ('Country', labels), ('City', labels)]
+        + [(col, pa.float32()) for col in COLUMNS[3:]]
+    )
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for chunk in chunks:
+            # Only the ~2000 distinct labels need parsing
+            codes, labels = pd.factorize(chunk['Date'])
+            dates = pd.to_datetime(labels, format=DATE_FORMAT).to_numpy().astype('datetime64[D]')[codes]
+            table = pa.Table.from_pandas(chunk.drop(columns='Date'), preserve_index=False)
+            table = table.add_column(0, 'Date', pa.array(dates, type=pa.date32()))
+            writer.write_table(table.cast(schema))
+
+
+def parse_rows(text):
+    """``'10k'`` -> 10000, ``'1M'`` -> 1000000, ``'1e6'`` -> 1000000."""
+    scale = {'k': 10 ** 3, 'm': 10 ** 6, 'g': 10 ** 9}.get(text[-1].lower())
+    return int(float(text[:-1]) * scale) if scale else int(float(text))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic air quality measurements.")
+    parser.add_argument('rows', type=parse_rows, help="number of rows, e.g. 20000, 10k, 50M")
+    parser.add_argument('path', help="output .csv or .arrow file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=parse_rows, default=CHUNK_ROWS)
+    parser.add_argument('--start', default='2019-01-01', help="first date (YYYY-MM-DD)")
+    parser.add_argument('--end', default='2023-12-31', help="last date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    write_dataset(args.path, args.rows, args.seed, args.chunk_rows, args.start, args.end)
+    print(f"Wrote {args.rows} rows to {args.path} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())